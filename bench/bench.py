@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Salt interpreter
+
+Usage: python3 bench/bench.py [--engine tree|closure|vm ...] [--parse] [--runs N] [--no-optimize]
+                              [--save FILE] [--compare BASELINE [--against RESULTS]] [--threshold FRACTION]
+                              [name ...]
+
+Each bench/*.salt workload is tokenized, parsed and run from scratch --runs
+times with its output thrown away, and the runner reports the median and p95
+wall-clock time plus the peak memory Python allocated during one more
+(traced) run. --save writes the results as a JSON baseline.
+
+--parse times the lexer and parser instead: each workload is repeated to at
+least PARSE_SIZE characters and only tokenized and parsed, reported as
+name/parse along with its throughput.
+
+--compare BASELINE runs the suite and compares it with a saved baseline;
+adding --against RESULTS compares two saved files without running
+anything. A benchmark whose median got slower by more than --threshold
+(default 0.10, so 10%) is a regression, and the exit status is 1 if there
+is any.
+"""
+
+import argparse
+import glob
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from interpreter import Interpreter, ENGINES
+from math_parser import Parser
+from salt_output import StreamSink
+from tokenizer import lex
+
+RUNS = 5
+THRESHOLD = 0.10  # Slowdown (as a fraction of the baseline median) that counts as a regression
+PARSE_SIZE = 1024 * 1024  # Characters of source each --parse benchmark parses
+
+
+def workloads(names=None):
+    """{name: source} for the bench/*.salt files, or just the named ones"""
+    found = {}
+    for path in sorted(glob.glob(os.path.join(BENCH_DIR, '*.salt'))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if not names or name in names:
+            with open(path) as f:
+                found[name] = f.read()
+    missing = set(names or ()) - set(found)
+    if missing:
+        raise ValueError(f"No such benchmark: {', '.join(sorted(missing))}")
+    return found
+
+
+def run_once(code, engine, optimize):
+    """Tokenize, parse and run a program on a fresh interpreter"""
+    tokens = lex(code)
+    parser = Parser(tokens)
+    interpreter = Interpreter(engine, optimize=optimize, output=StreamSink(io.StringIO()))
+    while parser.position < len(tokens):
+        statement = parser.parse_statement()
+        if statement is not None:
+            interpreter.execute(statement)
+
+
+def parse_once(code):
+    """Tokenize and parse a program without running it"""
+    for statement in Parser(lex(code)).statements():
+        pass
+
+
+def measure(code, engine, runs=RUNS, optimize=True):
+    """Times and peak memory for one workload; engine None only parses it"""
+    if engine is None:
+        run = lambda: parse_once(code)
+    else:
+        run = lambda: run_once(code, engine, optimize)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    # Memory gets its own run: tracing slows everything down
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    times.sort()
+    return {
+        'median': statistics.median(times),
+        'p95': times[max(0, math.ceil(0.95 * len(times)) - 1)],
+        'min': times[0],
+        'runs': runs,
+        'peak_memory': peak,
+    }
+
+
+def run_suite(engines, runs=RUNS, optimize=True, names=None, parse=False):
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'optimize': optimize,
+        'runs': runs,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'benchmarks': {},
+    }
+    for name, code in workloads(names).items():
+        if parse:
+            code = '\n'.join([code] * -(-PARSE_SIZE // (len(code) + 1)))
+            key = f"{name}/parse"
+            results['benchmarks'][key] = stats = measure(code, None, runs)
+            print(f"{key:<26} median {stats['median'] * 1000:9.2f} ms   p95 {stats['p95'] * 1000:9.2f} ms   "
+                  f"peak {stats['peak_memory'] / 1024:9.1f} KB   {len(code) / stats['median'] / 1e6:6.2f} MB/s")
+            continue
+        for engine in engines:
+            key = f"{name}/{engine}"
+            results['benchmarks'][key] = stats = measure(code, engine, runs, optimize)
+            print(f"{key:<26} median {stats['median'] * 1000:9.2f} ms   p95 {stats['p95'] * 1000:9.2f} ms   "
+                  f"peak {stats['peak_memory'] / 1024:9.1f} KB")
+    return results
+
+
+def compare(baseline, results, threshold=THRESHOLD):
+    """Print each benchmark's change in median time; returns the regressed ones"""
+    regressions = []
+    print(f"{'Benchmark':<26} {'Baseline':>11} {'Now':>11} {'Change':>8}")
+    for key, now in results['benchmarks'].items():
+        before = baseline['benchmarks'].get(key)
+        if before is None:
+            print(f"{key:<26} {'-':>11} {now['median'] * 1000:9.2f}ms      new")
+            continue
+        change = now['median'] / before['median'] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        elif change < -threshold:
+            flag = '  faster'
+        print(f"{key:<26} {before['median'] * 1000:9.2f}ms {now['median'] * 1000:9.2f}ms {change:+8.1%}{flag}")
+    if baseline.get('python') != results.get('python') or baseline.get('optimize') != results.get('optimize'):
+        print("Note: the runs used different Python versions or optimizer settings")
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the Salt interpreter")
+    arg_parser.add_argument('names', nargs='*', help="benchmarks to run (default: all of bench/*.salt)")
+    arg_parser.add_argument('--engine', dest='engines', action='append', choices=ENGINES,
+                            help="engine to run on; repeat for several (default: tree)")
+    arg_parser.add_argument('--parse', action='store_true',
+                            help="time tokenizing and parsing a large copy of each workload instead of running it")
+    arg_parser.add_argument('--runs', type=int, default=RUNS,
+                            help=f"timed runs per benchmark (default: {RUNS})")
+    arg_parser.add_argument('--no-optimize', dest='optimize', action='store_false',
+                            help="run the AST exactly as parsed")
+    arg_parser.add_argument('--save', metavar='FILE', help="write the results to FILE as JSON")
+    arg_parser.add_argument('--compare', metavar='BASELINE', help="compare with the results saved in BASELINE")
+    arg_parser.add_argument('--against', metavar='RESULTS',
+                            help="with --compare, compare BASELINE with RESULTS instead of running the suite")
+    arg_parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                            help=f"slowdown that counts as a regression (default: {THRESHOLD})")
+    args = arg_parser.parse_args()
+    if args.runs < 1:
+        arg_parser.error("--runs must be at least 1")
+    if args.against and not args.compare:
+        arg_parser.error("--against needs --compare")
+
+    if args.against:
+        with open(args.against) as f:
+            results = json.load(f)
+    else:
+        try:
+            workloads(args.names)
+        except ValueError as e:
+            arg_parser.error(str(e))
+        results = run_suite(args.engines or ['tree'], args.runs, args.optimize, args.names, args.parse)
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(results, f, indent=2)
+                f.write('\n')
+            print(f"Saved {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
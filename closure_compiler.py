@@ -0,0 +1,619 @@
+"""
+Closure compiler for Salt programs
+
+Turns a Salt AST into a tree of pre-bound Python closures once, so running a
+node is a single call instead of walking the isinstance chain in
+Interpreter.evaluate every time. Operators, type coercions and child
+evaluators are all resolved at compile time.
+
+The closures share the interpreter's globals, call frames and function
+table, so the behaviour (scoping, SKIP/END propagation, error messages) is
+the same as the tree walker.
+"""
+
+import operator
+
+from resolver import resolve_function
+from loop_idioms import match_idiom, run_idiom
+from memo import MISS
+from salt_arrays import new_array, widen_array, store_array
+from salt_strings import StringVariable
+from salt_variables import Variable, ArrayVariable, COERCIONS, TYPE_CODES, INT, STRING
+from salt_builtins import BUILTINS
+from math_parser import NumberNode, StringNode, BooleanNode, ConstantNode, VariableNode, AssignmentNode, DeclarationNode, BinaryOpNode, ComparisonNode, LogicalNode, PrintNode, IfNode, ForNode, WhileNode, SkipNode, EndNode, FunctionNode, FunctionCallNode, ReturnNode, UnaryOpNode, ArrayNode, ArrayAccessNode
+
+
+ARITHMETIC_OPERATORS = {
+    '-': operator.sub,
+}
+
+COMPARISON_OPERATORS = {
+    'eq': operator.eq,
+    'neq': operator.ne,
+    'lt': operator.lt,
+    'gt': operator.gt,
+    'lteq': operator.le,
+    'gteq': operator.ge,
+}
+
+
+class ClosureCompiler:
+    """Compiles AST nodes into closures bound to one Interpreter"""
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        # Compiled function bodies, keyed by id of the FunctionNode.
+        # The node itself is kept alive so its id can't be reused.
+        self.function_bodies = {}
+        self.compilers = {
+            NumberNode: self.compile_constant,
+            BooleanNode: self.compile_constant,
+            ConstantNode: self.compile_constant,
+            StringNode: self.compile_string,
+            VariableNode: self.compile_variable,
+            DeclarationNode: self.compile_declaration,
+            AssignmentNode: self.compile_assignment,
+            BinaryOpNode: self.compile_binary_op,
+            LogicalNode: self.compile_logical,
+            ComparisonNode: self.compile_comparison,
+            IfNode: self.compile_if,
+            PrintNode: self.compile_print,
+            ArrayNode: self.compile_array,
+            ArrayAccessNode: self.compile_array_access,
+            ForNode: self.compile_for,
+            WhileNode: self.compile_while,
+            SkipNode: self.compile_skip,
+            EndNode: self.compile_end,
+            FunctionNode: self.compile_function,
+            FunctionCallNode: self.compile_function_call,
+            ReturnNode: self.compile_return,
+            UnaryOpNode: self.compile_unary_op,
+        }
+
+    def compile(self, node):
+        """Compile a node into a zero-argument closure that evaluates it"""
+        compiler = self.compilers.get(type(node))
+        if compiler is None:
+            # Defer the error until the node actually runs, like the tree walker
+            def unknown():
+                raise ValueError(f"Unknown node type: {type(node)}")
+            return unknown
+        return compiler(node)
+
+    def compile_block(self, statements):
+        """Compile a list of statements into a tuple of closures"""
+        return tuple(self.compile(statement) for statement in statements)
+
+    def compile_function_body(self, func_def):
+        """Get (compiling on first use) the closures for a function body"""
+        entry = self.function_bodies.get(id(func_def))
+        if entry is None:
+            entry = (func_def, self.compile_block(func_def.code_block))
+            self.function_bodies[id(func_def)] = entry
+        return entry[1]
+
+    # Literals and variables
+
+    def compile_constant(self, node):
+        value = node.value
+        return lambda: value
+
+    def compile_string(self, node):
+        # Strip the quotes once instead of on every evaluation
+        value = node.value.strip('"')
+        return lambda: value
+
+    def compile_variable(self, node):
+        interp = self.interpreter
+        name = node.name
+        slot = node.slot
+
+        if slot is None:
+            def global_variable():
+                try:
+                    return interp.variables[name].value
+                except KeyError:
+                    raise NameError(f"Variable '{name}' is not defined")
+            return global_variable
+
+        def local_variable():
+            var_info = interp.frame[slot]
+            if var_info is None:
+                var_info = interp.variables.get(name)
+                if var_info is None:
+                    raise NameError(f"Variable '{name}' is not defined")
+            return var_info.value
+        return local_variable
+
+    def compile_declaration(self, node):
+        interp = self.interpreter
+        var_name = node.var_name
+        var_type = node.var_type
+        value_fn = self.compile(node.value)
+        type_code = TYPE_CODES.get(var_type)
+        coerce = COERCIONS[type_code] if type_code is not None else None
+        slot = node.slot
+
+        def declaration():
+            if interp.lookup(var_name, slot) is not None:
+                raise NameError(f"Variable '{var_name}' already defined")
+            value = value_fn()
+            if coerce is None:
+                raise ValueError(f"Unknown variable type: {var_type}")
+            value = coerce(value)
+            if type_code == STRING:
+                interp.declare(var_name, slot, StringVariable(value))
+            else:
+                interp.declare(var_name, slot, Variable(value, type_code))
+            return value
+        return declaration
+
+    def compile_assignment(self, node):
+        interp = self.interpreter
+        var_name = node.var_name
+        value_fn = self.compile(node.value)
+        coercions = COERCIONS
+        lookup = interp.lookup
+        slot = node.slot
+
+        def assignment():
+            var_info = lookup(var_name, slot)
+            if var_info is None:
+                raise NameError(f"Variable '{var_name}' is not defined")
+            value = value_fn()
+            if var_info.__class__ is ArrayVariable:
+                # Whole-array assignment, e.g. make c a + b
+                return store_array(var_info, value)
+            value = coercions[var_info.type](value)
+            var_info.value = value
+            return value
+
+        if node.append is None:
+            return assignment
+
+        pieces = self.compile_block(node.append)
+        budget = interp.budget
+
+        def append():
+            var_info = lookup(var_name, slot)
+            if var_info.__class__ is StringVariable:
+                # make s s + ...: add the new text to s instead of copying it
+                var_info.append(''.join([str(piece()) for piece in pieces]), budget)
+                return None
+            return assignment()
+        return append
+
+    # Expressions
+
+    def compile_binary_op(self, node):
+        left = self.compile(node.left)
+        op = node.operator
+        budget = self.interpreter.budget
+
+        # A constant right operand is captured directly instead of called
+        if isinstance(node.right, (NumberNode, BooleanNode, StringNode, ConstantNode)):
+            right_const = self.compile(node.right)()
+            if op == '+':
+                if isinstance(right_const, str):
+                    return lambda: budget.concatenate(left(), right_const)
+
+                def add_const():
+                    left_val = left()
+                    if isinstance(left_val, str):
+                        return budget.concatenate(left_val, right_const)
+                    return left_val + right_const
+                return add_const
+            if op == '*':
+                def multiply_const():
+                    left_val = left()
+                    if isinstance(left_val, str) or isinstance(right_const, str):
+                        budget.check_repeat(left_val, right_const)
+                    return left_val * right_const
+                return multiply_const
+            if op in ARITHMETIC_OPERATORS:
+                func = ARITHMETIC_OPERATORS[op]
+                return lambda: func(left(), right_const)
+            if op in ('/', '%') and right_const != 0:
+                if op == '/':
+                    return lambda: left() / right_const
+                return lambda: left() % right_const
+
+        right = self.compile(node.right)
+
+        if op == '+':
+            def add():
+                left_val = left()
+                right_val = right()
+                # If either operand is a string, concatenate as strings
+                if isinstance(left_val, str) or isinstance(right_val, str):
+                    return budget.concatenate(left_val, right_val)
+                return left_val + right_val
+            return add
+        elif op == '*':
+            def multiply():
+                left_val = left()
+                right_val = right()
+                # Check the length of a repeated string before building it
+                if isinstance(left_val, str) or isinstance(right_val, str):
+                    budget.check_repeat(left_val, right_val)
+                return left_val * right_val
+            return multiply
+        elif op in ARITHMETIC_OPERATORS:
+            func = ARITHMETIC_OPERATORS[op]
+            return lambda: func(left(), right())
+        elif op == '/':
+            def divide():
+                left_val = left()
+                right_val = right()
+                if right_val == 0:
+                    raise ZeroDivisionError("Cannot divide by zero!")
+                return left_val / right_val
+            return divide
+        elif op == '%':
+            def modulo():
+                left_val = left()
+                right_val = right()
+                if right_val == 0:
+                    raise ZeroDivisionError("Cannot modulo by zero!")
+                return left_val % right_val
+            return modulo
+
+        def unknown():
+            left()
+            right()
+            raise ValueError(f"Unknown operator: {op}")
+        return unknown
+
+    def compile_logical(self, node):
+        left = self.compile(node.left)
+        op = node.operator
+
+        if node.right:
+            right = self.compile(node.right)
+            # Both sides are always evaluated, same as the tree walker
+            if op == 'and':
+                def logical_and():
+                    left_val = left()
+                    right_val = right()
+                    return left_val and right_val
+                return logical_and
+            elif op == 'or':
+                def logical_or():
+                    left_val = left()
+                    right_val = right()
+                    return left_val or right_val
+                return logical_or
+
+            def unknown():
+                left()
+                right()
+                raise ValueError(f"Unknown logical operator: {op}")
+            return unknown
+
+        if op == 'not':
+            return lambda: not left()
+
+        def unknown_unary():
+            left()
+            raise ValueError(f"Unknown logical operator: {op}")
+        return unknown_unary
+
+    def compile_comparison(self, node):
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        op = node.operator
+        func = COMPARISON_OPERATORS.get(op)
+
+        if func is not None and isinstance(node.right, (NumberNode, BooleanNode, StringNode, ConstantNode)):
+            right_const = right()
+            return lambda: func(left(), right_const)
+
+        if func is None:
+            def unknown():
+                left()
+                right()
+                raise ValueError(f"Unknown comparison operator: {op}")
+            return unknown
+
+        def comparison():
+            left_val = left()
+            return func(left_val, right())
+        return comparison
+
+    def compile_unary_op(self, node):
+        operand = self.compile(node.operand)
+        op = node.operator
+        if op == '-':
+            return lambda: -operand()
+
+        def unknown():
+            operand()
+            raise ValueError(f"Unknown unary operator: {op}")
+        return unknown
+
+    # Statements
+
+    def compile_if(self, node):
+        interp = self.interpreter
+        SKIP = interp.SKIP
+        END = interp.END
+        condition = self.compile(node.condition)
+
+        # IfNode.code_block can be a list (if only if-block) or a tuple (if-block, else-block)
+        if isinstance(node.code_block, tuple):
+            if_block, else_block = node.code_block
+            else_block = self.compile_block(else_block)
+        else:
+            if_block = node.code_block
+            else_block = None
+        if_block = self.compile_block(if_block)
+
+        def run_if():
+            if condition():
+                block = if_block
+            elif else_block is not None:
+                block = else_block
+            else:
+                return None
+            result = None
+            for statement in block:
+                result = statement()
+                # Propagate SKIP or END up to the enclosing loop
+                if result is SKIP or result is END:
+                    return result
+            return result
+        return run_if
+
+    def compile_print(self, node):
+        expressions = self.compile_block(node.expressions)
+        write = self.interpreter.output.write
+
+        def run_print():
+            result = ''.join([str(expr()) for expr in expressions])
+            write(result)
+            return result
+        return run_print
+
+    def compile_array(self, node):
+        interp = self.interpreter
+        var_name = node.var_name
+        slot = node.slot
+
+        if node.is_declaration:
+            var_type = node.var_type
+            element_type = TYPE_CODES.get(var_type)
+            size_fn = self.compile(node.size)
+            def array_declaration():
+                if interp.lookup(var_name, slot) is not None:
+                    raise NameError(f"Variable '{var_name}' already defined")
+                size = size_fn()
+                if not isinstance(size, int) or size <= 0:
+                    raise ValueError(f"Array size must be a positive integer, got {size}")
+                if element_type is None:
+                    raise ValueError(f"Unknown array type: {var_type}")
+                interp.budget.allocate(size)
+                array_data = new_array(element_type, size)
+                interp.declare(var_name, slot, ArrayVariable(array_data, element_type, size))
+                return array_data
+            return array_declaration
+
+        index_fn = self.compile(node.index)
+        value_fn = self.compile(node.value)
+        coercions = COERCIONS
+
+        lookup = interp.lookup
+
+        def array_assignment():
+            var_info = lookup(var_name, slot)
+            if var_info is None:
+                raise NameError(f"Array '{var_name}' is not defined")
+            if var_info.__class__ is not ArrayVariable:
+                raise TypeError(f"'{var_name}' is not an array")
+            index = index_fn()
+            if not isinstance(index, int) or index < 0 or index >= var_info.size:
+                raise IndexError(f"Array index {index} out of bounds for array '{var_name}' of size {var_info.size}")
+            value = coercions[var_info.type](value_fn())
+            try:
+                var_info.value[index] = value
+            except OverflowError:
+                # Too big for 64 bits, so the array becomes a plain list
+                widen_array(var_info)[index] = value
+            return value
+        return array_assignment
+
+    def compile_array_access(self, node):
+        interp = self.interpreter
+        array_name = node.array_name
+        index_fn = self.compile(node.index)
+        lookup = interp.lookup
+        slot = node.slot
+
+        def array_access():
+            var_info = lookup(array_name, slot)
+            if var_info is None:
+                raise NameError(f"Array '{array_name}' is not defined")
+            if var_info.__class__ is not ArrayVariable:
+                raise TypeError(f"'{array_name}' is not an array")
+            index = index_fn()
+            if not isinstance(index, int) or index < 0 or index >= var_info.size:
+                raise IndexError(f"Array index {index} out of bounds for array '{array_name}' of size {var_info.size}")
+            return var_info.value[index]
+        return array_access
+
+    def compile_for(self, node):
+        interp = self.interpreter
+        SKIP = interp.SKIP
+        END = interp.END
+        budget = interp.budget
+        block = self.compile_block(node.code_block)
+
+        if node.startIndex is None:
+            count = node.var
+
+            def loop_times():
+                for i in range(count):
+                    budget.ticks -= 1
+                    if budget.ticks <= 0:
+                        budget.check()
+                    for statement in block:
+                        result = statement()
+                        if result is SKIP:
+                            break  # Skip the rest of this iteration
+                        elif result is END:
+                            return None  # Break out of the loop
+                return None
+            return loop_times
+
+        var = node.var
+        loop_range = range(node.startIndex, node.endIndex + 1, node.step)
+        slot = node.slot
+        idiom = match_idiom(node)
+
+        def loop_from_to():
+            var_info = interp.lookup(var, slot)
+            if var_info is None:
+                raise ValueError(f"Loop variable '{var}' is not defined")
+            if var_info.__class__ is not Variable or var_info.type != INT:
+                raise ValueError(f"Variable {var} is not an integer")
+            if idiom is not None and run_idiom(interp, idiom, var_info):
+                return None  # Ran as one batch
+            for i in loop_range:
+                # Update the loop variable to current iteration value
+                var_info.value = i
+                budget.ticks -= 1
+                if budget.ticks <= 0:
+                    budget.check()
+                for statement in block:
+                    result = statement()
+                    if result is SKIP:
+                        break
+                    elif result is END:
+                        return None
+            return None
+        return loop_from_to
+
+    def compile_while(self, node):
+        interp = self.interpreter
+        SKIP = interp.SKIP
+        END = interp.END
+        budget = interp.budget
+        condition = self.compile(node.condition)
+        block = self.compile_block(node.code_block)
+
+        def run_while():
+            while condition():
+                budget.ticks -= 1
+                if budget.ticks <= 0:
+                    budget.check()
+                for statement in block:
+                    result = statement()
+                    if result is SKIP:
+                        break
+                    elif result is END:
+                        return None
+            return None
+        return run_while
+
+    def compile_skip(self, node):
+        SKIP = self.interpreter.SKIP
+        return lambda: SKIP
+
+    def compile_end(self, node):
+        END = self.interpreter.END
+        return lambda: END
+
+    # Functions
+
+    def compile_function(self, node):
+        interp = self.interpreter
+        name = node.name
+
+        def define_function():
+            # Store function definition in the interpreter's function table
+            resolve_function(node)
+            interp.define_function(name, node)
+            return None
+        return define_function
+
+    def compile_function_call(self, node):
+        interp = self.interpreter
+        name = node.name
+        arguments = self.compile_block(node.arguments)
+        coercions = COERCIONS
+        compile_function_body = self.compile_function_body
+        builtin = BUILTINS.get(name)
+        if builtin is not None:
+            builtin_arguments = self.compile_builtin_arguments(builtin, node, arguments)
+
+        def function_call():
+            func_def = interp.functions.get(name)
+            if func_def is None:
+                if builtin is not None:
+                    if len(arguments) != len(builtin.parameters):
+                        raise ValueError(f"Function '{name}' expects {len(builtin.parameters)} arguments, got {len(arguments)}")
+                    return builtin.call([argument() for argument in builtin_arguments])
+                raise NameError(f"Function '{name}' is not defined")
+            parameters = func_def.parameters
+            if len(arguments) != len(parameters):
+                raise ValueError(f"Function '{name}' expects {len(parameters)} arguments, got {len(arguments)}")
+
+            # Evaluate arguments in the current (caller) scope, straight into
+            # the new call's frame of local slots
+            frame = [None] * func_def.slot_count
+            arg_values = []
+            for argument, param_type, slot in zip(arguments, func_def.param_types, func_def.param_slots):
+                arg_value = coercions[param_type](argument())
+                arg_values.append(arg_value)
+                if param_type == STRING:
+                    frame[slot] = StringVariable(arg_value)
+                else:
+                    frame[slot] = Variable(arg_value, param_type)
+
+            # Pure functions answer repeated calls from their cache
+            memo = interp.memo
+            cache = None
+            if memo is not None:
+                cache = memo.cache_for(func_def, interp.functions, interp.variables)
+                if cache is not None:
+                    key = tuple(arg_values)
+                    result = memo.lookup(cache, key)
+                    if result is not MISS:
+                        return result
+
+            body = compile_function_body(func_def)
+
+            interp.enter_call(name)
+            old_frame = interp.frame
+            interp.frame = frame
+            try:
+                result = None
+                for statement in body:
+                    result = statement()
+                    if isinstance(result, tuple) and result[0] == 'RETURN':
+                        result = result[1]
+                        break
+            finally:
+                interp.frame = old_frame
+                interp.call_depth -= 1
+            if cache is not None:
+                memo.store(cache, key, result)
+            return result
+        return function_call
+
+    def compile_builtin_arguments(self, builtin, node, arguments):
+        """Argument closures for a builtin; array variables it changes give their cell"""
+        lookup = self.interpreter.lookup
+        builtin_arguments = list(arguments)
+        for i, (kind, argument) in enumerate(zip(builtin.parameters, node.arguments)):
+            if kind == 'target' and isinstance(argument, VariableNode):
+                def reference(name=argument.name, slot=argument.slot):
+                    var_info = lookup(name, slot)
+                    if var_info is None:
+                        raise NameError(f"Variable '{name}' is not defined")
+                    return var_info
+                builtin_arguments[i] = reference
+        return builtin_arguments
+
+    def compile_return(self, node):
+        value_fn = self.compile(node.value)
+        return lambda: ('RETURN', value_fn())
@@ -0,0 +1,337 @@
+"""
+Flat encoding of parsed Salt programs
+
+A parsed program is a tree of node objects: one for every number, name,
+operator and statement. encode() packs a list of statements into a
+FlatProgram instead, which is one row per node across parallel typed arrays,
+plus pools the rows point into:
+
+    kinds[row]    the node's kind (KINDS)
+    tags[row]     operator code (OPERATORS), or the type code of a declaration
+    a/b/c[row]    operands: the row of a child node, or an index into
+                  constants, names or lists; -1 for none
+
+    constants     numbers, strings and other values, each stored once
+    names         variable and function names, each stored once
+    lists         blocks, print expressions and call arguments: list j's
+                  rows are list_items[list_starts[j]:list_starts[j + 1]]
+
+FlatProgram.statements() turns the rows back into nodes one top-level
+statement at a time, so only the statement that's about to run (and the
+functions defined so far) exist as objects. Any engine runs them as usual:
+
+    for statement in program.statements():
+        interpreter.execute(statement)
+
+The resolver, optimizer and loop idioms fill in their fields on the decoded
+nodes again, the same as for freshly parsed ones.
+"""
+
+from array import array
+
+from math_parser import NumberNode, StringNode, BooleanNode, ConstantNode, VariableNode, AssignmentNode, DeclarationNode, BinaryOpNode, ComparisonNode, LogicalNode, PrintNode, IfNode, ForNode, WhileNode, SkipNode, EndNode, FunctionNode, FunctionCallNode, ReturnNode, UnaryOpNode, ArrayNode, ArrayAccessNode
+from salt_variables import TYPE_NAMES, TYPE_CODES
+
+KINDS = ('number', 'string', 'boolean', 'constant', 'variable', 'assign', 'declare', 'binary', 'compare',
+         'logical', 'unary', 'if', 'for', 'while', 'skip', 'end', 'array_declare', 'array_store', 'print',
+         'function', 'call', 'return', 'array_access')
+(NUMBER, STRING, BOOLEAN, CONSTANT, VARIABLE, ASSIGN, DECLARE, BINARY, COMPARE,
+ LOGICAL, UNARY, IF, FOR, WHILE, SKIP, END, ARRAY_DECLARE, ARRAY_STORE, PRINT,
+ FUNCTION, CALL, RETURN, ARRAY_ACCESS) = range(len(KINDS))
+
+OPERATORS = ('+', '-', '*', '/', '%', 'eq', 'neq', 'lt', 'gt', 'lteq', 'gteq', 'and', 'or', 'not')
+OPERATOR_CODES = {operator: code for code, operator in enumerate(OPERATORS)}
+
+NONE = -1  # Operand that isn't there
+
+
+class FlatProgram:
+    """Top-level statements packed into parallel arrays (see the module docstring)"""
+
+    def __init__(self):
+        self.kinds = array('B')
+        self.tags = array('B')
+        self.a = array('i')
+        self.b = array('i')
+        self.c = array('i')
+        self.constants = []
+        self.names = []
+        self.list_starts = array('i', [0])
+        self.list_items = array('i')
+        self.roots = array('i')  # Row of each top-level statement
+        self.constant_index = {}
+        self.name_index = {}
+
+    def __len__(self):
+        return len(self.roots)
+
+    def node_count(self):
+        return len(self.kinds)
+
+    def statements(self):
+        """Yield the top-level statements as nodes, decoding each one when it's reached"""
+        for row in self.roots:
+            yield self.decode(row)
+
+    def finish(self):
+        """Drop the lookup tables only needed while encoding"""
+        self.constant_index = self.name_index = None
+        return self
+
+    # Encoding
+
+    def add_row(self, kind, tag=0, a=NONE, b=NONE, c=NONE):
+        row = len(self.kinds)
+        self.kinds.append(kind)
+        self.tags.append(tag)
+        self.a.append(a)
+        self.b.append(b)
+        self.c.append(c)
+        return row
+
+    def add_constant(self, value):
+        # Key on the type too, since 1, 1.0 and TRUE compare equal (and repr
+        # keeps 0.0 and -0.0 apart)
+        key = (type(value), repr(value) if isinstance(value, float) else value)
+        index = self.constant_index.get(key)
+        if index is None:
+            index = self.constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+    def add_name(self, name):
+        index = self.name_index.get(name)
+        if index is None:
+            index = self.name_index[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def add_list(self, nodes):
+        rows = [self.encode(node) for node in nodes]
+        self.list_items.extend(rows)
+        self.list_starts.append(len(self.list_items))
+        return len(self.list_starts) - 2
+
+    def encode(self, node):
+        """Add the rows for a node and everything under it; returns its row"""
+        if node is None:
+            return NONE
+        if isinstance(node, NumberNode):
+            return self.add_row(NUMBER, a=self.add_constant(node.value))
+        elif isinstance(node, StringNode):
+            return self.add_row(STRING, a=self.add_constant(node.value))
+        elif isinstance(node, BooleanNode):
+            return self.add_row(BOOLEAN, a=self.add_constant(node.value))
+        elif isinstance(node, ConstantNode):
+            return self.add_row(CONSTANT, a=self.add_constant(node.value))
+        elif isinstance(node, VariableNode):
+            return self.add_row(VARIABLE, a=self.add_name(node.name))
+        elif isinstance(node, AssignmentNode):
+            return self.add_row(ASSIGN, a=self.add_name(node.var_name), b=self.encode(node.value))
+        elif isinstance(node, DeclarationNode):
+            return self.add_row(DECLARE, type_code(node.var_type), self.add_name(node.var_name), self.encode(node.value))
+        elif isinstance(node, BinaryOpNode):
+            return self.add_row(BINARY, operator_code(node.operator), self.encode(node.left), self.encode(node.right))
+        elif isinstance(node, ComparisonNode):
+            return self.add_row(COMPARE, operator_code(node.operator), self.encode(node.left), self.encode(node.right))
+        elif isinstance(node, LogicalNode):
+            return self.add_row(LOGICAL, operator_code(node.operator), self.encode(node.left), self.encode(node.right))
+        elif isinstance(node, UnaryOpNode):
+            return self.add_row(UNARY, operator_code(node.operator), self.encode(node.operand))
+        elif isinstance(node, IfNode):
+            condition = self.encode(node.condition)
+            if isinstance(node.code_block, tuple):
+                if_block, else_block = node.code_block
+                return self.add_row(IF, a=condition, b=self.add_list(if_block), c=self.add_list(else_block))
+            return self.add_row(IF, a=condition, b=self.add_list(node.code_block))
+        elif isinstance(node, ForNode):
+            block = self.add_list(node.code_block)
+            if node.startIndex is None:
+                # loop N times: var is the count
+                return self.add_row(FOR, a=self.add_constant(node.var), b=block)
+            loop_range = self.add_constant((node.startIndex, node.endIndex, node.step))
+            return self.add_row(FOR, a=self.add_name(node.var), b=block, c=loop_range)
+        elif isinstance(node, WhileNode):
+            return self.add_row(WHILE, a=self.encode(node.condition), b=self.add_list(node.code_block))
+        elif isinstance(node, SkipNode):
+            return self.add_row(SKIP)
+        elif isinstance(node, EndNode):
+            return self.add_row(END)
+        elif isinstance(node, ArrayNode):
+            name = self.add_name(node.var_name)
+            if node.is_declaration:
+                return self.add_row(ARRAY_DECLARE, type_code(node.var_type), name, self.encode(node.size))
+            return self.add_row(ARRAY_STORE, 0, name, self.encode(node.index), self.encode(node.value))
+        elif isinstance(node, PrintNode):
+            return self.add_row(PRINT, a=self.add_list(node.expressions))
+        elif isinstance(node, FunctionNode):
+            signature = self.add_constant((node.return_type, tuple(node.parameters)))
+            return self.add_row(FUNCTION, a=self.add_name(node.name), b=self.add_list(node.code_block), c=signature)
+        elif isinstance(node, FunctionCallNode):
+            return self.add_row(CALL, a=self.add_name(node.name), b=self.add_list(node.arguments))
+        elif isinstance(node, ReturnNode):
+            return self.add_row(RETURN, a=self.encode(node.value))
+        elif isinstance(node, ArrayAccessNode):
+            return self.add_row(ARRAY_ACCESS, a=self.add_name(node.array_name), b=self.encode(node.index))
+        raise ValueError(f"Can't encode node type: {type(node)}")
+
+    # Decoding
+
+    def decode_list(self, index):
+        starts = self.list_starts
+        return [self.decode(row) for row in self.list_items[starts[index]:starts[index + 1]]]
+
+    def decode(self, row):
+        """Build the node at a row (and everything under it)"""
+        if row == NONE:
+            return None
+        kind = self.kinds[row]
+        a = self.a[row]
+        b = self.b[row]
+        c = self.c[row]
+        decode = self.decode
+        if kind == VARIABLE:
+            return VariableNode(self.names[a])
+        elif kind == NUMBER:
+            return leaf(NumberNode, self.constants[a])
+        elif kind == BINARY:
+            return BinaryOpNode(decode(a), OPERATORS[self.tags[row]], decode(b))
+        elif kind == ASSIGN:
+            return AssignmentNode(self.names[a], decode(b))
+        elif kind == COMPARE:
+            return ComparisonNode(decode(a), OPERATORS[self.tags[row]], decode(b))
+        elif kind == STRING:
+            return StringNode(self.constants[a])
+        elif kind == BOOLEAN:
+            return leaf(BooleanNode, self.constants[a])
+        elif kind == CONSTANT:
+            return ConstantNode(self.constants[a])
+        elif kind == DECLARE:
+            return DeclarationNode(TYPE_NAMES[self.tags[row]], self.names[a], decode(b))
+        elif kind == LOGICAL:
+            return LogicalNode(decode(a), OPERATORS[self.tags[row]], decode(b))
+        elif kind == UNARY:
+            return UnaryOpNode(OPERATORS[self.tags[row]], decode(a))
+        elif kind == IF:
+            if c == NONE:
+                return IfNode(decode(a), self.decode_list(b))
+            return IfNode(decode(a), (self.decode_list(b), self.decode_list(c)))
+        elif kind == FOR:
+            if c == NONE:
+                return ForNode(self.constants[a], self.decode_list(b))
+            return ForNode(self.names[a], self.decode_list(b), *self.constants[c])
+        elif kind == WHILE:
+            return WhileNode(decode(a), self.decode_list(b))
+        elif kind == SKIP:
+            return SkipNode()
+        elif kind == END:
+            return EndNode()
+        elif kind == ARRAY_DECLARE:
+            return ArrayNode(var_type=TYPE_NAMES[self.tags[row]], var_name=self.names[a], size=decode(b),
+                             is_declaration=True)
+        elif kind == ARRAY_STORE:
+            return ArrayNode(var_name=self.names[a], index=decode(b), value=decode(c), is_declaration=False)
+        elif kind == PRINT:
+            return PrintNode(self.decode_list(a))
+        elif kind == FUNCTION:
+            return_type, parameters = self.constants[c]
+            return FunctionNode(self.names[a], return_type, list(parameters), self.decode_list(b))
+        elif kind == CALL:
+            return FunctionCallNode(self.names[a], self.decode_list(b))
+        elif kind == RETURN:
+            return ReturnNode(decode(a))
+        elif kind == ARRAY_ACCESS:
+            return ArrayAccessNode(self.names[a], decode(b))
+        raise ValueError(f"Unknown node kind: {kind}")
+
+
+def encode(statements):
+    """Pack a list of top-level statements into a FlatProgram"""
+    program = FlatProgram()
+    for statement in statements:
+        program.roots.append(program.encode(statement))
+    return program.finish()
+
+
+def leaf(cls, value):
+    # NumberNode and BooleanNode convert their token text in __init__; this
+    # sets the already converted value instead
+    node = cls.__new__(cls)
+    node.value = value
+    return node
+
+
+def operator_code(operator):
+    code = OPERATOR_CODES.get(operator)
+    if code is None:
+        raise ValueError(f"Can't encode operator: {operator}")
+    return code
+
+
+def type_code(var_type):
+    code = TYPE_CODES.get(var_type)
+    if code is None:
+        raise ValueError(f"Can't encode type: {var_type}")
+    return code
+
+
+def generated_program(statements):
+    """Salt source for a program with this many top-level statements, for measuring"""
+    lines = ["make int total 0", "make string label \"\"", "make int array values[100]"]
+    count = len(lines)
+    n = 0
+    while count < statements:
+        lines += [
+            f"make int x{n} {n} * 3 + total % 7",
+            f"make total total + x{n} - {n} / 2",
+            f"if (x{n} gt total) and (total lt {n})",
+            "{",
+            f"    make values[{n % 100}] x{n}",
+            "}",
+            f"make label \"step \" + {n}",
+            f"print label \": \" total",
+        ]
+        count += 5
+        n += 1
+    return '\n'.join(lines)
+
+
+def test_flat():
+    """Encode a 100k-statement program and compare its memory with the parsed nodes"""
+    import tracemalloc
+    from interpreter import Interpreter
+    from math_parser import Parser
+    from program_cache import ast_size
+    from salt_output import ListSink
+    from tokenizer import lex
+
+    code = generated_program(100000)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    statements = list(Parser(lex(code)).statements())
+    nodes_bytes = tracemalloc.get_traced_memory()[0] - before
+    print(f"{len(statements)} top-level statements, {len(code.splitlines())} lines")
+    print(f"Nodes: {nodes_bytes / 1e6:.1f} MB (ast_size {ast_size(statements) / 1e6:.1f} MB)")
+
+    before = tracemalloc.get_traced_memory()[0]
+    program = encode(statements)
+    flat_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del statements
+    print(f"Flat: {flat_bytes / 1e6:.1f} MB for {program.node_count()} nodes ({ast_size(program) / 1e6:.1f} MB ast_size)")
+
+    # Run it from the flat form and from freshly parsed nodes: same output
+    flat_output = ListSink()
+    interpreter = Interpreter(output=flat_output)
+    for statement in program.statements():
+        interpreter.execute(statement)
+    parsed_output = ListSink()
+    interpreter = Interpreter(output=parsed_output)
+    for statement in Parser(lex(code)).statements():
+        interpreter.execute(statement)
+    print(f"Same result: {flat_output.lines == parsed_output.lines} "
+          f"(total = {interpreter.variables['total'].value})")
+
+
+if __name__ == "__main__":
+    test_flat()
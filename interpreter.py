@@ -1,16 +1,115 @@
-from math_parser import Parser, NumberNode, StringNode, BooleanNode, VariableNode, AssignmentNode, DeclarationNode, BinaryOpNode, ComparisonNode, LogicalNode, PrintNode, IfNode, ForNode, WhileNode, SkipNode, EndNode, FunctionNode, FunctionCallNode, ReturnNode, UnaryOpNode, ArrayNode, ArrayAccessNode
+from math_parser import Parser, NumberNode, StringNode, BooleanNode, ConstantNode, VariableNode, AssignmentNode, DeclarationNode, BinaryOpNode, ComparisonNode, LogicalNode, PrintNode, IfNode, ForNode, WhileNode, SkipNode, EndNode, FunctionNode, FunctionCallNode, ReturnNode, UnaryOpNode, ArrayNode, ArrayAccessNode
 from tokenizer import tokenize
 from salt_language import TYPES
+from closure_compiler import ClosureCompiler
+from resolver import resolve_function
+from limits import Budget, CallDepthExceeded
+from loop_idioms import match_idiom, run_idiom
+from memo import FunctionMemo, MEMO_SIZE, MISS
+from optimizer import optimize
+from salt_arrays import new_array, widen_array, store_array
+from salt_builtins import BUILTINS
+from salt_output import stdout_sink
+from salt_strings import StringVariable
+from salt_variables import Variable, ArrayVariable, COERCIONS, TYPE_CODES, INT, STRING
+from salt_vm import VM, compile_statements
+
+
+# Execution engines an Interpreter can run statements with
+ENGINES = ('tree', 'closure', 'vm')
+
+# Default limit on nested Salt function calls. The vm engine keeps calls on
+# its own stack so it can really go this deep; tree and closure recurse in
+# Python and run into Python's recursion limit long before.
+MAX_CALL_DEPTH = 500000
 
 
 class Interpreter:
     """Evaluates Abstract Syntax Trees for Salt language"""
     
-    def __init__(self):
-        self.variables = {}  # Store variable values
+    def __init__(self, engine='tree', max_call_depth=MAX_CALL_DEPTH, memo_size=MEMO_SIZE, optimize=True,
+                 max_steps=None, max_time=None, max_array_elements=None, max_string_length=None, output=None):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+        self.variables = {}  # Global variables
+        self.frame = None  # Local slots of the running function call (None at top level)
         self.functions = {}  # Store function definitions
+        self.max_call_depth = max_call_depth
+        self.call_depth = 0  # Number of Salt calls currently running
+        self.max_depth_reached = 0  # Deepest call depth seen so far
+        # Results of pure function calls (memo_size=0 turns memoization off)
+        self.memo = FunctionMemo(memo_size) if memo_size > 0 else None
+        self.optimize = optimize  # Run the AST optimizer before each statement
+        # Limits on loop iterations and calls, seconds, array elements and string length
+        self.budget = Budget(max_steps, max_time, max_array_elements, max_string_length)
+        # Where print sends its lines (see salt_output.py); flushed after every statement
+        self.output = output if output is not None else stdout_sink()
         self.SKIP = object()
         self.END = object()
+        self.engine = engine
+        self.compiler = None
+        self.vm = None
+        if engine == 'closure':
+            self.compiler = ClosureCompiler(self)
+        elif engine == 'vm':
+            self.vm = VM(self)
+
+    def execute(self, node):
+        """Run a top-level statement with the selected engine"""
+        self.budget.start()
+        if self.optimize:
+            node = optimize(node)
+        try:
+            if self.vm is not None:
+                return self.vm.run(compile_statements([node]))
+            if self.compiler is not None:
+                return self.compiler.compile(node)()
+            return self.evaluate(node)
+        except RecursionError as e:
+            if self.vm is not None or self.max_depth_reached >= self.max_call_depth:
+                raise
+            # Python's own stack ran out before our limit did
+            raise RecursionError(f"Recursion too deep for the {self.engine} engine "
+                                 f"(reached call depth {self.max_depth_reached}); try --engine vm") from e
+        finally:
+            self.output.flush()
+
+    def define_function(self, name, function):
+        """Store a function definition; any memoized results may now be stale"""
+        self.functions[name] = function
+        if self.memo is not None:
+            self.memo.clear()
+
+    def enter_call(self, name):
+        """Count a new function call, enforcing the call depth limit"""
+        depth = self.call_depth + 1
+        if depth > self.max_call_depth:
+            raise CallDepthExceeded(f"Maximum call depth of {self.max_call_depth} exceeded calling '{name}'")
+        self.call_depth = depth
+        budget = self.budget
+        budget.ticks -= 1
+        if budget.ticks <= 0:
+            budget.check()
+        if depth > self.max_depth_reached:
+            self.max_depth_reached = depth
+
+    def lookup(self, name, slot=None):
+        """Find a variable's cell: its local slot in the current call, else the global"""
+        if slot is not None:
+            var_info = self.frame[slot]
+            if var_info is not None:
+                return var_info
+        return self.variables.get(name)
+
+    def declare(self, name, slot, var_info):
+        """Store a new variable in its local slot, or globally at top level"""
+        if slot is not None:
+            self.frame[slot] = var_info
+        else:
+            self.variables[name] = var_info
+            if self.memo is not None:
+                self.memo.declared_global(name, self.functions)
+
     def evaluate(self, node):
         """Recursively evaluate an AST node"""
         
@@ -24,52 +123,57 @@ class Interpreter:
         elif isinstance(node, BooleanNode):
             return node.value
         
+        elif isinstance(node, ConstantNode):
+            return node.value
+        
         elif isinstance(node, VariableNode):
-            if node.name in self.variables:
-                return self.variables[node.name]['value']
+            # Same as self.lookup, inlined since this is the hottest node
+            var_info = self.frame[node.slot] if node.slot is not None else None
+            if var_info is None:
+                var_info = self.variables.get(node.name)
+            if var_info is not None:
+                return var_info.value
             else:
                 raise NameError(f"Variable '{node.name}' is not defined")
         
         elif isinstance(node, DeclarationNode):
             # Evaluate the value and store it
-            if node.var_name in self.variables:
+            if self.lookup(node.var_name, node.slot) is not None:
                 raise NameError(f"Variable '{node.var_name}' already defined")
 
             value = self.evaluate(node.value)
-            # disinguish between int and doubles, ints will be truncated
-            if node.var_type == 'int':
-                value = int(value)
-            elif node.var_type == 'double':
-                value = float(value)    
-            elif node.var_type == 'bool':
-                value = bool(value)
-            elif node.var_type == 'string':
-                value = str(value)
-            else: 
+            var_type = TYPE_CODES.get(node.var_type)
+            if var_type is None:
                 raise ValueError(f"Unknown variable type: {node.var_type}")
+            # disinguish between int and doubles, ints will be truncated
+            value = COERCIONS[var_type](value)
 
-            self.variables[node.var_name] = {'value': value, 'type': node.var_type}
+            if var_type == STRING:
+                self.declare(node.var_name, node.slot, StringVariable(value))
+            else:
+                self.declare(node.var_name, node.slot, Variable(value, var_type))
             # print(f"Made {node.var_type} {node.var_name} = {value}")
             return value
         
         elif isinstance(node, AssignmentNode):
             # Evaluate the value and store it
-            if node.var_name not in self.variables:
+            var_info = self.lookup(node.var_name, node.slot)
+            if var_info is None:
                 raise NameError(f"Variable '{node.var_name}' is not defined")
+
+            if node.append is not None and var_info.__class__ is StringVariable:
+                # make s s + ...: add the new text to s instead of copying it
+                var_info.append(''.join([str(self.evaluate(piece)) for piece in node.append]), self.budget)
+                return None
             
             value = self.evaluate(node.value)
 
-            if self.variables[node.var_name]['type'] == 'int':
-                value = int(value)
-            elif self.variables[node.var_name]['type'] == 'double':
-                value = float(value)
-            elif self.variables[node.var_name]['type'] == 'bool':
-                value = bool(value)
-            elif self.variables[node.var_name]['type'] == 'string':
-                value = str(value)
-                
+            if var_info.__class__ is ArrayVariable:
+                # Whole-array assignment, e.g. make c a + b
+                return store_array(var_info, value)
+            value = COERCIONS[var_info.type](value)
 
-            self.variables[node.var_name]['value'] = value
+            var_info.value = value
             # print(f"Made {node.var_name} = {value}")
             return value
         
@@ -82,11 +186,13 @@ class Interpreter:
             if node.operator == '+':
                 # If either operand is a string, concatenate as strings
                 if isinstance(left_val, str) or isinstance(right_val, str):
-                    return str(left_val) + str(right_val)
+                    return self.budget.concatenate(left_val, right_val)
                 return left_val + right_val
             elif node.operator == '-':
                 return left_val - right_val
             elif node.operator == '*':
+                if isinstance(left_val, str) or isinstance(right_val, str):
+                    self.budget.check_repeat(left_val, right_val)
                 return left_val * right_val
             elif node.operator == '/':
                 if right_val == 0:
@@ -176,87 +282,77 @@ class Interpreter:
             
             # Join all values and print
             result = ''.join(values)
-            print(result)
+            self.output.write(result)
             return result  # Return the printed value
         
         elif isinstance(node, ArrayNode):
             if node.is_declaration:
                 # Array declaration: make int array name[size]
-                if node.var_name in self.variables:
+                if self.lookup(node.var_name, node.slot) is not None:
                     raise NameError(f"Variable '{node.var_name}' already defined")
                 
                 size = self.evaluate(node.size)
                 if not isinstance(size, int) or size <= 0:
                     raise ValueError(f"Array size must be a positive integer, got {size}")
                 
-                # Initialize array with default values based on type
-                if node.var_type == 'int':
-                    array_data = [0] * size
-                elif node.var_type == 'double':
-                    array_data = [0.0] * size
-                elif node.var_type == 'string':
-                    array_data = [""] * size
-                elif node.var_type == 'bool':
-                    array_data = [False] * size
-                else:
+                element_type = TYPE_CODES.get(node.var_type)
+                if element_type is None:
                     raise ValueError(f"Unknown array type: {node.var_type}")
                 
-                self.variables[node.var_name] = {
-                    'value': array_data, 
-                    'type': f'array_{node.var_type}',
-                    'element_type': node.var_type,
-                    'size': size
-                }
+                # Compact storage for the type, filled with its default value
+                self.budget.allocate(size)
+                array_data = new_array(element_type, size)
+                
+                self.declare(node.var_name, node.slot, ArrayVariable(array_data, element_type, size))
                 return array_data
             else:
                 # Array element assignment: make name[index] value
-                if node.var_name not in self.variables:
+                var_info = self.lookup(node.var_name, node.slot)
+                if var_info is None:
                     raise NameError(f"Array '{node.var_name}' is not defined")
                 
-                var_info = self.variables[node.var_name]
-                if not var_info['type'].startswith('array_'):
+                if var_info.__class__ is not ArrayVariable:
                     raise TypeError(f"'{node.var_name}' is not an array")
                 
                 index = self.evaluate(node.index)
-                if not isinstance(index, int) or index < 0 or index >= var_info['size']:
-                    raise IndexError(f"Array index {index} out of bounds for array '{node.var_name}' of size {var_info['size']}")
+                if not isinstance(index, int) or index < 0 or index >= var_info.size:
+                    raise IndexError(f"Array index {index} out of bounds for array '{node.var_name}' of size {var_info.size}")
                 
                 value = self.evaluate(node.value)
                 
                 # Type conversion based on array element type
-                element_type = var_info['element_type']
-                if element_type == 'int':
-                    value = int(value)
-                elif element_type == 'double':
-                    value = float(value)
-                elif element_type == 'bool':
-                    value = bool(value)
-                elif element_type == 'string':
-                    value = str(value)
+                value = COERCIONS[var_info.type](value)
                 
-                var_info['value'][index] = value
+                try:
+                    var_info.value[index] = value
+                except OverflowError:
+                    # Too big for 64 bits, so the array becomes a plain list
+                    widen_array(var_info)[index] = value
                 return value
         
         elif isinstance(node, ArrayAccessNode):
             # Array element access: name[index]
-            if node.array_name not in self.variables:
+            var_info = self.lookup(node.array_name, node.slot)
+            if var_info is None:
                 raise NameError(f"Array '{node.array_name}' is not defined")
             
-            var_info = self.variables[node.array_name]
-            if not var_info['type'].startswith('array_'):
+            if var_info.__class__ is not ArrayVariable:
                 raise TypeError(f"'{node.array_name}' is not an array")
             
             index = self.evaluate(node.index)
-            if not isinstance(index, int) or index < 0 or index >= var_info['size']:
-                raise IndexError(f"Array index {index} out of bounds for array '{node.array_name}' of size {var_info['size']}")
+            if not isinstance(index, int) or index < 0 or index >= var_info.size:
+                raise IndexError(f"Array index {index} out of bounds for array '{node.array_name}' of size {var_info.size}")
             
-            return var_info['value'][index]
+            return var_info.value[index]
         
         elif isinstance(node, ForNode):
             #evaluate the for node
+            budget = self.budget
             if node.startIndex is None:  # Check explicitly for None
                 for i in range(node.var):
-                    
+                    budget.ticks -= 1
+                    if budget.ticks <= 0:
+                        budget.check()
                     for statement in node.code_block:
                         result = self.evaluate(statement)
                         if result is self.SKIP:
@@ -266,11 +362,19 @@ class Interpreter:
                 return None
             else:
                 # Variable-based loops like "loop i from 1 to 10"
-                if node.var in self.variables:
-                    if self.variables[node.var]['type'] == 'int':
+                var_info = self.lookup(node.var, node.slot)
+                if var_info is not None:
+                    if var_info.__class__ is Variable and var_info.type == INT:
+                        if node.idiom is None:
+                            node.idiom = match_idiom(node) or False
+                        if node.idiom and run_idiom(self, node.idiom, var_info):
+                            return None  # Ran as one batch
                         for i in range(node.startIndex, node.endIndex+1, node.step):
                             # Update the loop variable to current iteration value
-                            self.variables[node.var]['value'] = i
+                            var_info.value = i
+                            budget.ticks -= 1
+                            if budget.ticks <= 0:
+                                budget.check()
                             for statement in node.code_block:
                                 result = self.evaluate(statement)
                                 if result is self.SKIP:
@@ -287,8 +391,12 @@ class Interpreter:
             # evaluate the condition of the loop
             condition_result = self.evaluate(node.condition)
 
+            budget = self.budget
             while condition_result:
                 #reevaluate condition each tijme
+                budget.ticks -= 1
+                if budget.ticks <= 0:
+                    budget.check()
 
                 for statement in node.code_block:
                     result = self.evaluate(statement)
@@ -305,7 +413,8 @@ class Interpreter:
             return self.END
         elif isinstance(node, FunctionNode):
             # Store function definition in a functions dictionary
-            self.functions[node.name] = node
+            resolve_function(node)
+            self.define_function(node.name, node)
             return None  # Function definitions don't return a value
         elif isinstance(node, FunctionCallNode):
             return self.evaluate_function_call(node)
@@ -325,6 +434,8 @@ class Interpreter:
     def evaluate_function_call(self, node):
         """Evaluate a function call"""
         if node.name not in self.functions:
+            if node.name in BUILTINS:
+                return self.call_builtin(BUILTINS[node.name], node)
             raise NameError(f"Function '{node.name}' is not defined")
         
         func_def = self.functions[node.name]
@@ -335,41 +446,65 @@ class Interpreter:
         
         # Evaluate arguments in the current (caller) scope
         arg_values = []
-        for i, (param_type, param_name) in enumerate(func_def.parameters):
-            arg_value = self.evaluate(node.arguments[i])
+        for argument, param_type in zip(node.arguments, func_def.param_types):
             # Type conversion based on parameter type
-            if param_type == 'int':
-                arg_value = int(arg_value)
-            elif param_type == 'double':
-                arg_value = float(arg_value)
-            elif param_type == 'bool':
-                arg_value = bool(arg_value)
-            elif param_type == 'string':
-                arg_value = str(arg_value)
-            arg_values.append((param_type, param_name, arg_value))
-        
-        # Create a new scope for function execution, inheriting global variables
-        old_variables = self.variables
-        self.variables = old_variables.copy()  # Start with global variables
+            arg_values.append(COERCIONS[param_type](self.evaluate(argument)))
         
-        # Bind arguments to parameters in the new scope (shadow globals if needed)
-        for param_type, param_name, arg_value in arg_values:
-            self.variables[param_name] = {'value': arg_value, 'type': param_type}
+        # Pure functions answer repeated calls from their cache
+        cache = None
+        if self.memo is not None:
+            cache = self.memo.cache_for(func_def, self.functions, self.variables)
+            if cache is not None:
+                key = tuple(arg_values)
+                result = self.memo.lookup(cache, key)
+                if result is not MISS:
+                    return result
         
-        # Execute function body
-        result = None
-        for statement in func_def.code_block:
-            result = self.evaluate(statement)
-            # Check for return statement
-            if isinstance(result, tuple) and result[0] == 'RETURN':
-                result = result[1]
-                break
+        # Locals get a fresh frame of slots; globals are shared, not copied
+        frame = [None] * func_def.slot_count
+        for slot, param_type, arg_value in zip(func_def.param_slots, func_def.param_types, arg_values):
+            if param_type == STRING:
+                frame[slot] = StringVariable(arg_value)
+            else:
+                frame[slot] = Variable(arg_value, param_type)
         
-        # Restore original variables
-        self.variables = old_variables
+        self.enter_call(node.name)
+        old_frame = self.frame
+        self.frame = frame
+        try:
+            # Execute function body
+            result = None
+            for statement in func_def.code_block:
+                result = self.evaluate(statement)
+                # Check for return statement
+                if isinstance(result, tuple) and result[0] == 'RETURN':
+                    result = result[1]
+                    break
+        finally:
+            # Back to the caller's frame
+            self.frame = old_frame
+            self.call_depth -= 1
         
+        if cache is not None:
+            self.memo.store(cache, key, result)
         return result
 
+    def call_builtin(self, builtin, node):
+        """Call a built-in array function; array variables it changes are passed as their cell"""
+        if len(node.arguments) != len(builtin.parameters):
+            raise ValueError(f"Function '{node.name}' expects {len(builtin.parameters)} arguments, got {len(node.arguments)}")
+        
+        arg_values = []
+        for kind, argument in zip(builtin.parameters, node.arguments):
+            if kind == 'target' and isinstance(argument, VariableNode):
+                var_info = self.lookup(argument.name, argument.slot)
+                if var_info is None:
+                    raise NameError(f"Variable '{argument.name}' is not defined")
+                arg_values.append(var_info)
+            else:
+                arg_values.append(self.evaluate(argument))
+        return builtin.call(arg_values)
+
 
 def test_interpreter():
     """Test the complete Salt pipeline: tokenize -> parse -> interpret"""
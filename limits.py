@@ -0,0 +1,175 @@
+"""
+Execution budgets for Salt programs
+
+An Interpreter can cap how much work a program does: steps (loop iterations
+and function calls), wall-clock time, array elements allocated, the length of
+any one string, and call depth. Going over a cap raises a LimitExceeded
+subclass, so callers can catch them all at once or tell them apart.
+
+Checking has to be cheap enough to leave on, so the engines only count down
+budget.ticks once per step; check() runs when it reaches zero, every
+CHECK_EVERY steps, and that's the only place that reads the clock.
+"""
+
+import time
+
+# Steps between looks at the clock
+CHECK_EVERY = 1024
+
+
+class LimitExceeded(Exception):
+    """A program went over one of its budgets"""
+
+
+class StepLimitExceeded(LimitExceeded):
+    pass
+
+
+class TimeLimitExceeded(LimitExceeded):
+    pass
+
+
+class MemoryLimitExceeded(LimitExceeded):
+    pass
+
+
+class CallDepthExceeded(LimitExceeded, RecursionError):
+    # Still a RecursionError, which is what running out of call depth used to raise
+    pass
+
+
+class Budget:
+    """Counts what a program uses against its limits (None means no limit)"""
+
+    def __init__(self, max_steps=None, max_time=None, max_array_elements=None, max_string_length=None):
+        self.max_steps = max_steps
+        self.max_time = max_time
+        self.max_array_elements = max_array_elements
+        self.max_string_length = max_string_length
+        self.steps = 0
+        self.array_elements = 0
+        self.deadline = None
+        self.period = self.ticks = self.next_period()
+
+    def start(self):
+        """Start the clock, the first time the program runs a statement"""
+        if self.max_time is not None and self.deadline is None:
+            self.deadline = time.monotonic() + self.max_time
+
+    def next_period(self):
+        # Check again right when the step limit would be passed
+        if self.max_steps is None:
+            return CHECK_EVERY
+        return max(1, min(CHECK_EVERY, self.max_steps - self.steps + 1))
+
+    def check(self):
+        """Called when ticks runs out: add up the steps since last time and look at the clock"""
+        self.steps += self.period - self.ticks
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise StepLimitExceeded(f"Step limit of {self.max_steps} exceeded")
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise TimeLimitExceeded(f"Time limit of {self.max_time:g} seconds exceeded")
+        self.period = self.ticks = self.next_period()
+
+    def steps_taken(self):
+        """Steps so far, including the ones not added up by check() yet"""
+        return self.steps + self.period - self.ticks
+
+    def charge(self, steps):
+        """Count several steps at once, e.g. a loop that ran as one batch"""
+        self.ticks -= steps
+        if self.ticks <= 0:
+            self.check()
+
+    def allocate(self, elements):
+        """Count a new array's elements before it's allocated"""
+        total = self.array_elements + elements
+        if self.max_array_elements is not None and total > self.max_array_elements:
+            raise MemoryLimitExceeded(f"Array limit of {self.max_array_elements} elements exceeded "
+                                      f"(asked for {elements} more)")
+        self.array_elements = total
+
+    def check_length(self, length):
+        """Check the length of a string before it's built"""
+        if self.max_string_length is not None and length > self.max_string_length:
+            raise MemoryLimitExceeded(f"String limit of {self.max_string_length} characters exceeded")
+
+    def check_repeat(self, left, right):
+        """Check a string repeated by *, e.g. "ab" * 1000000"""
+        if isinstance(left, str) and isinstance(right, int):
+            self.check_length(len(left) * right)
+        elif isinstance(right, str) and isinstance(left, int):
+            self.check_length(len(right) * left)
+
+    def concatenate(self, left, right):
+        """str(left) + str(right), checking the result's length first"""
+        left = str(left)
+        right = str(right)
+        self.check_length(len(left) + len(right))
+        return left + right
+
+
+def test_limits():
+    """Run a few runaway programs on each engine with small budgets"""
+    from interpreter import Interpreter, ENGINES
+    from math_parser import Parser
+    from tokenizer import lex
+    # The interpreter raises the classes from the imported module, not __main__
+    from limits import LimitExceeded
+
+    programs = {
+        'steps': ('make int x 0\nwhile TRUE\n{\n    make x x + 1\n}', {'max_steps': 10000}),
+        'time': ('make int x 0\nwhile TRUE\n{\n    make x x + 1\n}', {'max_time': 0.2}),
+        'arrays': ('make int array a[600]\nmake int array b[600]', {'max_array_elements': 1000}),
+        'strings': ('make string s "ab"\nmake int i 0\nloop i from 1 to 30\n{\n    make s s + s\n}',
+                    {'max_string_length': 100000}),
+    }
+    for engine in ENGINES:
+        for name, (code, limits) in programs.items():
+            interpreter = Interpreter(engine, **limits)
+            parser = Parser(lex(code))
+            try:
+                while parser.position < len(parser.tokens):
+                    statement = parser.parse_statement()
+                    if statement is not None:
+                        interpreter.execute(statement)
+                print(f"{engine} {name}: finished")
+            except LimitExceeded as e:
+                print(f"{engine} {name}: {type(e).__name__}: {e}")
+
+
+def test_batched_limits():
+    """Long loops the loop idioms would batch still stop at the limit, without building the whole result"""
+    import tracemalloc
+    from interpreter import Interpreter, ENGINES
+    from math_parser import Parser
+    from tokenizer import lex
+    from limits import LimitExceeded
+
+    programs = {
+        'steps': ('make int total 1\nmake int i 0\nloop i from 1 to 30000000\n{\n    make total total * 1\n}',
+                  {'max_steps': 1000}),
+        'strings': ('make string s ""\nmake int i 0\nloop i from 1 to 20000000\n{\n    make s s + "abcdefghij"\n}',
+                    {'max_string_length': 1000}),
+        'string elements': ('make string s ""\nmake int i 0\nloop i from 1 to 20000000\n{\n    make s s + i\n}',
+                            {'max_string_length': 1000}),
+    }
+    for engine in ENGINES:
+        for name, (code, limits) in programs.items():
+            interpreter = Interpreter(engine, **limits)
+            tracemalloc.start()
+            start = time.perf_counter()
+            try:
+                for statement in Parser(lex(code)).statements():
+                    interpreter.execute(statement)
+                outcome = "finished"
+            except LimitExceeded as e:
+                outcome = type(e).__name__
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{engine} {name}: {outcome} after {time.perf_counter() - start:.3f}s, peak {peak / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    test_limits()
+    test_batched_limits()
@@ -0,0 +1,431 @@
+"""
+Loop idiom recognition for Salt
+
+A counted loop (loop i from A to B) whose body is one of these statements
+runs as one batched pass over the whole range instead of one statement at a
+time:
+
+    make total total + arr[i]                  accumulate (+, - or *)
+    make arr[i] i * k                          fill an array
+    make dst[i] src[i]                         copy
+    if arr[i] gt 0 { make count count + 1 }    count matches
+
+The expression can use arr[i] for any array, the loop variable, constants,
+arithmetic, comparisons and any variable the body doesn't change.
+
+Nothing is changed until the idiom has been worked out for the whole range.
+If anything doesn't fit (an index out of bounds, dividing by zero, a value
+the loop would convert differently, ...) the loop just runs normally, so the
+results and errors are the same as without this.
+"""
+
+import operator
+from array import array
+from functools import reduce
+from itertools import islice, repeat
+
+from math_parser import NumberNode, StringNode, BooleanNode, ConstantNode, VariableNode, AssignmentNode, BinaryOpNode, ComparisonNode, LogicalNode, IfNode, UnaryOpNode, ArrayNode, ArrayAccessNode
+from salt_arrays import IntArray, DoubleArray, BitArray
+from salt_variables import ArrayVariable, COERCIONS, INT, DOUBLE, STRING
+
+ACCUMULATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+}
+
+ARITHMETIC = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '%': operator.mod,
+}
+
+COMPARISONS = {
+    'eq': operator.eq,
+    'neq': operator.ne,
+    'lt': operator.lt,
+    'gt': operator.gt,
+    'lteq': operator.le,
+    'gteq': operator.ge,
+}
+
+LOGICAL = {
+    'and': lambda left, right: left and right,
+    'or': lambda left, right: left or right,
+}
+
+# Kind of the values in each type of array, indexed by type code
+ELEMENT_KINDS = ('int', 'float', 'bool', 'str')
+
+# Longest loop run as one batch when there's a time limit
+MAX_TIMED_BATCH = 65536
+
+# Values joined at a time when appending to a string, so the string limit
+# stops a long append before it's all been built
+APPEND_CHUNK = 4096
+
+NUMERIC_KINDS = ('int', 'float', 'bool')
+
+
+class LoopIdiom:
+    """A loop body recognized as one of the idioms, ready to run over a range
+
+    kind is 'accumulate', 'store' or 'count'. target is the variable the body
+    changes. expression is the value (accumulate, store) or the condition
+    (count) as nested tuples, e.g. ('binary', '*', ('index',), ('const', 2)).
+    """
+
+    def __init__(self, kind, loop_range, target, slot, expression, operator=None, increment=None):
+        self.kind = kind
+        self.loop_range = loop_range
+        self.target = target
+        self.slot = slot
+        self.expression = expression
+        self.operator = operator  # accumulate: '+', '-' or '*'
+        self.increment = increment  # count: added once per match
+
+    def __repr__(self):
+        return f"LoopIdiom({self.kind} {self.target}, {self.expression})"
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'range': [self.loop_range.start, self.loop_range.stop, self.loop_range.step],
+            'target': self.target,
+            'slot': self.slot,
+            'expression': self.expression,
+            'operator': self.operator,
+            'increment': self.increment,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['kind'], range(*data['range']), data['target'], data['slot'],
+                   data['expression'], data['operator'], data['increment'])
+
+
+class NotBatchable(Exception):
+    """The idiom can't run as one batch this time, so the loop runs normally"""
+
+
+def match_idiom(node):
+    """The LoopIdiom for a ForNode's body, or None if it isn't one"""
+    if node.startIndex is None or node.step == 0 or len(node.code_block) != 1:
+        return None
+    loop_range = range(node.startIndex, node.endIndex + 1, node.step)
+    statement = node.code_block[0]
+
+    if isinstance(statement, AssignmentNode):
+        # make total total + <expression>
+        value = statement.value
+        if (statement.var_name == node.var or not isinstance(value, BinaryOpNode)
+                or value.operator not in ACCUMULATORS or not is_variable(value.left, statement.var_name)):
+            return None
+        expression = idiom_expression(value.right, node.var)
+        if expression is None:
+            return None
+        return LoopIdiom('accumulate', loop_range, statement.var_name, statement.slot, expression,
+                         operator=value.operator)
+
+    if isinstance(statement, ArrayNode) and not statement.is_declaration:
+        # make arr[i] <expression>
+        if not is_variable(statement.index, node.var):
+            return None
+        expression = idiom_expression(statement.value, node.var)
+        if expression is None:
+            return None
+        return LoopIdiom('store', loop_range, statement.var_name, statement.slot, expression)
+
+    if isinstance(statement, IfNode) and isinstance(statement.code_block, list) and len(statement.code_block) == 1:
+        # if <condition> { make count count + k }
+        inner = statement.code_block[0]
+        if not isinstance(inner, AssignmentNode) or inner.var_name == node.var:
+            return None
+        value = inner.value
+        if (not isinstance(value, BinaryOpNode) or value.operator != '+'
+                or not is_variable(value.left, inner.var_name)
+                or not isinstance(value.right, (NumberNode, ConstantNode))
+                or type(value.right.value) is not int):
+            return None
+        condition = idiom_expression(statement.condition, node.var)
+        if condition is None:
+            return None
+        return LoopIdiom('count', loop_range, inner.var_name, inner.slot, condition,
+                         increment=value.right.value)
+
+    return None
+
+
+def is_variable(node, name):
+    return isinstance(node, VariableNode) and node.name == name
+
+
+def idiom_expression(node, loop_var):
+    """node as a nested tuple the batch evaluator understands, or None"""
+    if isinstance(node, (NumberNode, BooleanNode, ConstantNode)):
+        return ('const', node.value)
+    elif isinstance(node, StringNode):
+        return ('const', node.value.strip('"'))
+    elif isinstance(node, VariableNode):
+        if node.name == loop_var:
+            return ('index',)
+        return ('var', node.name, node.slot)
+    elif isinstance(node, ArrayAccessNode):
+        if not is_variable(node.index, loop_var):
+            return None
+        return ('element', node.array_name, node.slot)
+
+    if isinstance(node, BinaryOpNode) and node.operator in ARITHMETIC:
+        tag, operands = 'binary', (node.left, node.right)
+    elif isinstance(node, ComparisonNode) and node.operator in COMPARISONS:
+        tag, operands = 'compare', (node.left, node.right)
+    elif isinstance(node, LogicalNode) and node.right and node.operator in LOGICAL:
+        tag, operands = 'logical', (node.left, node.right)
+    elif isinstance(node, LogicalNode) and not node.right and node.operator == 'not':
+        tag, operands = 'not', (node.left,)
+    elif isinstance(node, UnaryOpNode) and node.operator == '-':
+        tag, operands = 'negate', (node.operand,)
+    else:
+        return None
+
+    parts = [idiom_expression(operand, loop_var) for operand in operands]
+    if None in parts:
+        return None
+    if tag in ('not', 'negate'):
+        return (tag, parts[0])
+    return (tag, node.operator, parts[0], parts[1])
+
+
+def run_idiom(interp, idiom, loop_var):
+    """Run a recognized loop in one batch; False if the loop has to run normally"""
+    if not interp.optimize:
+        return False
+    loop_range = idiom.loop_range
+    if loop_range.step < 0:
+        return False
+    if not loop_range:
+        return True  # The body never runs
+    # The budget isn't looked at while a batch runs, so a loop that would go
+    # over the step limit, or run long enough to miss the deadline, runs
+    # normally and stops where it would have
+    budget = interp.budget
+    if budget.max_steps is not None and budget.steps_taken() + len(loop_range) > budget.max_steps:
+        return False
+    if budget.deadline is not None and len(loop_range) > MAX_TIMED_BATCH:
+        return False
+    try:
+        if idiom.kind == 'accumulate':
+            run_accumulate(interp, idiom)
+        elif idiom.kind == 'store':
+            run_store(interp, idiom)
+        else:
+            run_count(interp, idiom)
+    except (NotBatchable, ArithmeticError, TypeError, ValueError):
+        return False  # Nothing charged yet: the loop counts its own steps when it runs normally
+    interp.budget.charge(len(loop_range))  # One step per iteration, as if it ran
+    loop_var.value = loop_range[-1]
+    return True
+
+
+def target_info(interp, idiom, types):
+    var_info = interp.lookup(idiom.target, idiom.slot)
+    if var_info is None or var_info.__class__ is ArrayVariable or var_info.type not in types:
+        raise NotBatchable(idiom.target)
+    return var_info
+
+
+def run_accumulate(interp, idiom):
+    var_info = target_info(interp, idiom, (INT, DOUBLE, STRING))
+    values, kind, is_vector = evaluate(interp, idiom.expression, idiom)
+    count = len(idiom.loop_range)
+    var_type = var_info.type
+    current = var_info.value
+
+    if var_type == STRING:
+        # Each step is total + str(value)
+        if idiom.operator != '+':
+            raise NotBatchable(idiom.target)
+        var_info.value = current + appended(interp.budget, len(current), values, is_vector, count)
+        return
+
+    if not is_vector:
+        values = repeat(values, count)
+
+    # An int total has to get an int every step, or int() would cut each one
+    if kind not in NUMERIC_KINDS or (var_type == INT and kind == 'float'):
+        raise NotBatchable(idiom.target)
+    if var_type == INT and idiom.operator == '+' and isinstance(values, range):
+        # make total total + i: the sum of an arithmetic series
+        result = current + len(values) * (values[0] + values[-1]) // 2
+    else:
+        result = reduce(ACCUMULATORS[idiom.operator], values, current)
+    var_info.value = int(result) if var_type == INT else float(result)
+
+
+def appended(budget, length, values, is_vector, count):
+    """str() of every value joined, checking the string limit as it grows from length"""
+    if not is_vector:
+        text = str(values)
+        budget.check_length(length + len(text) * count)
+        return text * count
+    pieces = []
+    texts = map(str, values)
+    while True:
+        chunk = list(islice(texts, APPEND_CHUNK))
+        if not chunk:
+            return ''.join(pieces)
+        piece = ''.join(chunk)
+        length += len(piece)
+        budget.check_length(length)
+        pieces.append(piece)
+
+
+def run_store(interp, idiom):
+    var_info = interp.lookup(idiom.target, idiom.slot)
+    if var_info is None or var_info.__class__ is not ArrayVariable:
+        raise NotBatchable(idiom.target)
+    loop_range = idiom.loop_range
+    check_bounds(var_info, loop_range)
+    values, kind, is_vector = evaluate(interp, idiom.expression, idiom)
+    count = len(loop_range)
+    coerce = COERCIONS[var_info.type]
+    if not is_vector:
+        value = coerce(values)
+        if var_info.type == STRING:
+            interp.budget.check_length(len(value))
+        values = [value] * count
+    elif var_info.type == STRING:
+        # Check each string as it's made, so a too-long one stops the batch straight away
+        values = [checked_length(interp.budget, text) for text in map(str, values)]
+    else:
+        values = list(map(coerce, values))
+
+    # Every element is worked out before any is stored
+    storage = var_info.value
+    positions = slice(loop_range[0], loop_range[-1] + 1, loop_range.step)
+    if isinstance(storage, IntArray):
+        storage[positions] = array('q', values)  # OverflowError: the loop widens the array
+    elif isinstance(storage, DoubleArray):
+        storage[positions] = array('d', values)
+    elif isinstance(storage, BitArray):
+        flags = storage.tolist()
+        flags[positions] = values
+        storage.bits[:] = BitArray.from_values(flags).bits
+    else:
+        storage[positions] = values
+
+
+def checked_length(budget, text):
+    budget.check_length(len(text))
+    return text
+
+
+def run_count(interp, idiom):
+    var_info = target_info(interp, idiom, (INT,))
+    values, kind, is_vector = evaluate(interp, idiom.expression, idiom)
+    if is_vector:
+        matches = sum(map(bool, values))
+    else:
+        matches = len(idiom.loop_range) if values else 0
+    var_info.value = var_info.value + idiom.increment * matches
+
+
+def check_bounds(var_info, loop_range):
+    if loop_range[0] < 0 or loop_range[-1] >= var_info.size:
+        raise NotBatchable(var_info.size)  # The loop raises the IndexError
+
+
+def evaluate(interp, expression, idiom):
+    """An expression's values for the whole range: (values, kind, is_vector)
+
+    values is one value if the expression doesn't depend on the loop variable.
+    kind is 'int', 'float', 'bool', 'str' or 'any' (mixed).
+    """
+    tag = expression[0]
+    if tag == 'const':
+        value = expression[1]
+        return value, kind_of(value), False
+
+    if tag == 'index':
+        return idiom.loop_range, 'int', True
+
+    if tag == 'var':
+        name = expression[1]
+        var_info = interp.lookup(name, expression[2])
+        if name == idiom.target or var_info is None or var_info.__class__ is ArrayVariable:
+            raise NotBatchable(name)  # Changes during the loop, or isn't a plain value
+        value = var_info.value
+        return value, kind_of(value), False
+
+    if tag == 'element':
+        name = expression[1]
+        var_info = interp.lookup(name, expression[2])
+        if var_info is None or var_info.__class__ is not ArrayVariable:
+            raise NotBatchable(name)
+        loop_range = idiom.loop_range
+        check_bounds(var_info, loop_range)
+        storage = var_info.value
+        if isinstance(storage, BitArray):
+            storage = storage.tolist()
+        values = storage[loop_range[0]:loop_range[-1] + 1:loop_range.step]
+        return values, ELEMENT_KINDS[var_info.type], True
+
+    if tag in ('not', 'negate'):
+        values, kind, is_vector = evaluate(interp, expression[1], idiom)
+        if tag == 'not':
+            function, kind = operator.not_, 'bool'
+        else:
+            if kind not in NUMERIC_KINDS:
+                raise NotBatchable(tag)
+            function, kind = operator.neg, 'int' if kind == 'bool' else kind
+        if is_vector:
+            return map(function, values), kind, True
+        return function(values), kind, False
+
+    op = expression[1]
+    left, left_kind, left_vector = evaluate(interp, expression[2], idiom)
+    right, right_kind, right_vector = evaluate(interp, expression[3], idiom)
+    if tag == 'binary':
+        function, kind = arithmetic(op, left_kind, right_kind)
+    elif tag == 'compare':
+        function, kind = COMPARISONS[op], 'bool'
+    else:
+        function, kind = LOGICAL[op], left_kind if left_kind == right_kind else 'any'
+
+    if not (left_vector or right_vector):
+        return function(left, right), kind, False
+    count = len(idiom.loop_range)
+    if not left_vector:
+        left = repeat(left, count)
+    if not right_vector:
+        right = repeat(right, count)
+    return map(function, left, right), kind, True
+
+
+def arithmetic(op, left_kind, right_kind):
+    """The function for an arithmetic operator on these kinds, and its result's kind"""
+    if op == '+' and 'str' in (left_kind, right_kind) and 'any' not in (left_kind, right_kind):
+        return concatenate, 'str'
+    if left_kind not in NUMERIC_KINDS or right_kind not in NUMERIC_KINDS:
+        raise NotBatchable(op)
+    if op == '/' or 'float' in (left_kind, right_kind):
+        return ARITHMETIC[op], 'float'
+    return ARITHMETIC[op], 'int'
+
+
+def concatenate(left, right):
+    return str(left) + str(right)
+
+
+def kind_of(value):
+    if isinstance(value, bool):
+        return 'bool'
+    elif isinstance(value, int):
+        return 'int'
+    elif isinstance(value, float):
+        return 'float'
+    elif isinstance(value, str):
+        return 'str'
+    return 'any'
@@ -60,14 +60,14 @@ def main():
                 print(f"2. AST: {ast}")
                 
                 # Step 3: Evaluate
-                result = interpreter.evaluate(ast)
+                result = interpreter.execute(ast)
                 print(f"3. Result: {result}")
             else:
                 # Normal mode - just show the result
                 tokens = tokenize(user_input)
                 parser = Parser(tokens)
                 ast = parser.parse()
-                result = interpreter.evaluate(ast)
+                result = interpreter.execute(ast)
                 print(f"= {result}")
                 
         except ZeroDivisionError as e:
@@ -98,7 +98,7 @@ def run_examples():
             tokens = tokenize(expr)
             parser = Parser(tokens)
             ast = parser.parse()
-            result = interpreter.evaluate(ast)
+            result = interpreter.execute(ast)
             print(f"{expr:20} = {result}")
         except Exception as e:
             print(f"{expr:20} = Error: {e}")
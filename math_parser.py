@@ -1,12 +1,15 @@
-from tokenizer import tokenize
-from salt_language import KEYWORDS, TYPES, STATEMENT_STARTERS
+from tokenizer import tokenize, classify, Token, NUMBER, STRING, NAME
+from salt_language import TYPES, STATEMENT_STARTERS
 
 class ASTNode:
     """Base class for all AST nodes"""
-    pass
+    # Every node class lists its fields in __slots__, so a node has no
+    # per-instance __dict__ (large programs hold a lot of nodes)
+    __slots__ = ()
 
 class NumberNode(ASTNode):
     """Represents a number in the AST"""
+    __slots__ = ('value',)
     def __init__(self, value):
         # Preserve integer vs float based on whether there's a decimal point
         if '.' in str(value):
@@ -19,6 +22,7 @@ class NumberNode(ASTNode):
 
 class StringNode(ASTNode):
     """Represents a string in the AST"""
+    __slots__ = ('value',)
     def __init__(self, value):
         self.value = value  # Keep quotes for now
     
@@ -27,16 +31,28 @@ class StringNode(ASTNode):
 
 class BooleanNode(ASTNode):
     """Represents a boolean in the AST"""
+    __slots__ = ('value',)
     def __init__(self, value):
         self.value = value == 'TRUE'
     
     def __repr__(self):
         return f"Boolean({self.value})"
 
+class ConstantNode(ASTNode):
+    """A value worked out ahead of time by the optimizer"""
+    __slots__ = ('value',)
+    def __init__(self, value):
+        self.value = value  # Already the runtime value (strings have no quotes)
+    
+    def __repr__(self):
+        return f"Constant({self.value!r})"
+
 class VariableNode(ASTNode):
     """Represents a variable reference in the AST"""
+    __slots__ = ('name', 'slot')
     def __init__(self, name):
         self.name = name
+        self.slot = None  # Local slot index, set by the resolver
     
     def __repr__(self):
         return f"Variable({self.name})"
@@ -44,25 +60,31 @@ class VariableNode(ASTNode):
 
 class AssignmentNode(ASTNode):
     """changes the value of an existing varaible: make name value"""
+    __slots__ = ('var_name', 'value', 'slot', 'append')
     def __init__(self, var_name, value):
         self.var_name = var_name
         self.value = value
+        self.slot = None
+        self.append = None  # For make s s + a + b, (a, b) once the optimizer marks it as an append
     
     def __repr__(self):
         return f"Make({self.var_name} = {self.value})"
 
 class DeclarationNode(ASTNode):
     """Represents a variable declaration in Salt: make type name value"""
+    __slots__ = ('var_type', 'var_name', 'value', 'slot')
     def __init__(self, var_type, var_name, value):
         self.var_type = var_type
         self.var_name = var_name
         self.value = value
+        self.slot = None
     
     def __repr__(self):
         return f"Make({self.var_type} {self.var_name} = {self.value})"
 
 class BinaryOpNode(ASTNode):
     """Represents a binary operation (+, -, *, /) in the AST"""
+    __slots__ = ('left', 'operator', 'right')
     def __init__(self, left, operator, right):
         self.left = left
         self.operator = operator
@@ -73,6 +95,7 @@ class BinaryOpNode(ASTNode):
 
 class LogicalNode(ASTNode): 
     """for parsing 'and' and 'or' and 'not'"""
+    __slots__ = ('left', 'operator', 'right')
     def __init__(self, left, operator, right=None):
         self.left = left
         self.operator = operator
@@ -86,6 +109,7 @@ class LogicalNode(ASTNode):
 
 class ComparisonNode(ASTNode):
     """for parsing comparisons like x gt 5"""
+    __slots__ = ('left', 'operator', 'right')
     def __init__(self, left, operator, right):
         self.left = left
         self.operator = operator
@@ -95,6 +119,7 @@ class ComparisonNode(ASTNode):
 
 class IfNode(ASTNode): 
     """for parsing if statements"""
+    __slots__ = ('condition', 'code_block')
     def __init__(self, condition, code_block):
         self.condition = condition
         self.code_block = code_block  # List of statements in the block
@@ -103,12 +128,15 @@ class IfNode(ASTNode):
         return f"If({self.condition}, {self.code_block})"
     
 class ForNode(ASTNode):
+    __slots__ = ('var', 'code_block', 'startIndex', 'endIndex', 'step', 'slot', 'idiom')
     def __init__(self, var, code_block, startIndex=None, endIndex=None, step=None):
         self.var = var
         self.code_block = code_block 
         self.startIndex = startIndex
         self.endIndex = endIndex
         self.step = step
+        self.slot = None  # Slot of the loop variable
+        self.idiom = None  # LoopIdiom for the body once looked for, False if it isn't one
 
     def __repr__(self):
         if self.startIndex is None:
@@ -117,6 +145,7 @@ class ForNode(ASTNode):
             return f"For({self.var} from {self.startIndex} to {self.endIndex}, {self.code_block})"
 
 class WhileNode(ASTNode):
+    __slots__ = ('condition', 'code_block')
     def __init__(self, condition, code_block):
         self.condition = condition
         self.code_block = code_block 
@@ -125,16 +154,19 @@ class WhileNode(ASTNode):
     
 class SkipNode(ASTNode):
     """Represents a skip statement (continue)"""
+    __slots__ = ()
     def __repr__(self):
         return "Skip()"
 
 class EndNode(ASTNode):
     """Represents an end statement (break)"""
+    __slots__ = ()
     def __repr__(self):
         return "End()"
     
 class ArrayNode(ASTNode):
     """Represents an array declaration or array element assignment"""
+    __slots__ = ('var_type', 'var_name', 'size', 'index', 'value', 'is_declaration', 'slot')
     def __init__(self, var_type=None, var_name=None, size=None, index=None, value=None, is_declaration=True):
         self.var_type = var_type  # For declarations
         self.var_name = var_name
@@ -142,6 +174,7 @@ class ArrayNode(ASTNode):
         self.index = index  # For assignments/access
         self.value = value  # For assignments
         self.is_declaration = is_declaration  # True for declarations, False for assignments
+        self.slot = None
     
     def __repr__(self):
         if self.is_declaration:
@@ -152,6 +185,7 @@ class ArrayNode(ASTNode):
 
 class PrintNode(ASTNode):
     """Represents a print statement: print expression1 expression2 ..."""
+    __slots__ = ('expressions',)
     def __init__(self, expressions):
         self.expressions = expressions  # List of expressions to print
     
@@ -160,17 +194,26 @@ class PrintNode(ASTNode):
 
 class FunctionNode(ASTNode):
     """Represents a function definition"""
+    __slots__ = ('name', 'return_type', 'parameters', 'code_block', 'slot_count', 'param_slots', 'param_types',
+                 'pure_body', 'callees', 'local_names')
     def __init__(self, name, return_type, parameters, code_block):
         self.name = name
         self.return_type = return_type
         self.parameters = parameters  # List of (type, name) tuples
         self.code_block = code_block
+        self.slot_count = None  # Set by the resolver: number of local slots
+        self.param_slots = None  # Set by the resolver: slot of each parameter
+        self.param_types = None  # Set by the resolver: type code of each parameter
+        self.pure_body = None  # Set by the resolver: body has no side effects of its own
+        self.callees = None  # Set by the resolver: names of functions the body calls
+        self.local_names = None  # Set by the resolver: locals that aren't parameters
     
     def __repr__(self):
         return f"Function({self.name}, {self.return_type}, {self.parameters}, {self.code_block})"
 
 class FunctionCallNode(ASTNode):
     """Represents a function call"""
+    __slots__ = ('name', 'arguments')
     def __init__(self, name, arguments):
         self.name = name
         self.arguments = arguments  # List of expressions
@@ -180,6 +223,7 @@ class FunctionCallNode(ASTNode):
 
 class ReturnNode(ASTNode):
     """Represents a return statement"""
+    __slots__ = ('value',)
     def __init__(self, value):
         self.value = value
     
@@ -188,6 +232,7 @@ class ReturnNode(ASTNode):
 
 class UnaryOpNode(ASTNode):
     """Represents a unary operation (e.g., -x) in the AST"""
+    __slots__ = ('operator', 'operand')
     def __init__(self, operator, operand):
         self.operator = operator
         self.operand = operand
@@ -196,18 +241,47 @@ class UnaryOpNode(ASTNode):
 
 class ArrayAccessNode(ASTNode):
     """Represents array element access: array_name[index]"""
+    __slots__ = ('array_name', 'index', 'slot')
     def __init__(self, array_name, index):
         self.array_name = array_name
         self.index = index
+        self.slot = None
     
     def __repr__(self):
         return f"ArrayAccess({self.array_name}[{self.index}])"
 
+# Binding power of each binary operator (higher binds tighter) and the node
+# it makes. All of them are left-associative; unary minus binds tighter than
+# any of them (see parse_primary).
+INFIX = {
+    'or': (1, LogicalNode),
+    'and': (2, LogicalNode),
+    'eq': (4, ComparisonNode), 'neq': (4, ComparisonNode),
+    'lt': (4, ComparisonNode), 'gt': (4, ComparisonNode),
+    'lteq': (4, ComparisonNode), 'gteq': (4, ComparisonNode),
+    '+': (5, BinaryOpNode), '-': (5, BinaryOpNode),
+    '*': (6, BinaryOpNode), '/': (6, BinaryOpNode), '%': (6, BinaryOpNode),
+}
+
+# not takes a comparison: not x gt 1 is not (x gt 1), not a and b is (not a) and b
+NOT_POWER = 3
+
+
 class Parser:
     """Parses tokens into an Abstract Syntax Tree"""
     
     def __init__(self, tokens):
-        self.tokens = tokens
+        # Accept bare string tokens (from tokenize) or Token records (from lex).
+        # Records are already classified, so their kinds are used as-is; bare
+        # tokens are classified once here rather than every time they're looked at.
+        if tokens and isinstance(tokens[0], Token):
+            self.records = tokens
+            self.tokens = [token.value for token in tokens]
+            self.kinds = [token.kind for token in tokens]
+        else:
+            self.records = None
+            self.tokens = tokens
+            self.kinds = [classify(token) for token in tokens]
         self.position = 0
     
     def current_token(self):
@@ -216,6 +290,19 @@ class Parser:
             return None
         return self.tokens[self.position]
     
+    def current_kind(self):
+        """Get the kind (NUMBER, STRING, NAME, KEYWORD or OP) of the current token"""
+        if self.position >= len(self.tokens):
+            return None
+        return self.kinds[self.position]
+    
+    def current_location(self):
+        """Get (line, column) of the current token, or None if unknown"""
+        if self.records is None or self.position >= len(self.records):
+            return None
+        record = self.records[self.position]
+        return record.line, record.column
+    
     def advance(self):
         """Move to the next token"""
         self.position += 1
@@ -232,11 +319,12 @@ class Parser:
             operand = self.parse_primary()
             return UnaryOpNode('-', operand)
         
-        if token.replace('.', '').isdigit():
+        kind = self.current_kind()
+        if kind == NUMBER:
             # It's a number
             self.advance()
             return NumberNode(token)
-        elif token.startswith('"') and token.endswith('"'):
+        elif kind == STRING:
             # It's a string
             self.advance()
             return StringNode(token)
@@ -245,12 +333,12 @@ class Parser:
             return BooleanNode(token)
         elif token == '(':  # Parenthesized expression
             self.advance()
-            expr = self.parse_comparison()
+            expr = self.parse_expression()
             if self.current_token() != ')':
                 raise ValueError(f"Expected ')', got {self.current_token()}")
             self.advance()
             return expr
-        elif (token[0].isalpha() or token[0] == '_') and all(c.isalnum() or c == '_' for c in token) and token not in KEYWORDS:
+        elif kind == NAME:
             # It's a variable or function call
             name = token
             self.advance()
@@ -258,7 +346,7 @@ class Parser:
             # Check for array access: variable_name[index]
             if self.current_token() == '[':
                 self.advance()  # Skip '['
-                index = self.parse_comparison()  # Parse the index expression
+                index = self.parse_expression()  # Parse the index expression
                 if self.current_token() != ']':
                     raise ValueError(f"Expected ']', got {self.current_token()}")
                 self.advance()  # Skip ']'
@@ -270,59 +358,35 @@ class Parser:
         else:
             raise ValueError(f"Expected number, variable, string, boolean, or '(', got {token}")
     
-    def parse_term(self):
-        """Parse multiplication, division, and modulo (higher precedence)"""
-        result = self.parse_primary()
-        
-        while self.current_token() in ['*', '/', '%']:
-            operator = self.current_token()
-            self.advance()
-            right = self.parse_primary()
-            result = BinaryOpNode(result, operator, right)
-        
-        return result
-    
-    def parse_expression(self):
-        """Parse addition and subtraction (lower precedence)"""
-        result = self.parse_term()
-        
-        while self.current_token() in ['+', '-']:
-            operator = self.current_token()
-            self.advance()
-            right = self.parse_term()
-            result = BinaryOpNode(result, operator, right)
-        
-        return result
-    
-    def parse_comparison(self):
-        """parses comparisons and logical arguments"""
-        if self.current_token() == 'not': 
-            self.advance()
-            operand = self.parse_expression()
-            return LogicalNode(operand, 'not', None)
-        
-        left = self.parse_expression() # get left and move on
+    def parse_expression(self, power=0):
+        """Parse an expression whose operators all bind tighter than power
 
-        operator = self.current_token() #get the middle and check later
-    
-        if operator in ['and', 'or']: #NOW check what operator it is
+        This is a Pratt (precedence climbing) parser: INFIX gives each binary
+        operator its binding power, so one loop handles arithmetic,
+        comparisons, and/or chains and not with the right precedence, e.g.
+        a gt 1 and b lt 2 or not c eq 3 is ((a gt 1) and (b lt 2)) or (not (c eq 3)).
+        """
+        if self.current_token() == 'not':
             self.advance()
-            right = self.parse_expression()
-            return LogicalNode(left, operator, right)
-        elif operator in ['lt', 'gt', 'lteq', 'gteq', 'eq', 'neq']:
+            left = LogicalNode(self.parse_expression(NOT_POWER), 'not', None)
+        else:
+            left = self.parse_primary()
+
+        while True:
+            operator = self.current_token()
+            entry = INFIX.get(operator)
+            if entry is None or entry[0] <= power:
+                return left
             self.advance()
-            right = self.parse_expression()
-            return ComparisonNode(left, operator, right)
-        
-        # If no operator found, just return the left expression
-        return left
+            # Parsing the right side at the operator's own power makes it left-associative
+            left = entry[1](left, operator, self.parse_expression(entry[0]))
 
     def parse_if_statement(self):
         """parse if statement with condition and code block, and optional else block"""
         self.advance()  # skip the 'if'
         
         # Parse the condition
-        condition = self.parse_comparison()
+        condition = self.parse_expression()
         
         # Expect '{'
         if self.current_token() != '{':
@@ -380,7 +444,7 @@ class Parser:
                 
                 # Get array name
                 var_name = self.current_token()
-                if not var_name or not (var_name[0].isalpha() or var_name[0] == '_') or not all(c.isalnum() or c == '_' for c in var_name) or var_name in KEYWORDS:
+                if self.current_kind() != NAME:
                     raise ValueError(f"Expected array name, got {var_name}")
                 self.advance()
                 
@@ -390,7 +454,7 @@ class Parser:
                 self.advance()
                 
                 # Parse array size
-                size = self.parse_comparison()
+                size = self.parse_expression()
                 
                 # Expect ']'
                 if self.current_token() != ']':
@@ -401,34 +465,34 @@ class Parser:
             else:
                 # Regular variable declaration: make type name value
                 var_name = self.current_token()
-                if not var_name or not (var_name[0].isalpha() or var_name[0] == '_') or not all(c.isalnum() or c == '_' for c in var_name) or var_name in KEYWORDS:
+                if self.current_kind() != NAME:
                     raise ValueError(f"Expected variable name, got {var_name}")
                 self.advance()
                 
-                value = self.parse_comparison()
+                value = self.parse_expression()
                 return DeclarationNode(var_type, var_name, value)
         
         else:
             # This is an assignment: make name value or make name[index] value
             var_name = self.current_token()
-            if not var_name or not (var_name[0].isalpha() or var_name[0] == '_') or not all(c.isalnum() or c == '_' for c in var_name) or var_name in KEYWORDS:
+            if self.current_kind() != NAME:
                 raise ValueError(f"Expected variable name, got {var_name}")
             self.advance()
             
             # Check if this is an array element assignment: make name[index] value
             if self.current_token() == '[':
                 self.advance()  # Skip '['
-                index = self.parse_comparison()
+                index = self.parse_expression()
                 
                 if self.current_token() != ']':
                     raise ValueError(f"Expected ']', got {self.current_token()}")
                 self.advance()
                 
-                value = self.parse_comparison()
+                value = self.parse_expression()
                 return ArrayNode(var_name=var_name, index=index, value=value, is_declaration=False)
             else:
                 # Regular assignment: make name value
-                value = self.parse_comparison()
+                value = self.parse_expression()
                 return AssignmentNode(var_name, value)
     
     def parse_function_definition(self):
@@ -437,7 +501,7 @@ class Parser:
         
         # Get function name
         func_name = self.current_token()
-        if not func_name or not (func_name[0].isalpha() or func_name[0] == '_') or not all(c.isalnum() or c == '_' for c in func_name) or func_name in KEYWORDS:
+        if self.current_kind() != NAME:
             raise ValueError(f"Expected function name, got {func_name}")
         self.advance()
         
@@ -458,7 +522,7 @@ class Parser:
                 self.advance()
                 # Parse parameter name
                 param_name = self.current_token()
-                if not param_name or not (param_name[0].isalpha() or param_name[0] == '_') or not all(c.isalnum() or c == '_' for c in param_name) or param_name in KEYWORDS:
+                if self.current_kind() != NAME:
                     raise ValueError(f"Expected parameter name, got {param_name}")
                 self.advance()
                 parameters.append((param_type, param_name))
@@ -508,7 +572,7 @@ class Parser:
         
         # Keep parsing expressions until we hit a new statement or end of block
         while self.current_token() is not None and not self.is_statement_starter(self.current_token()) and self.current_token() != '}':
-            expression = self.parse_comparison()
+            expression = self.parse_expression()
             expressions.append(expression)
         
         return PrintNode(expressions)
@@ -519,7 +583,7 @@ class Parser:
         
         # Check if it's a literal number or a variable name
         token = self.current_token()
-        if token and token.replace('.', '').isdigit():
+        if self.current_kind() == NUMBER:
             # It's a literal number like "loop 5 times"
             var = int(token)
             self.advance()
@@ -531,25 +595,25 @@ class Parser:
                 step = None
             else:
                 raise ValueError(f"Expected 'times' after number, got {self.current_token()}")
-        elif token and (token[0].isalpha() or token[0] == '_') and all(c.isalnum() or c == '_' for c in token) and token not in KEYWORDS:
+        elif self.current_kind() == NAME:
             # It's a variable name like "loop x from 1 to 10"
             var = token  # Store variable name as string
             self.advance()
             if self.current_token() == 'from':
                 self.advance()
-                if self.current_token() and self.current_token().replace('.', '').isdigit():
+                if self.current_kind() == NUMBER:
                     startIndex = int(self.current_token())
                     self.advance()
                     if self.current_token() != 'to':
                         raise ValueError(f"Expected 'to' after start index, got {self.current_token()}")
                     self.advance()
-                    if self.current_token() and self.current_token().replace('.', '').isdigit():
+                    if self.current_kind() == NUMBER:
                         endIndex = int(self.current_token())
                         self.advance()
                         step = 1  # Default step (not really neccesary)
                         if self.current_token() == 'by':
                             self.advance()
-                            if self.current_token() and self.current_token().replace('.', '').isdigit():
+                            if self.current_kind() == NUMBER:
                                 step = int(self.current_token())
                                 self.advance()
                             else:
@@ -583,7 +647,7 @@ class Parser:
         """parse thru while statement"""
         self.advance() # skip 'while'
         
-        condition = self.parse_comparison()
+        condition = self.parse_expression()
         
         if self.current_token() != '{':
             raise ValueError(f"Expected '{{' after while condition, got {self.current_token()}")
@@ -627,14 +691,14 @@ class Parser:
         elif token == '}':  # Don't try to parse the closing brace as a statement
             return None
         else:
-            return self.parse_comparison()
+            return self.parse_expression()
     
     def parse_give_statement(self):
         """Parse a give statement (return statement)"""
         self.advance()  # Skip 'give'
         
         # Parse the return value
-        value = self.parse_comparison()
+        value = self.parse_expression()
         
         return ReturnNode(value)
     
@@ -650,7 +714,7 @@ class Parser:
                 raise ValueError("Expected ')' to close function call, reached end of input")
             
             # Parse argument expression
-            arg = self.parse_comparison()
+            arg = self.parse_expression()
             arguments.append(arg)
             
             # Check for comma or closing parenthesis
@@ -668,8 +732,62 @@ class Parser:
         """Parse the entire statement"""
         return self.parse_statement()
     
+    def statements(self):
+        """Yield top-level statements one at a time, skipping stray closing braces"""
+        while True:
+            while self.current_token() == '}':
+                self.advance()
+            if self.current_token() is None:
+                return
+            yield self.parse_statement()
+    
 #end of parser class
 
+
+class StreamParser(Parser):
+    """
+    Parser that pulls Token records from an iterator (e.g. lex_file) instead
+    of a list. Only the current token is held, so parsing a large file with
+    statements() keeps memory proportional to one statement.
+    """
+    
+    def __init__(self, tokens):
+        self.stream = iter(tokens)
+        self.records = None
+        self.tokens = None
+        self.kinds = None
+        self.position = 0
+        self.record = None
+        self.value = None
+        self.kind = None
+        self.advance()
+        self.position = 0
+    
+    def current_token(self):
+        """Get the current token without advancing"""
+        return self.value
+    
+    def current_kind(self):
+        """Get the kind (NUMBER, STRING, NAME, KEYWORD or OP) of the current token"""
+        return self.kind
+    
+    def current_location(self):
+        """Get (line, column) of the current token, or None at end of input"""
+        if self.record is None:
+            return None
+        return self.record.line, self.record.column
+    
+    def advance(self):
+        """Move to the next token"""
+        self.position += 1
+        record = next(self.stream, None)
+        self.record = record
+        if record is None:
+            self.value = None
+            self.kind = None
+        else:
+            self.kind, self.value = record[0], record[1]
+
 def print_tree(node, indent=0):
     """Pretty print the AST tree"""
     spaces = "  " * indent
@@ -711,7 +829,8 @@ def test_parser():
         "make string name \"hello\"",
         "make bool flag TRUE",
         "x + 10",
-        "make int result x * 2"
+        "make int result x * 2",
+        "make bool ok x gt 1 and x lt 10 and not x eq 5"
     ]
     
     print("Testing Salt parser:")
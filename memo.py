@@ -0,0 +1,94 @@
+"""
+Memoization of pure Salt functions
+
+A function is pure when its own body has no side effects (the resolver sets
+pure_body) and every function it calls is pure too. Calls to a pure function
+are cached per function in a small LRU keyed on the coerced argument values,
+so recursive numeric functions like fib stop recomputing the same calls.
+"""
+
+from collections import OrderedDict
+
+from salt_arrays import ARRAY_TYPES
+from salt_builtins import BUILTINS
+
+# Default number of results kept per function
+MEMO_SIZE = 1024
+
+# Parameter types whose coerced values make safe cache keys
+MEMO_TYPES = ('int', 'double', 'bool', 'string')
+
+# Returned by lookup() when a call isn't cached
+MISS = object()
+
+
+class FunctionMemo:
+    """Per-function LRU caches of pure function results, plus hit/miss counters"""
+
+    def __init__(self, size=MEMO_SIZE):
+        self.size = size
+        self.caches = {}  # Function name -> OrderedDict of argument tuple -> result
+        self.purity = {}  # Function name -> whether it's pure with the current definitions
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        """Forget everything; called whenever a function is (re)defined"""
+        self.caches.clear()
+        self.purity.clear()
+
+    def cache_for(self, function, functions, variables):
+        """The cache for calls to this function, or None if it isn't pure"""
+        cache = self.caches.get(function.name)
+        if cache is not None:
+            return cache
+        pure = self.purity.get(function.name)
+        if pure is None:
+            pure = self.is_pure(function.name, functions, variables, set())
+            self.purity[function.name] = pure
+        if not pure:
+            return None
+        cache = self.caches[function.name] = OrderedDict()
+        return cache
+
+    def is_pure(self, name, functions, variables, visiting):
+        """Whether a function and everything it calls are free of side effects"""
+        if name in visiting:
+            return True  # Recursion doesn't make a function impure
+        function = functions.get(name)
+        if function is None:
+            # Builtins only touch their arguments
+            return name in BUILTINS
+        if not function.pure_body:
+            return False
+        # Declaring a local while a global of the same name exists is an
+        # error, so such a call has to run for real
+        if any(local_name in variables for local_name in function.local_names):
+            return False
+        visiting.add(name)
+        return all(self.is_pure(callee, functions, variables, visiting) for callee in function.callees)
+
+    def declared_global(self, name, functions):
+        """Forget everything if a new global shadows some function's local"""
+        for function in functions.values():
+            if name in function.local_names:
+                self.clear()
+                return
+
+    def lookup(self, cache, key):
+        """The cached result for these arguments, or MISS"""
+        result = cache.get(key, MISS)
+        if result is MISS:
+            self.misses += 1
+        else:
+            self.hits += 1
+            cache.move_to_end(key)
+        return result
+
+    def store(self, cache, key, result):
+        """Remember a result, evicting the least recently used one if full"""
+        if isinstance(result, ARRAY_TYPES):
+            return  # Arrays are mutable, so callers can't share one
+        cache[key] = result
+        if len(cache) > self.size:
+            cache.popitem(last=False)
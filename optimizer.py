@@ -0,0 +1,300 @@
+"""
+AST optimizer for Salt
+
+Runs between the parser and the interpreter and rewrites a statement into
+one that does the same thing with less work at runtime:
+
+- Constant BinaryOpNode, UnaryOpNode, ComparisonNode and LogicalNode subtrees
+  are folded into a ConstantNode. Anything that would raise (dividing by
+  zero, "a" - 1, ...) is left alone so the error still happens when, and
+  only if, that code runs.
+- String literals become ConstantNodes with their quotes already stripped.
+- An if with a constant condition keeps only the branch that runs, and that
+  branch is spliced into the surrounding block when that can't change what
+  skip/end/give do.
+- Statements that can never run are dropped: anything after skip or end in
+  an if or loop block, and anything after give at the top of a function
+  body. (A give inside an if that isn't its last statement doesn't return,
+  so code after it there stays.)
+- An assignment like make s s + a + b whose value nobody uses (in a loop
+  body, or not last in its block) is marked as an append: if s turns out
+  to be a string, the engines add a and b to it in place (salt_strings.py).
+"""
+
+from limits import Budget, LimitExceeded
+from math_parser import NumberNode, StringNode, BooleanNode, ConstantNode, VariableNode, AssignmentNode, DeclarationNode, BinaryOpNode, ComparisonNode, LogicalNode, PrintNode, IfNode, ForNode, WhileNode, SkipNode, EndNode, FunctionNode, FunctionCallNode, ReturnNode, UnaryOpNode, ArrayNode, ArrayAccessNode
+
+# Folding a string longer than this is left for runtime (e.g. "ab" * 1000000)
+MAX_FOLDED_STRING = 4096
+# Checks a repeated string's length before it's built, not after
+FOLD_BUDGET = Budget(max_string_length=MAX_FOLDED_STRING)
+
+
+def optimize(node):
+    """Optimize one top-level statement, returning the node to run instead"""
+    node = optimize_node(node)
+    mark_appends([node], True)
+    return node
+
+
+def optimize_node(node):
+    if isinstance(node, StringNode):
+        return ConstantNode(node.value.strip('"'))
+
+    elif isinstance(node, BinaryOpNode):
+        node.left = optimize_node(node.left)
+        node.right = optimize_node(node.right)
+        if node.operator == '*' and is_constant(node.left) and is_constant(node.right):
+            try:
+                FOLD_BUDGET.check_repeat(node.left.value, node.right.value)
+            except LimitExceeded:
+                return node
+        return fold(node, binary_value, node.operator, node.left, node.right)
+
+    elif isinstance(node, ComparisonNode):
+        node.left = optimize_node(node.left)
+        node.right = optimize_node(node.right)
+        return fold(node, comparison_value, node.operator, node.left, node.right)
+
+    elif isinstance(node, LogicalNode):
+        node.left = optimize_node(node.left)
+        if node.right:
+            node.right = optimize_node(node.right)
+            return fold(node, logical_value, node.operator, node.left, node.right)
+        return fold(node, not_value, node.operator, node.left)
+
+    elif isinstance(node, UnaryOpNode):
+        node.operand = optimize_node(node.operand)
+        return fold(node, unary_value, node.operator, node.operand)
+
+    elif isinstance(node, (DeclarationNode, AssignmentNode, ReturnNode)):
+        node.value = optimize_node(node.value)
+
+    elif isinstance(node, ArrayNode):
+        if node.size is not None:
+            node.size = optimize_node(node.size)
+        if node.index is not None:
+            node.index = optimize_node(node.index)
+        if node.value is not None:
+            node.value = optimize_node(node.value)
+
+    elif isinstance(node, ArrayAccessNode):
+        node.index = optimize_node(node.index)
+
+    elif isinstance(node, PrintNode):
+        node.expressions = [optimize_node(expr) for expr in node.expressions]
+
+    elif isinstance(node, FunctionCallNode):
+        node.arguments = [optimize_node(argument) for argument in node.arguments]
+
+    elif isinstance(node, IfNode):
+        return optimize_if(node)
+
+    elif isinstance(node, ForNode):
+        node.code_block = optimize_block(node.code_block, 'loop')
+
+    elif isinstance(node, WhileNode):
+        node.condition = optimize_node(node.condition)
+        if is_constant(node.condition) and not node.condition.value:
+            node.code_block = []  # The body never runs
+        else:
+            node.code_block = optimize_block(node.code_block, 'loop')
+
+    elif isinstance(node, FunctionNode):
+        node.code_block = optimize_block(node.code_block, 'function')
+
+    return node
+
+
+def optimize_if(node):
+    """Fold the condition; with a constant one, keep just the branch that runs"""
+    node.condition = optimize_node(node.condition)
+    if isinstance(node.code_block, tuple):
+        if_block, else_block = node.code_block
+        if_block = optimize_block(if_block, 'if')
+        else_block = optimize_block(else_block, 'if')
+        node.code_block = (if_block, else_block)
+    else:
+        if_block = optimize_block(node.code_block, 'if')
+        else_block = None
+        node.code_block = if_block
+
+    if not is_constant(node.condition):
+        return node
+    if node.condition.value:
+        return IfNode(ConstantNode(True), if_block)
+    if else_block is not None:
+        return IfNode(ConstantNode(True), else_block)
+    return IfNode(ConstantNode(False), [])
+
+
+def optimize_block(statements, kind):
+    """Optimize a block of statements; kind is 'function', 'if' or 'loop'"""
+    block = []
+    last = len(statements) - 1
+    for i, statement in enumerate(statements):
+        statement = optimize_node(statement)
+        if is_constant_if(statement) and can_inline(statement.code_block, kind, i == last):
+            block.extend(statement.code_block)
+        else:
+            block.append(statement)
+        if ends_block(block[-1] if block else None, kind):
+            break
+    return block
+
+
+def is_constant_if(node):
+    return isinstance(node, IfNode) and is_constant(node.condition) and not isinstance(node.code_block, tuple)
+
+
+def can_inline(branch, kind, is_last):
+    """Whether running branch's statements directly in the block is the same as the if"""
+    if not branch:
+        # An if that runs nothing still gives None as the block's last value
+        return kind == 'loop' or not is_last
+    if kind == 'function':
+        # Inside the if, skip/end stop the branch and a non-tail give is
+        # ignored; in a function body they wouldn't be
+        return not any(may_escape(statement) for statement in branch[:-1])
+    # If and loop blocks treat skip/end/give the same way an if does
+    return True
+
+
+def may_escape(node):
+    """Whether a statement can give back skip, end or a give"""
+    if isinstance(node, (SkipNode, EndNode, ReturnNode)):
+        return True
+    if isinstance(node, IfNode):
+        blocks = node.code_block if isinstance(node.code_block, tuple) else (node.code_block,)
+        return any(may_escape(statement) for block in blocks for statement in block)
+    return False
+
+
+def ends_block(node, kind):
+    """Whether nothing after this statement in the block can run"""
+    if kind == 'function':
+        return isinstance(node, ReturnNode)
+    return isinstance(node, (SkipNode, EndNode))
+
+
+def mark_appends(block, last_used):
+    """Mark make s s + ... assignments whose value is thrown away as appends
+
+    last_used says whether the block's last statement gives the value of
+    something, like the result of a function without a give.
+    """
+    last = len(block) - 1
+    for i, statement in enumerate(block):
+        used = last_used and i == last
+        if isinstance(statement, AssignmentNode):
+            statement.append = None if used else append_pieces(statement)
+        elif isinstance(statement, IfNode):
+            blocks = statement.code_block if isinstance(statement.code_block, tuple) else (statement.code_block,)
+            for if_block in blocks:
+                mark_appends(if_block, used)
+        elif isinstance(statement, (ForNode, WhileNode)):
+            mark_appends(statement.code_block, False)
+        elif isinstance(statement, FunctionNode):
+            mark_appends(statement.code_block, True)
+
+
+def append_pieces(node):
+    """(a, b) for make s s + a + b, or None if it isn't one"""
+    pieces = []
+    value = node.value
+    while isinstance(value, BinaryOpNode) and value.operator == '+':
+        pieces.append(value.right)
+        value = value.left
+    if not pieces or not isinstance(value, VariableNode) or value.name != node.var_name:
+        return None
+    # s is read before the pieces run, so a call that changes s would see a different order
+    if any(has_call(piece) for piece in pieces):
+        return None
+    return tuple(reversed(pieces))
+
+
+def has_call(node):
+    if isinstance(node, FunctionCallNode):
+        return True
+    if isinstance(node, (BinaryOpNode, ComparisonNode, LogicalNode)):
+        return has_call(node.left) or (node.right is not None and has_call(node.right))
+    if isinstance(node, UnaryOpNode):
+        return has_call(node.operand)
+    if isinstance(node, ArrayAccessNode):
+        return has_call(node.index)
+    return False
+
+
+def is_constant(node):
+    return isinstance(node, (NumberNode, BooleanNode, ConstantNode))
+
+
+def fold(node, compute, operator, *operands):
+    """Replace node with its value if all operands are constants and it evaluates cleanly"""
+    if not all(is_constant(operand) for operand in operands):
+        return node
+    try:
+        value = compute(operator, *(operand.value for operand in operands))
+    except Exception:
+        return node  # Raise at runtime instead, like unoptimized code
+    if isinstance(value, str) and len(value) > MAX_FOLDED_STRING:
+        return node
+    return ConstantNode(value)
+
+
+# These match Interpreter.evaluate exactly
+
+def binary_value(operator, left, right):
+    if operator == '+':
+        if isinstance(left, str) or isinstance(right, str):
+            return str(left) + str(right)
+        return left + right
+    elif operator == '-':
+        return left - right
+    elif operator == '*':
+        return left * right
+    elif operator == '/':
+        if right == 0:
+            raise ZeroDivisionError("Cannot divide by zero!")
+        return left / right
+    elif operator == '%':
+        if right == 0:
+            raise ZeroDivisionError("Cannot modulo by zero!")
+        return left % right
+    raise ValueError(f"Unknown operator: {operator}")
+
+
+def comparison_value(operator, left, right):
+    if operator == 'eq':
+        return left == right
+    elif operator == 'neq':
+        return left != right
+    elif operator == 'lt':
+        return left < right
+    elif operator == 'gt':
+        return left > right
+    elif operator == 'lteq':
+        return left <= right
+    elif operator == 'gteq':
+        return left >= right
+    raise ValueError(f"Unknown comparison operator: {operator}")
+
+
+def logical_value(operator, left, right):
+    if operator == 'and':
+        return left and right
+    elif operator == 'or':
+        return left or right
+    raise ValueError(f"Unknown logical operator: {operator}")
+
+
+def not_value(operator, operand):
+    if operator == 'not':
+        return not operand
+    raise ValueError(f"Unknown logical operator: {operator}")
+
+
+def unary_value(operator, operand):
+    if operator == '-':
+        return -operand
+    raise ValueError(f"Unknown unary operator: {operator}")
@@ -0,0 +1,235 @@
+"""
+Profiler for Salt programs
+
+    ./salt --profile program.salt
+    ./salt --profile-json profile.json program.salt
+
+Profiling swaps in two subclasses: ProfilingParser remembers the source line
+each statement starts on, and ProfilingInterpreter times every evaluate().
+The plain Parser and Interpreter have no profiling code in them, so a
+program that isn't being profiled runs exactly as fast as before.
+
+Recorded per source line (statements) and per AST node type:
+- count: times it ran
+- total: seconds from start to finish, counted once even when it recurses
+- self: total minus the time spent in nested statements (for lines) or
+  nested nodes (for node types)
+
+and per function: calls and inclusive time, from entering the body to
+returning (a memoized call that skips the body adds no time).
+
+Profiling runs on the tree engine: the closure and vm engines compile nodes
+away, so there is nothing left to time them by.
+"""
+
+import json
+import time
+
+from interpreter import Interpreter
+from math_parser import StreamParser, FunctionCallNode
+
+# Rows shown per table by report()
+TOP_ROWS = 20
+
+
+class ProfilingParser(StreamParser):
+    """A StreamParser that records the line each statement starts on in self.lines"""
+
+    def __init__(self, tokens):
+        self.lines = {}  # Statement node -> line
+        super().__init__(tokens)
+
+    def parse_statement(self):
+        location = self.current_location()
+        statement = super().parse_statement()
+        if statement is not None and location is not None:
+            self.lines[statement] = location[0]
+        return statement
+
+
+class Profile:
+    """Counts and times collected by a ProfilingInterpreter"""
+
+    def __init__(self):
+        self.lines = {}  # Line -> [count, total, self]
+        self.nodes = {}  # Node type -> [count, total, self]
+        self.functions = {}  # Function name -> [calls, inclusive time]
+        self.total = 0.0  # Seconds spent running top-level statements
+
+    def to_dict(self, source=None):
+        """The profile as plain data for JSON, hottest first"""
+        return {
+            'total': self.total,
+            'lines': [{'line': line, 'count': count, 'total': total, 'self': own,
+                       'source': source_line(source, line)}
+                      for line, (count, total, own) in hottest(self.lines)],
+            'nodes': [{'node': kind, 'count': count, 'total': total, 'self': own}
+                      for kind, (count, total, own) in hottest(self.nodes)],
+            'functions': [{'function': name, 'calls': calls, 'total': total}
+                          for name, (calls, total) in sorted(self.functions.items(), key=lambda item: -item[1][1])],
+        }
+
+    def report(self, source=None, rows=TOP_ROWS):
+        """A text table of the hottest lines, node types and functions"""
+        out = [f"Profile: {self.total:.6f}s in top-level statements", "",
+               f"{'Line':>6} {'Count':>10} {'Total(s)':>11} {'Self(s)':>11}  Source"]
+        for line, (count, total, own) in hottest(self.lines)[:rows]:
+            out.append(f"{line:>6} {count:>10} {total:>11.6f} {own:>11.6f}  {source_line(source, line) or ''}")
+
+        out += ["", f"{'Node':<18} {'Count':>10} {'Total(s)':>11} {'Self(s)':>11}"]
+        for kind, (count, total, own) in hottest(self.nodes)[:rows]:
+            out.append(f"{kind:<18} {count:>10} {total:>11.6f} {own:>11.6f}")
+
+        if self.functions:
+            out += ["", f"{'Function':<18} {'Calls':>10} {'Total(s)':>11}"]
+            functions = sorted(self.functions.items(), key=lambda item: -item[1][1])
+            for name, (calls, total) in functions[:rows]:
+                out.append(f"{name:<18} {calls:>10} {total:>11.6f}")
+        return '\n'.join(out)
+
+
+def hottest(table):
+    """Rows of a [count, total, self] table, most self time first"""
+    return sorted(table.items(), key=lambda item: -item[1][2])
+
+
+def source_line(source, line):
+    if source is None or line is None or not 0 < line <= len(source):
+        return None
+    return source[line - 1].strip()
+
+
+class ProfilingInterpreter(Interpreter):
+    """A tree-engine Interpreter that times every node it evaluates
+
+    lines maps statement nodes to their source line (ProfilingParser.lines).
+    """
+
+    def __init__(self, lines, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.engine != 'tree':
+            raise ValueError("Profiling only works with the tree engine")
+        self.lines = lines
+        self.profile = Profile()
+        self.line = None  # Line of the statement running now
+        self.node_children = [0.0]  # Time spent in nested nodes, per running node
+        self.line_children = [0.0]  # Time spent in nested statements, per running statement
+        self.running = {}  # Node type, line or function -> how many are running (for recursion)
+        self.call_starts = []  # When each running function body was entered
+
+    def execute(self, node):
+        self.line = self.lines.get(node, self.line)
+        start = time.perf_counter()
+        try:
+            return super().execute(node)
+        finally:
+            self.profile.total += time.perf_counter() - start
+
+    def enter_call(self, name):
+        super().enter_call(name)
+        self.call_starts.append(time.perf_counter())
+
+    def evaluate(self, node):
+        outer_line = self.line
+        line = self.lines.get(node)
+        # The optimizer may have replaced a top-level statement, so it
+        # counts as one whether or not the parser saw it
+        is_statement = line is not None or len(self.line_children) == 1
+        if line is None:
+            line = outer_line
+        self.line = line
+        kind = type(node).__name__
+        running = self.running
+        calls = len(self.call_starts)
+
+        self.node_children.append(0.0)
+        if is_statement:
+            self.line_children.append(0.0)
+            running[line] = running.get(line, 0) + 1
+        running[kind] = running.get(kind, 0) + 1
+        start = time.perf_counter()
+        try:
+            return Interpreter.evaluate(self, node)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.line = outer_line
+
+            running[kind] -= 1
+            children = self.node_children.pop()
+            self.node_children[-1] += elapsed
+            add_time(self.profile.nodes, kind, elapsed, elapsed - children, running[kind] == 0)
+
+            if is_statement:
+                running[line] -= 1
+                children = self.line_children.pop()
+                self.line_children[-1] += elapsed
+                add_time(self.profile.lines, line, elapsed, elapsed - children, running[line] == 0)
+
+            if isinstance(node, FunctionCallNode):
+                self.record_call(node.name, calls, elapsed)
+
+    def record_call(self, name, calls, elapsed):
+        entry = self.profile.functions.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        if len(self.call_starts) > calls:
+            # The body ran (not a memo hit or a builtin)
+            elapsed = time.perf_counter() - self.call_starts.pop()
+        elif name in self.functions:
+            return
+        key = ('function', name)
+        if not self.running.get(key):
+            entry[1] += elapsed
+
+    def evaluate_function_call(self, node):
+        key = ('function', node.name)
+        self.running[key] = self.running.get(key, 0) + 1
+        try:
+            return super().evaluate_function_call(node)
+        finally:
+            self.running[key] -= 1
+
+
+def add_time(table, key, total, own, outermost):
+    entry = table.get(key)
+    if entry is None:
+        entry = table[key] = [0, 0.0, 0.0]
+    entry[0] += 1
+    if outermost:
+        entry[1] += total  # Recursive runs are already inside the outer one's total
+    entry[2] += own
+
+
+def write_json(profile, path, source=None):
+    with open(path, 'w') as f:
+        json.dump(profile.to_dict(source), f, indent=2)
+        f.write('\n')
+
+
+def test_profiler():
+    """Profile a small program with a loop and a recursive function"""
+    from tokenizer import lex
+    code = '''make function fib takes int n gives int
+{
+    if n lt 2
+    {
+        give n
+    }
+    give fib(n - 1) + fib(n - 2)
+}
+make int total 0
+make int i 0
+loop i from 1 to 2000
+{
+    make total total + i * i
+}
+print fib(12)
+'''
+    parser = ProfilingParser(lex(code))
+    interpreter = ProfilingInterpreter(parser.lines, memo_size=0, optimize=False)
+    for statement in parser.statements():
+        interpreter.execute(statement)
+    print(interpreter.profile.report(code.splitlines()))
+
+
+if __name__ == "__main__":
+    test_profiler()
@@ -0,0 +1,113 @@
+"""
+Cache of parsed programs
+
+The web app gets the same programs over and over, so each process keeps the
+statements it parsed for recent sources in an LRU keyed on a hash of the
+source. A hit skips tokenizing and parsing; the statements still run fresh
+every time. The cache is bounded by a rough count of the bytes its ASTs
+hold, not by the number of programs.
+
+With flat=True the statements are kept in the flat encoding (flat_ast.py),
+which holds several times more programs in the same bytes; each hit then
+decodes the statements again as they run.
+"""
+
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+from flat_ast import encode
+
+# Default bound on the bytes held by cached ASTs
+MAX_BYTES = 32 * 1024 * 1024
+
+
+def source_key(code):
+    return hashlib.sha256(code.encode('utf-8', 'surrogatepass')).digest()
+
+
+def ast_size(value, seen=None):
+    """Rough bytes held by an AST: every node, its attributes and their values"""
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(ast_size(item, seen) for item in value)
+    elif hasattr(value, '__dict__'):
+        size += sys.getsizeof(value.__dict__)
+        size += sum(ast_size(item, seen) for item in value.__dict__.values())
+    elif hasattr(value, '__slots__'):
+        # AST nodes keep their fields in slots, which getsizeof already counts
+        for cls in type(value).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                size += ast_size(getattr(value, name, None), seen)
+    return size
+
+
+class ProgramCache:
+    """LRU of source hash -> (statements, parse error), bounded by bytes held"""
+
+    def __init__(self, max_bytes=MAX_BYTES, flat=False):
+        self.max_bytes = max_bytes
+        self.flat = flat  # Keep statements as FlatPrograms
+        self.entries = OrderedDict()  # Key -> (program, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, code):
+        """The cached program for this source, or None"""
+        key = source_key(code)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            program = entry[0]
+        if self.flat:
+            flat, error = program
+            return flat.statements(), error
+        return program
+
+    def put(self, code, program):
+        """Remember a parsed program, evicting the least recently used ones to make room"""
+        if self.flat:
+            statements, error = program
+            program = (encode(statements), error)
+        size = ast_size(program) + sys.getsizeof(code)
+        if size > self.max_bytes:
+            return  # Would push everything else out
+        key = source_key(code)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (program, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'programs': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,162 @@
+"""
+Resolver pass for Salt functions
+
+Gives every parameter and every variable declared inside a function body a
+fixed slot index, so a call can keep its locals in a small list (a frame)
+instead of copying the whole variable table. Names that aren't local are
+left with slot None and looked up in the global table at runtime.
+
+The slot is stored on the nodes that name a variable (VariableNode,
+DeclarationNode, AssignmentNode, ArrayNode, ArrayAccessNode and ForNode).
+
+The same pass also records whether a function body is pure on its own (see
+find_side_effects), which is what lets calls to it be memoized.
+"""
+
+from memo import MEMO_TYPES
+from salt_variables import TYPE_CODES
+from math_parser import VariableNode, AssignmentNode, DeclarationNode, BinaryOpNode, ComparisonNode, LogicalNode, PrintNode, IfNode, ForNode, WhileNode, FunctionNode, FunctionCallNode, ReturnNode, UnaryOpNode, ArrayNode, ArrayAccessNode
+
+
+def resolve_function(func_def):
+    """Assign slots for a function's parameters and locals (only done once per function)"""
+    if func_def.slot_count is not None:
+        return
+
+    slots = {}
+    param_slots = []
+    for param_type, param_name in func_def.parameters:
+        # A repeated parameter name shares one slot; the last argument wins
+        param_slots.append(slots.setdefault(param_name, len(slots)))
+
+    for statement in func_def.code_block:
+        collect_declarations(statement, slots)
+    for statement in func_def.code_block:
+        assign_slots(statement, slots)
+
+    func_def.param_slots = param_slots
+    func_def.param_types = tuple(TYPE_CODES[param_type] for param_type, param_name in func_def.parameters)
+    func_def.slot_count = len(slots)
+
+    callees = set()
+    pure = all(param_type in MEMO_TYPES for param_type, param_name in func_def.parameters)
+    for statement in func_def.code_block:
+        if find_side_effects(statement, callees):
+            pure = False
+    func_def.pure_body = pure
+    func_def.callees = frozenset(callees)
+    params = set(name for param_type, name in func_def.parameters)
+    func_def.local_names = tuple(name for name in slots if name not in params)
+
+
+def collect_declarations(node, slots):
+    """Give every name declared in this subtree a slot"""
+    if isinstance(node, DeclarationNode):
+        slots.setdefault(node.var_name, len(slots))
+    elif isinstance(node, ArrayNode) and node.is_declaration:
+        slots.setdefault(node.var_name, len(slots))
+    for child in block_children(node):
+        collect_declarations(child, slots)
+
+
+def assign_slots(node, slots):
+    """Record the slot (or None for a global) on every node that names a variable"""
+    if isinstance(node, VariableNode):
+        node.slot = slots.get(node.name)
+    elif isinstance(node, (DeclarationNode, AssignmentNode)):
+        node.slot = slots.get(node.var_name)
+        assign_slots(node.value, slots)
+    elif isinstance(node, ArrayNode):
+        node.slot = slots.get(node.var_name)
+        for child in (node.size, node.index, node.value):
+            if child is not None:
+                assign_slots(child, slots)
+    elif isinstance(node, ArrayAccessNode):
+        node.slot = slots.get(node.array_name)
+        assign_slots(node.index, slots)
+    elif isinstance(node, ForNode):
+        if node.startIndex is not None:
+            node.slot = slots.get(node.var)
+        for statement in node.code_block:
+            assign_slots(statement, slots)
+    elif isinstance(node, (BinaryOpNode, ComparisonNode)):
+        assign_slots(node.left, slots)
+        assign_slots(node.right, slots)
+    elif isinstance(node, LogicalNode):
+        assign_slots(node.left, slots)
+        if node.right:
+            assign_slots(node.right, slots)
+    elif isinstance(node, UnaryOpNode):
+        assign_slots(node.operand, slots)
+    elif isinstance(node, ReturnNode):
+        assign_slots(node.value, slots)
+    elif isinstance(node, PrintNode):
+        for expr in node.expressions:
+            assign_slots(expr, slots)
+    elif isinstance(node, FunctionCallNode):
+        for argument in node.arguments:
+            assign_slots(argument, slots)
+    elif isinstance(node, IfNode):
+        assign_slots(node.condition, slots)
+        for statement in block_children(node):
+            assign_slots(statement, slots)
+    elif isinstance(node, WhileNode):
+        assign_slots(node.condition, slots)
+        for statement in node.code_block:
+            assign_slots(statement, slots)
+    # A nested FunctionNode is resolved on its own when it is defined
+
+
+def find_side_effects(node, callees):
+    """True if this subtree prints, touches a global or defines a function.
+
+    Names of called functions are added to callees; whether those are pure
+    is only known at call time, once they've been defined.
+    """
+    if isinstance(node, PrintNode) or isinstance(node, FunctionNode):
+        return True
+    if isinstance(node, (VariableNode, DeclarationNode, AssignmentNode, ArrayNode, ArrayAccessNode)):
+        if node.slot is None:
+            return True  # Reads or writes a global
+    elif isinstance(node, ForNode) and node.startIndex is not None and node.slot is None:
+        return True  # Global loop variable
+    elif isinstance(node, FunctionCallNode):
+        callees.add(node.name)
+
+    effects = False
+    for child in expression_children(node) + block_children(node):
+        if find_side_effects(child, callees):
+            effects = True
+    return effects
+
+
+def expression_children(node):
+    """The expressions directly inside a node"""
+    if isinstance(node, (DeclarationNode, AssignmentNode, ReturnNode)):
+        return [node.value]
+    if isinstance(node, (BinaryOpNode, ComparisonNode)):
+        return [node.left, node.right]
+    if isinstance(node, LogicalNode):
+        return [node.left, node.right] if node.right else [node.left]
+    if isinstance(node, UnaryOpNode):
+        return [node.operand]
+    if isinstance(node, ArrayNode):
+        return [child for child in (node.size, node.index, node.value) if child is not None]
+    if isinstance(node, ArrayAccessNode):
+        return [node.index]
+    if isinstance(node, FunctionCallNode):
+        return list(node.arguments)
+    if isinstance(node, (IfNode, WhileNode)):
+        return [node.condition]
+    return []
+
+
+def block_children(node):
+    """The statements nested directly inside an if/loop (not inside nested functions)"""
+    if isinstance(node, IfNode):
+        if isinstance(node.code_block, tuple):
+            return list(node.code_block[0]) + list(node.code_block[1])
+        return node.code_block
+    if isinstance(node, (ForNode, WhileNode)):
+        return node.code_block
+    return []
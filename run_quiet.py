@@ -2,54 +2,60 @@
 """
 Quiet File Runner for Salt Programming Language
 
-Usage: python3 run_quiet.py program.salt
+Usage: python3 run_quiet.py [--engine tree|closure|vm] [--max-depth N] [--memo-size N | --no-memo] [--no-optimize] [--stats]
+       [--max-steps N] [--max-time SECONDS] [--max-array-elements N] [--max-string N]
+       [--profile] [--profile-json FILE] program.salt
 """
 
+import argparse
 import sys
-from tokenizer import tokenize
-from math_parser import Parser
-from interpreter import Interpreter
+from tokenizer import lex_file
+from math_parser import StreamParser
+from interpreter import Interpreter, ENGINES, MAX_CALL_DEPTH
+from memo import MEMO_SIZE
+from profiler import ProfilingParser, ProfilingInterpreter, write_json
 
 
-def run_file(filename):
-    """Run a program file written in our language"""
+def run_file(filename, engine='tree', max_depth=MAX_CALL_DEPTH, memo_size=MEMO_SIZE, optimize=True, stats=False,
+             limits=None, profile=False, profile_json=None):
+    """Run a program file written in our language
+
+    limits: keyword arguments for the Interpreter's budgets, e.g. {'max_steps': 1000000}
+    profile: print a table of the hottest lines, node types and functions
+    profile_json: write the profile to this file as JSON
+    """
+    profiling = profile or profile_json is not None
     try:
-        # Read the entire file
         with open(filename, 'r') as f:
-            source_code = f.read()
-        
-        # Process the entire file as a stream of tokens
-        # Remove comments and empty lines first
-        cleaned_lines = []
-        lines = source_code.strip().split('\n')
-        for line in lines:
-            line = line.strip()
-            if line and not line.startswith('#'):
-                cleaned_lines.append(line)
-        
-        # Join all lines and tokenize the entire content
-        full_code = ' '.join(cleaned_lines)
-        tokens = tokenize(full_code)
-        
-        interpreter = Interpreter()
-        parser = Parser(tokens)
-        
-        # Parse and execute statements one by one
-        while parser.current_token() is not None:
+            # Tokens are lexed lazily from the file, and each top-level
+            # statement is executed (and dropped) before the next is parsed
+            if profiling:
+                parser = ProfilingParser(lex_file(f))
+                interpreter = ProfilingInterpreter(parser.lines, engine, max_depth, memo_size, optimize,
+                                                   **(limits or {}))
+            else:
+                parser = StreamParser(lex_file(f))
+                interpreter = Interpreter(engine, max_depth, memo_size, optimize, **(limits or {}))
             try:
-                # Skip stray closing braces at the top level
-                while parser.current_token() == '}':
-                    parser.advance()
-                
-                if parser.current_token() is None:
-                    break
-                
-                # Parse one complete statement
-                ast = parser.parse()
-                interpreter.evaluate(ast)
+                for ast in parser.statements():
+                    interpreter.execute(ast)
             except Exception as e:
                 print(f"Error: {e}")
-                break
+            
+            if stats:
+                print(f"Max call depth: {interpreter.max_depth_reached}", file=sys.stderr)
+                print(f"Steps: {interpreter.budget.steps_taken()}, array elements: {interpreter.budget.array_elements}",
+                      file=sys.stderr)
+                if interpreter.memo is not None:
+                    print(f"Memo: {interpreter.memo.hits} hits, {interpreter.memo.misses} misses", file=sys.stderr)
+
+            if profiling:
+                f.seek(0)
+                source = f.read().splitlines()
+                if profile:
+                    print(interpreter.profile.report(source), file=sys.stderr)
+                if profile_json is not None:
+                    write_json(interpreter.profile, profile_json, source)
     
     except FileNotFoundError:
         print(f"Error: File '{filename}' not found")
@@ -58,12 +64,39 @@ def run_file(filename):
 
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python3 run_quiet.py <filename>")
-        sys.exit(1)
+    arg_parser = argparse.ArgumentParser(description="Run a Salt program quietly")
+    arg_parser.add_argument('filename', help="the .salt file to run")
+    arg_parser.add_argument('--engine', choices=ENGINES, default='tree',
+                            help="execution engine (default: tree)")
+    arg_parser.add_argument('--max-depth', type=int, default=MAX_CALL_DEPTH,
+                            help=f"maximum nested function calls (default: {MAX_CALL_DEPTH})")
+    arg_parser.add_argument('--memo-size', type=int, default=MEMO_SIZE,
+                            help=f"results cached per pure function (default: {MEMO_SIZE})")
+    arg_parser.add_argument('--no-memo', dest='memo_size', action='store_const', const=0,
+                            help="don't memoize pure functions")
+    arg_parser.add_argument('--no-optimize', dest='optimize', action='store_false',
+                            help="run the AST exactly as parsed")
+    arg_parser.add_argument('--stats', action='store_true',
+                            help="print call depth and memo stats to stderr")
+    arg_parser.add_argument('--max-steps', type=int,
+                            help="stop after this many loop iterations and function calls")
+    arg_parser.add_argument('--max-time', type=float,
+                            help="stop after this many seconds")
+    arg_parser.add_argument('--max-array-elements', type=int,
+                            help="most array elements the program can allocate in all")
+    arg_parser.add_argument('--max-string', dest='max_string_length', type=int,
+                            help="longest string the program can build")
+    arg_parser.add_argument('--profile', action='store_true',
+                            help="print the hottest lines, node types and functions to stderr (tree engine)")
+    arg_parser.add_argument('--profile-json', metavar='FILE',
+                            help="write the profile to FILE as JSON (tree engine)")
+    args = arg_parser.parse_args()
+    if (args.profile or args.profile_json) and args.engine != 'tree':
+        arg_parser.error("--profile only works with --engine tree")
+    limits = {name: getattr(args, name) for name in ('max_steps', 'max_time', 'max_array_elements', 'max_string_length')}
     
-    filename = sys.argv[1]
-    run_file(filename)
+    run_file(args.filename, args.engine, args.max_depth, args.memo_size, args.optimize, args.stats, limits,
+             args.profile, args.profile_json)
 
 
 if __name__ == "__main__":
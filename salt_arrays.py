@@ -0,0 +1,290 @@
+"""
+Compact storage for Salt arrays
+
+int and double arrays are backed by array.array (8 bytes per element, no
+boxed objects) and bool arrays by a packed bitset (1 bit per element).
+string arrays stay plain lists.
+
+Salt code can still see an array as a value: it prints and compares like the
+Python list it replaces, and adds to a string as that list's text. Arithmetic
+on numeric arrays is elementwise (a + b, a * 2.0, -a) and runs as one batched
+pass over the storage; the result is a new array value, which assignment
+converts to the target array's element type (see store_array).
+"""
+
+import operator
+from array import array
+from itertools import repeat
+
+from salt_variables import INT, DOUBLE, BOOL
+
+
+def as_list(value):
+    """A typed array as a plain list; anything else unchanged"""
+    if isinstance(value, ListLike):
+        return value.tolist()
+    return value
+
+
+def elementwise(op, left, right):
+    """Apply op to each pair of elements; either side may be a number instead of an array"""
+    size = len(left) if isinstance(left, NUMERIC_ARRAYS) else len(right)
+    left_values = operand(left, size)
+    right_values = operand(right, size)
+    if left_values is None or right_values is None:
+        return NotImplemented
+    try:
+        values = list(map(op, left_values, right_values))
+    except ZeroDivisionError:
+        if op is operator.mod:
+            raise ZeroDivisionError("Cannot modulo by zero!")
+        raise ZeroDivisionError("Cannot divide by zero!")
+    if op is not operator.truediv and is_integral(left) and is_integral(right):
+        return int_array(values)
+    return DoubleArray.from_values(values)
+
+
+def operand(value, size):
+    """Something to map over for one side of an elementwise operation"""
+    if isinstance(value, NUMERIC_ARRAYS):
+        if len(value) != size:
+            raise ValueError(f"Arrays must be the same size, got {size} and {len(value)}")
+        return value
+    if isinstance(value, (int, float)):
+        return repeat(value, size)
+    return None
+
+
+def is_integral(value):
+    return isinstance(value, (IntArray, BitArray, WideIntArray, int))
+
+
+def int_array(values):
+    """An int array of these values, as a list if any is too big for 64 bits"""
+    try:
+        return IntArray.from_values(values)
+    except OverflowError:
+        return WideIntArray(values)
+
+
+class ListLike:
+    """Makes an array behave like a list when used as a Salt value"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def __eq__(self, other):
+        return self.tolist() == as_list(other)
+
+    def __ne__(self, other):
+        return self.tolist() != as_list(other)
+
+    def __lt__(self, other):
+        return self.tolist() < as_list(other)
+
+    def __le__(self, other):
+        return self.tolist() <= as_list(other)
+
+    def __gt__(self, other):
+        return self.tolist() > as_list(other)
+
+    def __ge__(self, other):
+        return self.tolist() >= as_list(other)
+
+    def __add__(self, other):
+        return elementwise(operator.add, self, other)
+
+    def __radd__(self, other):
+        return elementwise(operator.add, other, self)
+
+    def __sub__(self, other):
+        return elementwise(operator.sub, self, other)
+
+    def __rsub__(self, other):
+        return elementwise(operator.sub, other, self)
+
+    def __mul__(self, other):
+        return elementwise(operator.mul, self, other)
+
+    def __rmul__(self, other):
+        return elementwise(operator.mul, other, self)
+
+    def __truediv__(self, other):
+        return elementwise(operator.truediv, self, other)
+
+    def __rtruediv__(self, other):
+        return elementwise(operator.truediv, other, self)
+
+    def __mod__(self, other):
+        return elementwise(operator.mod, self, other)
+
+    def __rmod__(self, other):
+        return elementwise(operator.mod, other, self)
+
+    def __neg__(self):
+        return elementwise(operator.mul, self, -1)
+
+    __hash__ = None
+
+
+class IntArray(ListLike, array):
+    """int elements as signed 64-bit machine integers"""
+    __slots__ = ()
+
+    def __new__(cls, size):
+        return cls.filled(size, 0)
+
+    @classmethod
+    def filled(cls, size, value):
+        # Copying a same-typed array allocates exactly size elements
+        return array.__new__(cls, 'q', array('q', [value]) * size)
+
+    @classmethod
+    def from_values(cls, values):
+        return array.__new__(cls, 'q', values)
+
+
+class DoubleArray(ListLike, array):
+    """double elements as C doubles"""
+    __slots__ = ()
+
+    def __new__(cls, size):
+        return cls.filled(size, 0.0)
+
+    @classmethod
+    def filled(cls, size, value):
+        return array.__new__(cls, 'd', array('d', [value]) * size)
+
+    @classmethod
+    def from_values(cls, values):
+        return array.__new__(cls, 'd', values)
+
+
+class WideIntArray(ListLike, list):
+    """An int array holding a value too big for 64 bits, as a plain list"""
+    __slots__ = ()
+
+    @classmethod
+    def filled(cls, size, value):
+        return cls([value] * size)
+
+    def tolist(self):
+        return list(self)
+
+
+# Maps the bytes 0 and 1 to the digits '0' and '1'
+BIT_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+
+
+class BitArray(ListLike):
+    """bool elements packed 8 to a byte"""
+    __slots__ = ('bits', 'size')
+
+    def __init__(self, size):
+        self.bits = bytearray((size + 7) >> 3)
+        self.size = size
+
+    @classmethod
+    def filled(cls, size, value):
+        bit_array = cls(size)
+        if value:
+            bit_array.bits[:] = b'\xff' * len(bit_array.bits)
+        return bit_array
+
+    @classmethod
+    def from_values(cls, values):
+        flags = bytes(map(bool, values))
+        bit_array = cls(len(flags))
+        if flags:
+            # Element i is bit i of one big integer, stored little-endian
+            number = int(flags.translate(BIT_DIGITS)[::-1], 2)
+            bit_array.bits[:] = number.to_bytes(len(bit_array.bits), 'little')
+        return bit_array
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError("array index out of range")
+        return bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def __setitem__(self, index, value):
+        if not 0 <= index < self.size:
+            raise IndexError("array index out of range")
+        if value:
+            self.bits[index >> 3] |= 1 << (index & 7)
+        else:
+            self.bits[index >> 3] &= ~(1 << (index & 7))
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        # Each byte's bits, lowest first, cut to the array's size
+        text = ''.join([format(byte, '08b')[::-1] for byte in self.bits])
+        return [bit == '1' for bit in text[:self.size]]
+
+
+# Arrays that take part in elementwise arithmetic
+NUMERIC_ARRAYS = (IntArray, DoubleArray, BitArray, WideIntArray)
+
+# Every type an array's value can have
+ARRAY_TYPES = NUMERIC_ARRAYS + (list,)
+
+# Storage for each element type, indexed by type code
+ARRAY_STORAGE = (
+    IntArray,
+    DoubleArray,
+    BitArray,
+    lambda size: [""] * size,
+)
+
+
+def new_array(element_type, size):
+    """Storage for a new array of an element type code, filled with the type's default value"""
+    return ARRAY_STORAGE[element_type](size)
+
+
+def widen_array(var_info):
+    """Switch an int array to a plain list, for a value too big for 64 bits"""
+    var_info.value = WideIntArray(var_info.value)
+    return var_info.value
+
+
+def convert_array(element_type, values):
+    """New storage for element_type holding values, each converted to that type"""
+    if element_type == INT:
+        if isinstance(values, IntArray):
+            return IntArray.from_values(values)
+        return int_array(list(map(int, values)))
+    elif element_type == DOUBLE:
+        return DoubleArray.from_values(values if isinstance(values, DoubleArray) else list(map(float, values)))
+    elif element_type == BOOL:
+        return BitArray.from_values(values)
+    return list(map(str, values))
+
+
+def filled_array(element_type, size, value):
+    """New storage for element_type with every element set to value (already converted)"""
+    if element_type == INT:
+        try:
+            return IntArray.filled(size, value)
+        except OverflowError:
+            return WideIntArray.filled(size, value)
+    elif element_type == DOUBLE:
+        return DoubleArray.filled(size, value)
+    elif element_type == BOOL:
+        return BitArray.filled(size, value)
+    return [value] * size
+
+
+def store_array(var_info, value):
+    """Whole-array assignment: copy an array value's elements into an array variable"""
+    if not isinstance(value, ARRAY_TYPES):
+        raise TypeError(f"Cannot assign {value} to an array")
+    if len(value) != var_info.size:
+        raise ValueError(f"Array size mismatch: expected {var_info.size} elements, got {len(value)}")
+    var_info.value = convert_array(var_info.type, value)
+    return var_info.value
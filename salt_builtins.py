@@ -0,0 +1,92 @@
+"""
+Built-in array functions for Salt
+
+Each one works on a whole array in a single batched pass over its storage,
+instead of a Salt loop visiting one element at a time:
+
+    sum(a)  min(a)  max(a)  mean(a)  dot(a, b)
+    fill(a, value)      set every element of a
+    copy(a, b)          copy b's elements into a
+
+A user function with the same name takes precedence over a builtin.
+
+Parameters are 'array' (any array value, e.g. a or a * 2), 'target' (an
+array variable that gets changed; the engine passes its ArrayVariable) or
+'value' (any value).
+"""
+
+import operator
+from functools import reduce
+
+from salt_arrays import ARRAY_TYPES, store_array, filled_array
+from salt_variables import ArrayVariable, COERCIONS
+
+
+class Builtin:
+    """A native function callable from Salt like a user-defined one"""
+
+    def __init__(self, name, parameters, function):
+        self.name = name
+        self.parameters = parameters  # Kind of each parameter
+        self.function = function
+
+    def __repr__(self):
+        return f"Builtin({self.name})"
+
+    def call(self, arg_values):
+        """Check the arguments' kinds, then run the builtin"""
+        for position, (kind, value) in enumerate(zip(self.parameters, arg_values), 1):
+            if kind == 'array' and not isinstance(value, ARRAY_TYPES):
+                raise TypeError(f"{self.name}() expects an array as argument {position}, got {value}")
+            if kind == 'target' and value.__class__ is not ArrayVariable:
+                raise TypeError(f"{self.name}() expects an array variable as argument {position}")
+        return self.function(*arg_values)
+
+
+def total(values):
+    # Left to right from 0, so it matches a Salt loop adding up the array
+    return reduce(operator.add, values, 0)
+
+
+def same_size(a, b):
+    if len(a) != len(b):
+        raise ValueError(f"Arrays must be the same size, got {len(a)} and {len(b)}")
+
+
+def builtin_mean(values):
+    return total(values) / len(values)
+
+
+def builtin_dot(a, b):
+    same_size(a, b)
+    return total(map(operator.mul, a, b))
+
+
+def builtin_fill(target, value):
+    value = COERCIONS[target.type](value)
+    target.value = filled_array(target.type, target.size, value)
+    return value
+
+
+def builtin_copy(target, source):
+    store_array(target, source)
+    return None
+
+
+BUILTINS = {
+    'sum': Builtin('sum', ('array',), total),
+    'min': Builtin('min', ('array',), min),
+    'max': Builtin('max', ('array',), max),
+    'mean': Builtin('mean', ('array',), builtin_mean),
+    'dot': Builtin('dot', ('array', 'array'), builtin_dot),
+    'fill': Builtin('fill', ('target', 'value'), builtin_fill),
+    'copy': Builtin('copy', ('target', 'array'), builtin_copy),
+}
+
+
+def target_positions(name):
+    """Argument positions of a builtin that take an array variable itself"""
+    builtin = BUILTINS.get(name)
+    if builtin is None:
+        return ()
+    return [i for i, kind in enumerate(builtin.parameters) if kind == 'target']
@@ -0,0 +1,221 @@
+"""
+Syntax checking for the web editor
+
+check(code) parses a whole buffer and reports every syntax error with its
+line and column, where running a program stops at the first one.
+
+The tokens are first split into top-level statements: a new one starts at
+each statement keyword (make, print, if, ...) outside any braces. Each is
+parsed on its own, so an error only spoils the statement it's in. Inside a
+statement that failed (a block that's never closed, say) parsing picks up
+again at the next statement keyword.
+
+A Checker remembers the errors for each top-level statement of the last
+buffer it checked, keyed by the statement's tokens, so after an edit only
+the statements whose tokens changed are parsed again. The buffer is split
+with tokenize(), which only produces token text and is several times quicker
+than lex(); lines and columns are worked out just for the tokens that have
+an error. The web app keeps a Checker per editor session (CheckSessions).
+"""
+
+import threading
+from collections import OrderedDict
+
+from math_parser import Parser
+from salt_language import STATEMENT_STARTERS
+from tokenizer import tokenize, VALUE_PATTERN
+
+MAX_ERRORS = 100  # Errors reported for one buffer
+MAX_SESSIONS = 1000  # Checkers CheckSessions keeps
+
+
+def split_statements(values):
+    """Index of the first token of each top-level statement"""
+    starts = [0] if values else []
+    depth = 0
+    for index, value in enumerate(values):
+        if value == '{':
+            depth += 1
+        elif value == '}':
+            if depth:
+                depth -= 1
+        elif depth == 0 and value in STATEMENT_STARTERS and index:
+            starts.append(index)
+    return starts
+
+
+def parse_errors(values, end):
+    """
+    Syntax errors in values[:end] as (token index, message, at token).
+    values[end], if it's there, is the start of the next statement: the
+    parser can see it (so a missing value says "got print" like it would in
+    the whole program) but doesn't parse it.
+
+    at token is True when the token itself is the mistake (an unmatched
+    '}'). Otherwise the parser expected something else there, which might
+    really be missing from the end of the line before (see error_location).
+    """
+    parser = Parser(values)
+    errors = []
+    recovering = False
+    while True:
+        while parser.position < end and parser.current_token() == '}':
+            if not recovering:
+                errors.append((parser.position, "Unmatched '}'", True))
+            parser.advance()
+        if parser.position >= end:
+            return errors
+        start = parser.position
+        try:
+            parser.parse_statement()
+        except Exception as e:
+            errors.append((min(parser.position, end), str(e), False))
+            # Skip the rest of the broken statement: pick up at the next statement keyword
+            recovering = True
+            position = max(parser.position, start + 1)
+            while position < end and values[position] not in STATEMENT_STARTERS:
+                position += 1
+            parser.position = position
+
+
+class Checker:
+    """Checks successive versions of one buffer, re-parsing only the statements that changed"""
+
+    def __init__(self):
+        self.statements = {}  # Tokens of a statement (and the next one's first) -> its errors
+        self.lock = threading.Lock()
+
+    def check(self, code):
+        """{'errors': [{'line', 'column', 'message'}, ...], 'statements': n, 'reparsed': n}"""
+        with self.lock:
+            values = tokenize(code)
+            starts = split_statements(values)
+            ends = starts[1:] + [len(values)]
+            previous = self.statements
+            statements = {}
+            errors = []
+            reparsed = 0
+            for start, end in zip(starts, ends):
+                key = tuple(values[start:end + 1])
+                found = statements.get(key)
+                if found is None:
+                    found = previous.get(key)
+                if found is None:
+                    found = parse_errors(values[start:end + 1], end - start)
+                    reparsed += 1
+                statements[key] = found
+                errors.extend((start + index, message, at_token) for index, message, at_token in found)
+            self.statements = statements
+
+        errors = errors[:MAX_ERRORS]
+        positions = token_positions(code, [index for error in errors for index in (error[0] - 1, error[0])])
+        return {
+            'errors': [error_location(positions, *error) for error in errors],
+            'statements': len(starts),
+            'reparsed': reparsed,
+        }
+
+
+def token_positions(code, indexes):
+    """{token index: (line, column, text)} for the given token indexes"""
+    wanted = {index for index in indexes if index >= 0}
+    positions = {}
+    if not wanted:
+        return positions
+    last = max(wanted)
+    index = 0
+    line = 1
+    line_start = 0
+    scanned = 0
+    for match in VALUE_PATTERN.finditer(code):
+        text = match.group(1)
+        if text is None:
+            continue  # A comment
+        if index in wanted:
+            start = match.start(1)
+            newlines = code.count('\n', scanned, start)
+            if newlines:
+                line += newlines
+                line_start = code.rfind('\n', scanned, start) + 1
+            scanned = start
+            positions[index] = (line, start - line_start + 1, text)
+        if index == last:
+            break
+        index += 1
+    return positions
+
+
+def error_location(positions, index, message, at_token):
+    # When the parser expected something else at the first token of a line,
+    # what's missing is from the end of the line before (make int y, then
+    # print on the next line), so it's reported just past the previous
+    # token. Same when input ran out. An error about the token itself stays on it.
+    position = positions.get(index)
+    before = positions.get(index - 1)
+    if position is not None and (at_token or before is None or position[0] == before[0]):
+        return {'line': position[0], 'column': position[1], 'message': message}
+    line, column, text = before
+    newlines = text.count('\n')  # A string can run over several lines
+    if newlines:
+        return {'line': line + newlines, 'column': len(text) - text.rfind('\n'), 'message': message}
+    return {'line': line, 'column': column + len(text), 'message': message}
+
+
+def check(code):
+    """Every syntax error in code (see Checker.check)"""
+    return Checker().check(code)
+
+
+class CheckSessions:
+    """A Checker per editor session, dropping the least recently used past max_sessions"""
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.checkers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def check(self, session, code):
+        """Check code with the session's Checker (a fresh one when session is None)"""
+        if session is None:
+            return check(code)
+        with self.lock:
+            checker = self.checkers.pop(session, None)
+            if checker is None:
+                checker = Checker()
+            self.checkers[session] = checker
+            while len(self.checkers) > self.max_sessions:
+                self.checkers.popitem(last=False)
+        return checker.check(code)
+
+
+def test_check():
+    """Check a buffer with several errors, then edit one statement"""
+    code = '\n'.join([
+        'make int x 5',
+        'make int y',
+        'print "x is" x',
+        'if x gt 1 and y lt',
+        '{',
+        '    print "big"',
+        '}',
+        'make string s "ok"',
+        'loop i from 1 to',
+        '{',
+        '    print i',
+        '}',
+        'print s',
+    ])
+    checker = Checker()
+    result = checker.check(code)
+    print(f"{result['statements']} statements, {result['reparsed']} parsed")
+    for error in result['errors']:
+        print(f"  line {error['line']}, column {error['column']}: {error['message']}")
+
+    fixed = code.replace('make int y\n', 'make int y 2\n')
+    result = checker.check(fixed)
+    print(f"After fixing line 2: {len(result['errors'])} errors, {result['reparsed']} of "
+          f"{result['statements']} statements parsed again")
+
+
+if __name__ == "__main__":
+    test_check()
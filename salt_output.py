@@ -0,0 +1,66 @@
+"""
+Output sinks for Salt's print statement
+
+An Interpreter sends each printed line to its output sink's write() instead
+of calling print(). A sink only has to have:
+
+- write(line): take one printed line, without its newline
+- flush(): pass on anything it's holding
+
+The Interpreter flushes its sink at the end of every top-level statement, so
+output never shows up after an error message or a runner's own output for a
+later statement. Between flushes a sink is free to hold on to lines.
+"""
+
+import sys
+
+# Characters StreamSink holds before writing them out
+BUFFER_SIZE = 64 * 1024
+
+
+class StreamSink:
+    """Writes printed lines to a text stream in large batches
+
+    stream defaults to whatever sys.stdout is when the lines are written, so
+    contextlib.redirect_stdout still works. buffer_size=0 writes every line
+    straight away, which is what you want at a terminal.
+    """
+
+    def __init__(self, stream=None, buffer_size=BUFFER_SIZE):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.lines = []
+        self.pending = 0  # Characters in lines
+
+    def write(self, line):
+        self.lines.append(line)
+        self.pending += len(line) + 1
+        if self.pending > self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.lines:
+            return
+        stream = self.stream if self.stream is not None else sys.stdout
+        text = '\n'.join(self.lines)
+        self.lines.clear()
+        self.pending = 0
+        stream.write(text + '\n')
+        stream.flush()
+
+
+def stdout_sink():
+    """A StreamSink for sys.stdout: batched when piped, line by line at a terminal"""
+    interactive = hasattr(sys.stdout, 'isatty') and sys.stdout.isatty()
+    return StreamSink(buffer_size=0 if interactive else BUFFER_SIZE)
+
+
+class ListSink:
+    """Keeps printed lines in a list"""
+
+    def __init__(self):
+        self.lines = []
+        self.write = self.lines.append
+
+    def flush(self):
+        pass
@@ -0,0 +1,338 @@
+"""
+Sandboxed worker processes for running Salt programs from the web
+
+Each worker is a separate process that has already imported the tokenizer,
+parser and interpreter, and runs one program at a time. A program gets a
+wall-clock timeout plus CPU time and memory limits (rlimits); a worker that
+hangs or gets killed by a limit is replaced with a fresh one. Only a bounded
+number of requests can wait for a worker: past that, run() and stream()
+raise PoolBusy straight away so the web server can answer 503 instead of
+piling up.
+
+run_batch() runs a list of programs across up to batch_workers workers at
+once (half the pool by default, so /run always has workers left), within an
+overall batch_timeout. Copies of the same source run back to back on one
+worker, so they share its parsed-program cache.
+
+Workers send ('output', text) messages while a streamed program prints and
+one ('done', output, success, cache stats) message at the end.
+"""
+
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+from web_interpreter import run_salt_code, stream_salt_code, PROGRAM_CACHE
+
+WORKERS = os.cpu_count() or 2
+MAX_QUEUE = 16  # Requests that can wait while every worker is busy
+TIMEOUT = 5.0  # Seconds of wall-clock time per program
+CPU_SECONDS = 5  # Seconds of CPU time per program
+MEMORY_LIMIT = 512 * 1024 * 1024  # Bytes of address space per worker
+MAX_BATCH = 1000  # Programs per run_batch() call
+BATCH_WORKERS = max(1, WORKERS // 2)  # Workers one batch can use at once
+BATCH_TIMEOUT = 30.0  # Seconds a whole batch can take; programs not started by then don't run
+
+
+class PoolBusy(Exception):
+    """Every worker is busy and the queue is full"""
+
+
+def worker_main(connection, cpu_seconds, memory_limit):
+    """Run programs sent over connection until it's closed"""
+    if resource is not None and memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+    while True:
+        try:
+            code, stream = connection.recv()
+        except EOFError:
+            return
+        if resource is not None and cpu_seconds:
+            # The limit counts the process's total CPU time, so move it past
+            # what earlier programs used. Going over it kills the worker.
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            used = math.ceil(usage.ru_utime + usage.ru_stime)
+            resource.setrlimit(resource.RLIMIT_CPU, (used + cpu_seconds, resource.getrlimit(resource.RLIMIT_CPU)[1]))
+        if stream:
+            output, success = stream_salt_code(code, lambda text: connection.send(('output', text)))
+        else:
+            output, success = run_salt_code(code)
+        connection.send(('done', output, success, PROGRAM_CACHE.stats()))
+
+
+# The worker died, most likely killed for going over a limit
+DIED_MESSAGE = "Error: Program was stopped for using too much CPU time or memory"
+
+# A batch program that never got a worker before the batch's deadline
+BUSY_MESSAGE = "Error: Server busy: no worker was free before the batch's time ran out"
+
+
+class Worker:
+    """One worker process and the parent's end of its pipe"""
+
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        self.cache_stats = None  # The worker's program cache stats after its last run
+
+    def stop(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class SaltPool:
+    """A fixed set of worker processes that run Salt programs one at a time each"""
+
+    def __init__(self, workers=WORKERS, max_queue=MAX_QUEUE, timeout=TIMEOUT,
+                 cpu_seconds=CPU_SECONDS, memory_limit=MEMORY_LIMIT,
+                 batch_workers=BATCH_WORKERS, batch_timeout=BATCH_TIMEOUT):
+        self.timeout = timeout
+        self.batch_workers = max(1, min(batch_workers, workers))
+        self.batch_timeout = batch_timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_limit = memory_limit
+        self.size = workers
+        # Spawned, not forked: the web server may have threads running
+        self.context = multiprocessing.get_context('spawn')
+        self.idle = queue.Queue()
+        self.slots = threading.BoundedSemaphore(workers + max_queue)
+        self.workers = []
+        self.lock = threading.Lock()
+        for _ in range(workers):
+            self.idle.put(self.start_worker())
+
+    def start_worker(self):
+        parent_end, child_end = self.context.Pipe()
+        process = self.context.Process(target=worker_main, args=(child_end, self.cpu_seconds, self.memory_limit),
+                                       daemon=True)
+        process.start()
+        child_end.close()
+        worker = Worker(process, parent_end)
+        with self.lock:
+            self.workers.append(worker)
+        return worker
+
+    def replace_worker(self, worker):
+        worker.stop()
+        with self.lock:
+            self.workers.remove(worker)
+        return self.start_worker()
+
+    def run(self, code):
+        """Run a program on the next free worker; returns (output, success) like run_salt_code"""
+        if not self.slots.acquire(blocking=False):
+            raise PoolBusy("Too many programs are waiting to run")
+        try:
+            worker = self.idle.get()
+            try:
+                output, success, worker = self.run_on(worker, code)
+            finally:
+                self.idle.put(worker)
+            return output, success
+        finally:
+            self.slots.release()
+
+    def batch_width(self, count):
+        """Workers a batch of count programs uses at once"""
+        return max(1, min(self.batch_workers, count))
+
+    def run_batch(self, programs):
+        """Run many programs at once on up to batch_workers workers
+
+        Returns (output, success, seconds) for each program, in order. Programs
+        that haven't started when batch_timeout runs out fail without running.
+        """
+        if len(programs) > MAX_BATCH:
+            raise ValueError(f"A batch can have at most {MAX_BATCH} programs, got {len(programs)}")
+        width = self.batch_width(len(programs))
+        copies = {}
+        for index, code in enumerate(programs):
+            copies.setdefault(code, []).append(index)
+        # Each task is some copies of one source for one worker; a source with
+        # lots of copies is split so it doesn't keep the other workers idle
+        tasks = []
+        for code, indexes in copies.items():
+            per_worker = -(-len(indexes) // width)
+            for start in range(0, len(indexes), per_worker):
+                tasks.append((code, indexes[start:start + per_worker]))
+
+        deadline = time.monotonic() + self.batch_timeout
+        results = [None] * len(programs)
+        with ThreadPoolExecutor(max_workers=width) as executor:
+            for task_results in executor.map(lambda task: self.run_copies(task, deadline), tasks):
+                for index, result in task_results:
+                    results[index] = result
+        return results
+
+    def run_copies(self, task, deadline):
+        """Run one source once per index on a single worker; [(index, (output, success, seconds))]"""
+        code, indexes = task
+        # Batch programs wait for a turn rather than getting PoolBusy, but
+        # only until the batch's deadline
+        if not self.slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            return [(index, (BUSY_MESSAGE, False, 0.0)) for index in indexes]
+        try:
+            try:
+                worker = self.idle.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return [(index, (BUSY_MESSAGE, False, 0.0)) for index in indexes]
+            results = []
+            try:
+                for index in indexes:
+                    if time.monotonic() >= deadline:
+                        results.append((index, (self.batch_timeout_message(), False, 0.0)))
+                        continue
+                    start = time.perf_counter()
+                    output, success, worker = self.run_on(worker, code)
+                    results.append((index, (output, success, time.perf_counter() - start)))
+            finally:
+                self.idle.put(worker)
+            return results
+        finally:
+            self.slots.release()
+
+    def run_on(self, worker, code):
+        """(output, success, worker to use next time)"""
+        try:
+            worker.connection.send((code, False))
+            if worker.connection.poll(self.timeout):
+                _, output, success, worker.cache_stats = worker.connection.recv()
+                return output, success, worker
+            message = self.timeout_message()
+        except (EOFError, OSError):
+            message = DIED_MESSAGE
+        return message, False, self.replace_worker(worker)
+
+    def timeout_message(self):
+        return f"Error: Program took longer than {self.timeout:g} seconds and was stopped"
+
+    def batch_timeout_message(self):
+        return f"Error: The batch took longer than {self.batch_timeout:g} seconds; this program didn't run"
+
+    def stream(self, code):
+        """Run a program on the next free worker, as a ProgramStream of its output"""
+        return ProgramStream(self, code)
+
+    def stream_events(self, code):
+        """Yield ('output', text) as the program prints, then ('done', message, success)"""
+        worker = self.idle.get()
+        finished = False
+        try:
+            worker.connection.send((code, True))
+            deadline = time.monotonic() + self.timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not worker.connection.poll(remaining):
+                    yield ('done', self.timeout_message(), False)
+                    return
+                message = worker.connection.recv()
+                if message[0] == 'output':
+                    yield message
+                else:
+                    _, output, success, worker.cache_stats = message
+                    finished = True
+                    yield ('done', output, success)
+                    return
+        except (EOFError, OSError):
+            yield ('done', DIED_MESSAGE, False)
+        finally:
+            if not finished:
+                # Hung, died, or the reader went away mid-program
+                worker = self.replace_worker(worker)
+            self.idle.put(worker)
+
+    def cache_stats(self):
+        """Program cache stats added up over the live workers"""
+        with self.lock:
+            stats = [worker.cache_stats for worker in self.workers if worker.cache_stats is not None]
+        totals = {key: sum(worker_stats[key] for worker_stats in stats)
+                  for key in ('hits', 'misses', 'programs', 'bytes')}
+        lookups = totals['hits'] + totals['misses']
+        totals['hit_rate'] = totals['hits'] / lookups if lookups else 0.0
+        totals['workers'] = len(stats)
+        return totals
+
+    def close(self):
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            worker.stop()
+
+
+class ProgramStream:
+    """A program's output, read chunk by chunk from a pool worker
+
+    Holds one of the pool's queue slots from creation until it's used up or
+    closed; closing it part way stops the program.
+    """
+
+    def __init__(self, pool, code):
+        if not pool.slots.acquire(blocking=False):
+            raise PoolBusy("Too many programs are waiting to run")
+        self.pool = pool
+        self.events = pool.stream_events(code)
+        self.holding_slot = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.events)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        self.events.close()
+        if self.holding_slot:
+            self.holding_slot = False
+            self.pool.slots.release()
+
+
+def test_pool():
+    """Run a normal program, a hung one and an overloaded queue"""
+    pool = SaltPool(workers=1, max_queue=0, timeout=1.0)
+    try:
+        print(pool.run('make int x 6\nprint "x * 7 = " x * 7'))
+        print(pool.run('make int x 0\nwhile TRUE\n{\n    make x x + 1\n}'))
+        print(pool.run('print "after the hung program"'))
+        print(pool.run('print "after the hung program"'))
+        print(pool.cache_stats())
+        for output, success, seconds in pool.run_batch(['print 1', 'print 2', 'print 1']):
+            print(output, success, f"{seconds:.4f}s")
+        pool.batch_timeout = 1.5
+        hung = 'make int x 0\nwhile TRUE\n{\n    make x x + 1\n}'
+        for output, success, seconds in pool.run_batch([hung, hung, 'print 3']):
+            print(output, success, f"{seconds:.4f}s")
+        pool.batch_timeout = BATCH_TIMEOUT
+        for event in pool.stream('make int i 0\nloop i from 1 to 3\n{\n    print "line " i\n}'):
+            print(event)
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(pool.run('make int x 0\nwhile TRUE\n{\n    make x x + 1\n}')))
+        thread.start()
+        while pool.idle.qsize():
+            pass  # Wait for the thread to take the only worker
+        try:
+            pool.run('print "no room"')
+        except PoolBusy as e:
+            print("PoolBusy:", e)
+        thread.join()
+        print(results[0])
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    test_pool()
@@ -0,0 +1,65 @@
+"""
+String variables that can be appended to in place
+
+A loop that builds a string with `make s s + "..."` used to copy all of s on
+every pass, so it was quadratic in the string's length. String variables
+are StringVariable cells instead. When the optimizer has marked an
+assignment as an append (see optimizer.mark_appends), the engines add the
+new text to the variable's pieces instead of building a new string.
+
+The joined string is only built when something reads var_info.value, which
+is a property here: it joins the pieces and keeps the result. Printing,
+comparing, passing s to a function or any other read sees a plain str, so
+nothing else needs to know about it.
+"""
+
+from salt_variables import Variable, STRING
+
+# Small pieces are joined into one chunk this often, so the list of pieces
+# stays short even for millions of appends
+CHUNK_PIECES = 1024
+
+
+class StringVariable(Variable):
+    """A string variable"""
+
+    __slots__ = ('text', 'chunks', 'pieces', 'length')
+
+    type = STRING
+
+    def __init__(self, value):
+        self.text = value
+        self.chunks = None  # Joined runs of pieces, while appending
+        self.pieces = None  # Pieces appended since the last chunk
+        self.length = 0  # Length of the whole string while appending
+
+    @property
+    def value(self):
+        if self.chunks is not None:
+            self.chunks.extend(self.pieces)
+            self.text = ''.join(self.chunks)
+            self.chunks = self.pieces = None
+        return self.text
+
+    @value.setter
+    def value(self, value):
+        self.text = value
+        self.chunks = self.pieces = None
+
+    def append(self, text, budget):
+        """Add text to the end of the string, checking the budget's string limit first"""
+        if self.chunks is None:
+            # An assignment or a read since the last append: start from that value
+            length = len(self.text) + len(text)
+            budget.check_length(length)
+            self.chunks = [self.text]
+            self.pieces = [text]
+        else:
+            length = self.length + len(text)
+            budget.check_length(length)
+            pieces = self.pieces
+            pieces.append(text)
+            if len(pieces) >= CHUNK_PIECES:
+                self.chunks.append(''.join(pieces))
+                pieces.clear()
+        self.length = length
@@ -0,0 +1,55 @@
+"""
+Variable cells for Salt
+
+Every variable is kept in a small object with __slots__ instead of a dict
+like {'value': ..., 'type': ...}: reading or writing it is an attribute
+access rather than a hash lookup, and it takes a lot less memory. The type
+is a small int (INT, DOUBLE, BOOL or STRING), so checking it is an int
+compare and coercing a value is COERCIONS[var_info.type](value).
+
+- Variable: an int, double or bool (strings use StringVariable, a subclass
+  in salt_strings.py)
+- ArrayVariable: an array's storage, its element type and its size
+
+The engines tell them apart with var_info.__class__ is ArrayVariable.
+"""
+
+# Type codes, in the order the vm engine encodes them
+INT, DOUBLE, BOOL, STRING = range(4)
+
+TYPE_NAMES = ('int', 'double', 'bool', 'string')  # Indexed by type code
+TYPE_CODES = {name: code for code, name in enumerate(TYPE_NAMES)}
+
+# Conversion of a value to each type, indexed by type code
+COERCIONS = (int, float, bool, str)
+
+
+class Variable:
+    """A scalar variable: its value and type code"""
+
+    __slots__ = ('value', 'type')
+
+    def __init__(self, value, var_type):
+        self.value = value
+        self.type = var_type
+
+    def __repr__(self):
+        return f"{TYPE_NAMES[self.type]} {self.value!r}"
+
+
+class ArrayVariable:
+    """An array variable: its storage, element type code and size"""
+
+    __slots__ = ('value', 'type', 'size')
+
+    def __init__(self, value, element_type, size):
+        self.value = value
+        self.type = element_type
+        self.size = size
+
+    def __repr__(self):
+        return f"{TYPE_NAMES[self.type]} array[{self.size}]"
+
+
+# Anything an engine can hand a builtin as an array variable reference
+VARIABLE_CLASSES = (Variable, ArrayVariable)
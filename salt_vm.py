@@ -0,0 +1,907 @@
+"""
+Bytecode compiler and virtual machine for Salt programs
+
+The compiler flattens the AST from Parser.parse_statement into a CodeObject:
+a flat list of (opcode, argument) pairs plus a constants pool and a names
+pool. IfNode/WhileNode/ForNode become conditional and unconditional jumps to
+absolute instruction offsets, and function bodies become nested CodeObjects
+in the constants pool.
+
+The VM runs a CodeObject in a single dispatch loop. Salt function calls push
+a frame onto the VM's own frame stack instead of recursing in Python, so call
+depth is bounded only by Interpreter.max_call_depth (and memory), not by
+Python's recursion limit.
+
+Variables are addressed through the names pool. Each CodeObject also has a
+slots list parallel to its names: for a function body, the resolver's local
+slot for that name (or None for a global), so the VM reads locals from the
+call's frame and everything else from the interpreter's globals, exactly
+like the tree walker.
+"""
+
+import json
+
+from resolver import resolve_function
+from loop_idioms import LoopIdiom, match_idiom, run_idiom
+from memo import MISS
+from salt_arrays import new_array, widen_array, store_array
+from salt_strings import StringVariable
+from salt_variables import Variable, ArrayVariable, VARIABLE_CLASSES, COERCIONS, TYPE_NAMES, TYPE_CODES, INT, STRING
+from salt_builtins import BUILTINS, Builtin, target_positions
+from math_parser import NumberNode, StringNode, BooleanNode, ConstantNode, VariableNode, AssignmentNode, DeclarationNode, BinaryOpNode, ComparisonNode, LogicalNode, PrintNode, IfNode, ForNode, WhileNode, SkipNode, EndNode, FunctionNode, FunctionCallNode, ReturnNode, UnaryOpNode, ArrayNode, ArrayAccessNode
+
+
+# Opcodes. Every instruction is two entries in CodeObject.code: opcode, argument.
+OPCODES = [
+    'LOAD_CONST',       # push constants[arg]
+    'LOAD_NAME',        # push value of variable names[arg]
+    'LOAD_SKIP',        # push the interpreter's SKIP sentinel
+    'LOAD_END',         # push the interpreter's END sentinel
+    'BINARY_ADD',
+    'BINARY_SUB',
+    'BINARY_MUL',
+    'BINARY_DIV',
+    'BINARY_MOD',
+    'COMPARE',          # arg indexes COMPARISONS
+    'LOGICAL_AND',      # both operands are already evaluated
+    'LOGICAL_OR',
+    'LOGICAL_NOT',
+    'NEGATE',
+    'CHECK_UNDEFINED',  # raise if names[arg] is already defined
+    'DECLARE',          # pop value, coerce to type code arg >> 16, store in names[arg & 0xFFFF]
+    'LOAD_REF',         # push the cell of variable names[arg]
+    'STORE_REF',        # pop value and cell, coerce and store, push value
+    'LOAD_APPEND_REF',  # push the cell of names[arg & 0xFFFF]; jump to arg >> 16 unless it's a StringVariable
+    'APPEND_STRING',    # pop arg pieces and a StringVariable, append the pieces, push None
+    'DECLARE_ARRAY',    # pop size, declare array names[arg & 0xFFFF] of type code arg >> 16
+    'ARRAY_REF',        # push the cell of array names[arg]
+    'ARRAY_INDEX',      # bounds-check the index on top of the stack for array names[arg]
+    'ARRAY_LOAD',       # pop index and cell, push the element
+    'ARRAY_STORE',      # pop value, index and cell, store, push value
+    'PRINT',            # pop arg values, print them joined, push the printed string
+    'SET_RESULT',       # pop into the frame's result register
+    'LOAD_RESULT',      # push the frame's result register
+    'POP_TOP',
+    'JUMP',             # jump to arg
+    'JUMP_IF_FALSE',    # pop condition, jump to arg if falsy
+    'FOR_PREP_TIMES',   # push an iterator over range(arg)
+    'FOR_PREP_RANGE',   # check loop variable, push an iterator over constants[arg]
+    'LOOP_IDIOM',       # try running the loop as the batched idiom constants[arg]
+    'FOR_ITER',         # advance the loop iterator or pop it and jump to arg
+    'DEFINE_FUNCTION',  # register the FunctionCode in constants[arg]
+    'GET_FUNCTION',     # look up function names[arg & 0xFFFF], check arity arg >> 16, push it
+    'CALL',             # pop arg arguments and the function, start a new frame
+    'BUILD_RETURN',     # wrap the value on top of the stack as ('RETURN', value)
+    'RETURN_VALUE',     # pop value, finish the frame and push value in the caller
+]
+
+for _number, _name in enumerate(OPCODES):
+    globals()[_name] = _number
+
+# Instructions whose argument is a jump target
+JUMP_OPCODES = {JUMP, JUMP_IF_FALSE, FOR_ITER}
+
+COMPARISONS = ['eq', 'neq', 'lt', 'gt', 'lteq', 'gteq']
+
+BINARY_OPCODES = {
+    '+': BINARY_ADD,
+    '-': BINARY_SUB,
+    '*': BINARY_MUL,
+    '/': BINARY_DIV,
+    '%': BINARY_MOD,
+}
+
+
+class CodeObject:
+    """A compiled block of Salt code: flat instructions plus constant and name pools"""
+
+    def __init__(self, name, code, constants, names, slots=None):
+        self.name = name
+        self.code = code  # [opcode, arg, opcode, arg, ...]
+        self.constants = constants
+        self.names = names
+        self.slots = slots if slots is not None else [None] * len(names)  # Local slot per name
+
+    def __repr__(self):
+        return f"CodeObject({self.name}, {len(self.code) // 2} instructions)"
+
+    def to_dict(self):
+        """Convert to plain data that can be stored as JSON"""
+        constants = []
+        for constant in self.constants:
+            if isinstance(constant, FunctionCode):
+                constants.append({'function': constant.to_dict()})
+            elif isinstance(constant, range):
+                constants.append({'range': [constant.start, constant.stop, constant.step]})
+            elif isinstance(constant, LoopIdiom):
+                constants.append({'idiom': constant.to_dict()})
+            else:
+                constants.append({'value': constant})
+        return {
+            'name': self.name,
+            'code': list(self.code),
+            'constants': constants,
+            'names': list(self.names),
+            'slots': list(self.slots),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a CodeObject from to_dict() output"""
+        constants = []
+        for constant in data['constants']:
+            if 'function' in constant:
+                constants.append(FunctionCode.from_dict(constant['function']))
+            elif 'range' in constant:
+                constants.append(range(*constant['range']))
+            elif 'idiom' in constant:
+                constants.append(LoopIdiom.from_dict(constant['idiom']))
+            else:
+                constants.append(constant['value'])
+        return cls(data['name'], list(data['code']), constants, list(data['names']), data.get('slots'))
+
+
+class FunctionCode:
+    """A compiled Salt function: its signature plus the CodeObject for its body"""
+
+    def __init__(self, name, return_type, parameters, code, param_slots, slot_count,
+                 pure_body=False, callees=(), local_names=()):
+        self.name = name
+        self.return_type = return_type
+        self.parameters = parameters  # List of (type, name) tuples
+        self.code = code
+        self.param_slots = param_slots  # Frame slot of each parameter
+        self.param_types = tuple(TYPE_CODES[param_type] for param_type, param_name in parameters)
+        self.slot_count = slot_count  # Size of a call's frame
+        # Purity info from the resolver, used for memoization
+        self.pure_body = pure_body
+        self.callees = frozenset(callees)
+        self.local_names = tuple(local_names)
+
+    def __repr__(self):
+        return f"FunctionCode({self.name}, {self.return_type}, {self.parameters})"
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'return_type': self.return_type,
+            'parameters': [list(param) for param in self.parameters],
+            'code': self.code.to_dict(),
+            'param_slots': list(self.param_slots),
+            'slot_count': self.slot_count,
+            'pure_body': self.pure_body,
+            'callees': sorted(self.callees),
+            'local_names': list(self.local_names),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        parameters = [tuple(param) for param in data['parameters']]
+        return cls(data['name'], data['return_type'], parameters, CodeObject.from_dict(data['code']),
+                   data['param_slots'], data['slot_count'],
+                   data.get('pure_body', False), data.get('callees', ()), data.get('local_names', ()))
+
+
+def dumps(code):
+    """Serialize a CodeObject to a JSON string"""
+    return json.dumps(code.to_dict())
+
+
+def loads(text):
+    """Load a CodeObject serialized with dumps()"""
+    return CodeObject.from_dict(json.loads(text))
+
+
+class Compiler:
+    """Compiles Salt AST nodes into a CodeObject"""
+
+    def __init__(self, name='<program>'):
+        self.name = name
+        self.code = []
+        self.constants = []
+        self.constant_index = {}
+        self.names = []
+        self.slots = []
+        self.name_index = {}
+        # One entry per enclosing loop: (continue target, break patches, pops on break)
+        self.loops = []
+        # Jumps taken by skip/end outside any loop, patched to the end of the
+        # current top-level (or function body-level) statement
+        self.escapes = []
+
+    # Emitting
+
+    def emit(self, opcode, arg=0):
+        """Append an instruction and return its offset"""
+        self.code.append(opcode)
+        self.code.append(arg)
+        return len(self.code) - 2
+
+    def here(self):
+        return len(self.code)
+
+    def patch(self, offset, target=None):
+        """Point the jump at offset to target (default: the next instruction)"""
+        self.code[offset + 1] = self.here() if target is None else target
+
+    def add_constant(self, value):
+        # Key on the type too, since 1, 1.0 and TRUE compare equal
+        key = (type(value), value) if not isinstance(value, (FunctionCode, range)) else (type(value), id(value))
+        if isinstance(value, float):
+            key = (float, repr(value))  # Keep 0.0 and -0.0 apart
+        if key not in self.constant_index:
+            self.constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return self.constant_index[key]
+
+    def add_name(self, name, slot=None):
+        # Keyed on the slot too: a function's local can share its name with a
+        # function it calls (looked up with no slot) or with a global
+        key = (name, slot)
+        if key not in self.name_index:
+            self.name_index[key] = len(self.names)
+            self.names.append(name)
+            self.slots.append(slot)
+        return self.name_index[key]
+
+    # Entry points
+
+    def compile_program(self, statements):
+        """Compile top-level statements; the code returns the last statement's result"""
+        for statement in statements:
+            self.compile_body_statement(statement, tail=False)
+        self.emit(LOAD_RESULT)
+        self.emit(RETURN_VALUE)
+        return CodeObject(self.name, self.code, self.constants, self.names, self.slots)
+
+    def compile_function_body(self, statements):
+        """Compile a function body; every body-level statement is a tail position for give"""
+        for statement in statements:
+            self.compile_body_statement(statement, tail=True)
+        self.emit(LOAD_RESULT)
+        self.emit(RETURN_VALUE)
+        return CodeObject(self.name, self.code, self.constants, self.names, self.slots)
+
+    def compile_body_statement(self, node, tail):
+        self.escapes = []
+        self.compile_statement(node, tail)
+        for offset in self.escapes:
+            self.patch(offset)
+        self.escapes = []
+
+    # Statements (each one leaves its value in the result register)
+
+    def compile_block(self, statements, tail):
+        if not statements:
+            self.emit(LOAD_CONST, self.add_constant(None))
+            self.emit(SET_RESULT)
+            return
+        last = len(statements) - 1
+        for i, statement in enumerate(statements):
+            self.compile_statement(statement, tail and i == last)
+
+    def compile_statement(self, node, tail=False):
+        if isinstance(node, IfNode):
+            self.compile_if(node, tail)
+        elif isinstance(node, ForNode):
+            self.compile_for(node)
+        elif isinstance(node, WhileNode):
+            self.compile_while(node)
+        elif isinstance(node, SkipNode):
+            self.compile_skip_end(LOAD_SKIP, is_skip=True)
+        elif isinstance(node, EndNode):
+            self.compile_skip_end(LOAD_END, is_skip=False)
+        elif isinstance(node, ReturnNode):
+            self.compile_expression(node.value)
+            if tail:
+                self.emit(RETURN_VALUE)
+            else:
+                # Outside a tail position give only produces a value
+                self.emit(BUILD_RETURN)
+                self.emit(SET_RESULT)
+        else:
+            self.compile_expression(node)
+            self.emit(SET_RESULT)
+
+    def compile_if(self, node, tail):
+        # IfNode.code_block can be a list (if only if-block) or a tuple (if-block, else-block)
+        if isinstance(node.code_block, tuple):
+            if_block, else_block = node.code_block
+        else:
+            if_block = node.code_block
+            else_block = None
+
+        self.compile_expression(node.condition)
+        to_else = self.emit(JUMP_IF_FALSE)
+        self.compile_block(if_block, tail)
+        to_end = self.emit(JUMP)
+        self.patch(to_else)
+        if else_block is not None:
+            self.compile_block(else_block, tail)
+        else:
+            self.emit(LOAD_CONST, self.add_constant(None))
+            self.emit(SET_RESULT)
+        self.patch(to_end)
+
+    def compile_skip_end(self, load_opcode, is_skip):
+        self.emit(load_opcode)
+        self.emit(SET_RESULT)
+        if self.loops:
+            continue_target, break_patches, _ = self.loops[-1]
+            if is_skip:
+                self.emit(JUMP, continue_target)
+            else:
+                break_patches.append(self.emit(JUMP))
+        else:
+            self.escapes.append(self.emit(JUMP))
+
+    def compile_loop_body(self, node, continue_target):
+        break_patches = []
+        self.loops.append((continue_target, break_patches, 0))
+        for statement in node.code_block:
+            self.compile_statement(statement)
+        self.loops.pop()
+        self.emit(JUMP, continue_target)
+        return break_patches
+
+    def compile_for(self, node):
+        if node.startIndex is None:
+            self.emit(FOR_PREP_TIMES, node.var)
+        else:
+            loop_range = range(node.startIndex, node.endIndex + 1, node.step)
+            name = self.add_name(node.var, node.slot)
+            self.emit(FOR_PREP_RANGE, (self.add_constant(loop_range) << 16) | name)
+            idiom = match_idiom(node)
+            if idiom is not None:
+                self.emit(LOOP_IDIOM, self.add_constant(idiom))
+        loop_top = self.here()
+        exhausted = self.emit(FOR_ITER)
+        break_patches = self.compile_loop_body(node, loop_top)
+        # 'end' leaves the loop with the iterator still on the stack
+        for offset in break_patches:
+            self.patch(offset)
+        self.emit(POP_TOP)
+        self.patch(exhausted)
+        self.emit(LOAD_CONST, self.add_constant(None))
+        self.emit(SET_RESULT)
+
+    def compile_while(self, node):
+        loop_top = self.here()
+        self.compile_expression(node.condition)
+        exit_jump = self.emit(JUMP_IF_FALSE)
+        break_patches = self.compile_loop_body(node, loop_top)
+        self.patch(exit_jump)
+        for offset in break_patches:
+            self.patch(offset)
+        self.emit(LOAD_CONST, self.add_constant(None))
+        self.emit(SET_RESULT)
+
+    # Expressions (each one pushes exactly one value)
+
+    def compile_expression(self, node):
+        if isinstance(node, (NumberNode, BooleanNode, ConstantNode)):
+            self.emit(LOAD_CONST, self.add_constant(node.value))
+        elif isinstance(node, StringNode):
+            self.emit(LOAD_CONST, self.add_constant(node.value.strip('"')))
+        elif isinstance(node, VariableNode):
+            self.emit(LOAD_NAME, self.add_name(node.name, node.slot))
+        elif isinstance(node, BinaryOpNode):
+            if node.operator not in BINARY_OPCODES:
+                raise ValueError(f"Unknown operator: {node.operator}")
+            self.compile_expression(node.left)
+            self.compile_expression(node.right)
+            self.emit(BINARY_OPCODES[node.operator])
+        elif isinstance(node, ComparisonNode):
+            if node.operator not in COMPARISONS:
+                raise ValueError(f"Unknown comparison operator: {node.operator}")
+            self.compile_expression(node.left)
+            self.compile_expression(node.right)
+            self.emit(COMPARE, COMPARISONS.index(node.operator))
+        elif isinstance(node, LogicalNode):
+            self.compile_expression(node.left)
+            if node.right:
+                if node.operator not in ('and', 'or'):
+                    raise ValueError(f"Unknown logical operator: {node.operator}")
+                self.compile_expression(node.right)
+                self.emit(LOGICAL_AND if node.operator == 'and' else LOGICAL_OR)
+            elif node.operator == 'not':
+                self.emit(LOGICAL_NOT)
+            else:
+                raise ValueError(f"Unknown logical operator: {node.operator}")
+        elif isinstance(node, UnaryOpNode):
+            if node.operator != '-':
+                raise ValueError(f"Unknown unary operator: {node.operator}")
+            self.compile_expression(node.operand)
+            self.emit(NEGATE)
+        elif isinstance(node, DeclarationNode):
+            name = self.add_name(node.var_name, node.slot)
+            if node.var_type not in TYPE_CODES:
+                raise ValueError(f"Unknown variable type: {node.var_type}")
+            self.emit(CHECK_UNDEFINED, name)
+            self.compile_expression(node.value)
+            self.emit(DECLARE, (TYPE_CODES[node.var_type] << 16) | name)
+        elif isinstance(node, AssignmentNode):
+            name = self.add_name(node.var_name, node.slot)
+            if node.append is None:
+                self.emit(LOAD_REF, name)
+                self.compile_expression(node.value)
+                self.emit(STORE_REF)
+            else:
+                # make s s + ...: when s is a string, append to it instead of
+                # copying it. Anything else jumps straight to the plain store.
+                to_store = self.emit(LOAD_APPEND_REF, name)
+                for piece in node.append:
+                    self.compile_expression(piece)
+                self.emit(APPEND_STRING, len(node.append))
+                to_end = self.emit(JUMP)
+                self.patch(to_store, (self.here() << 16) | name)
+                self.compile_expression(node.value)
+                self.emit(STORE_REF)
+                self.patch(to_end)
+        elif isinstance(node, ArrayNode):
+            name = self.add_name(node.var_name, node.slot)
+            if node.is_declaration:
+                if node.var_type not in TYPE_CODES:
+                    raise ValueError(f"Unknown array type: {node.var_type}")
+                self.emit(CHECK_UNDEFINED, name)
+                self.compile_expression(node.size)
+                self.emit(DECLARE_ARRAY, (TYPE_CODES[node.var_type] << 16) | name)
+            else:
+                self.emit(ARRAY_REF, name)
+                self.compile_expression(node.index)
+                self.emit(ARRAY_INDEX, name)
+                self.compile_expression(node.value)
+                self.emit(ARRAY_STORE)
+        elif isinstance(node, ArrayAccessNode):
+            name = self.add_name(node.array_name, node.slot)
+            self.emit(ARRAY_REF, name)
+            self.compile_expression(node.index)
+            self.emit(ARRAY_INDEX, name)
+            self.emit(ARRAY_LOAD)
+        elif isinstance(node, PrintNode):
+            for expr in node.expressions:
+                self.compile_expression(expr)
+            self.emit(PRINT, len(node.expressions))
+        elif isinstance(node, FunctionNode):
+            resolve_function(node)
+            body = Compiler(node.name).compile_function_body(node.code_block)
+            function = FunctionCode(node.name, node.return_type, list(node.parameters), body,
+                                    list(node.param_slots), node.slot_count,
+                                    node.pure_body, node.callees, node.local_names)
+            self.emit(DEFINE_FUNCTION, self.add_constant(function))
+        elif isinstance(node, FunctionCallNode):
+            self.emit(GET_FUNCTION, (len(node.arguments) << 16) | self.add_name(node.name))
+            targets = target_positions(node.name)
+            for i, argument in enumerate(node.arguments):
+                if i in targets and isinstance(argument, VariableNode):
+                    # A builtin that changes an array gets its cell
+                    self.emit(LOAD_REF, self.add_name(argument.name, argument.slot))
+                else:
+                    self.compile_expression(argument)
+            self.emit(CALL, len(node.arguments))
+        elif isinstance(node, (IfNode, ForNode, WhileNode, SkipNode, EndNode, ReturnNode)):
+            # Statements used as values (e.g. a bare give) evaluate into the result register
+            self.compile_statement(node)
+            self.emit(LOAD_RESULT)
+        else:
+            raise ValueError(f"Unknown node type: {type(node)}")
+
+
+def compile_statements(statements, name='<program>'):
+    """Compile a list of top-level statements into a CodeObject"""
+    return Compiler(name).compile_program(statements)
+
+
+def disassemble(code, indent=''):
+    """Return a human-readable listing of a CodeObject (and nested functions)"""
+    lines = [f"{indent}Disassembly of {code.name}:"]
+    nested = []
+    for offset in range(0, len(code.code), 2):
+        opcode = code.code[offset]
+        arg = code.code[offset + 1]
+        opname = OPCODES[opcode]
+        detail = ''
+        if opcode in (LOAD_CONST, DEFINE_FUNCTION, LOOP_IDIOM):
+            detail = repr(code.constants[arg])
+            if isinstance(code.constants[arg], FunctionCode):
+                nested.append(code.constants[arg].code)
+        elif opcode in (LOAD_NAME, CHECK_UNDEFINED, LOAD_REF, ARRAY_REF, ARRAY_INDEX):
+            detail = code.names[arg]
+        elif opcode in (DECLARE, DECLARE_ARRAY):
+            detail = f"{TYPE_NAMES[arg >> 16]} {code.names[arg & 0xFFFF]}"
+        elif opcode == FOR_PREP_RANGE:
+            detail = f"{code.names[arg & 0xFFFF]} in {code.constants[arg >> 16]}"
+        elif opcode == GET_FUNCTION:
+            detail = f"{code.names[arg & 0xFFFF]}/{arg >> 16}"
+        elif opcode == LOAD_APPEND_REF:
+            detail = f"{code.names[arg & 0xFFFF]}, else to {arg >> 16}"
+        elif opcode == COMPARE:
+            detail = COMPARISONS[arg]
+        elif opcode in JUMP_OPCODES:
+            detail = f"to {arg}"
+        lines.append(f"{indent}{offset:>6} {opname:<16} {arg:<6} {detail}".rstrip())
+    for nested_code in nested:
+        lines.append('')
+        lines.append(disassemble(nested_code, indent))
+    return '\n'.join(lines)
+
+
+class VM:
+    """Runs CodeObjects against an Interpreter's variable and function tables"""
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+    def run(self, code):
+        """Run a CodeObject to completion and return its result"""
+        interp = self.interpreter
+        SKIP = interp.SKIP
+        END = interp.END
+        budget = interp.budget
+        write = interp.output.write
+
+        frames = []  # Saved caller state: (code object, pc, stack, result, frame, memo entry)
+        memo = interp.memo
+        instructions = code.code
+        constants = code.constants
+        names = code.names
+        slots = code.slots
+        lookup = interp.lookup
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        result = None
+        pc = 0
+
+        try:
+            while True:
+                opcode = instructions[pc]
+                arg = instructions[pc + 1]
+                pc += 2
+
+                if opcode == LOAD_NAME:
+                    var_info = lookup(names[arg], slots[arg])
+                    if var_info is None:
+                        raise NameError(f"Variable '{names[arg]}' is not defined")
+                    push(var_info.value)
+                elif opcode == LOAD_CONST:
+                    push(constants[arg])
+                elif opcode == SET_RESULT:
+                    result = pop()
+                elif opcode == JUMP_IF_FALSE:
+                    if not pop():
+                        pc = arg
+                elif opcode == JUMP:
+                    if arg < pc:
+                        # Every loop iteration ends in a JUMP back to the top
+                        budget.ticks -= 1
+                        if budget.ticks <= 0:
+                            budget.check()
+                    pc = arg
+                elif opcode == COMPARE:
+                    right = pop()
+                    left = pop()
+                    if arg == 0:
+                        push(left == right)
+                    elif arg == 1:
+                        push(left != right)
+                    elif arg == 2:
+                        push(left < right)
+                    elif arg == 3:
+                        push(left > right)
+                    elif arg == 4:
+                        push(left <= right)
+                    else:
+                        push(left >= right)
+                elif opcode == BINARY_ADD:
+                    right = pop()
+                    left = pop()
+                    # If either operand is a string, concatenate as strings
+                    if isinstance(left, str) or isinstance(right, str):
+                        push(budget.concatenate(left, right))
+                    else:
+                        push(left + right)
+                elif opcode == BINARY_SUB:
+                    right = pop()
+                    stack[-1] = stack[-1] - right
+                elif opcode == BINARY_MUL:
+                    right = pop()
+                    if isinstance(right, str) or isinstance(stack[-1], str):
+                        budget.check_repeat(stack[-1], right)
+                    stack[-1] = stack[-1] * right
+                elif opcode == BINARY_DIV:
+                    right = pop()
+                    if right == 0:
+                        raise ZeroDivisionError("Cannot divide by zero!")
+                    stack[-1] = stack[-1] / right
+                elif opcode == BINARY_MOD:
+                    right = pop()
+                    if right == 0:
+                        raise ZeroDivisionError("Cannot modulo by zero!")
+                    stack[-1] = stack[-1] % right
+                elif opcode == LOAD_REF:
+                    name = names[arg]
+                    var_info = lookup(name, slots[arg])
+                    if var_info is None:
+                        raise NameError(f"Variable '{name}' is not defined")
+                    push(var_info)
+                elif opcode == STORE_REF:
+                    value = pop()
+                    var_info = pop()
+                    if var_info.__class__ is ArrayVariable:
+                        # Whole-array assignment, e.g. make c a + b
+                        value = store_array(var_info, value)
+                    else:
+                        value = COERCIONS[var_info.type](value)
+                        var_info.value = value
+                    push(value)
+                elif opcode == LOAD_APPEND_REF:
+                    name = names[arg & 0xFFFF]
+                    var_info = lookup(name, slots[arg & 0xFFFF])
+                    if var_info is None:
+                        raise NameError(f"Variable '{name}' is not defined")
+                    push(var_info)
+                    if var_info.__class__ is not StringVariable:
+                        pc = arg >> 16
+                elif opcode == APPEND_STRING:
+                    text = ''.join([str(value) for value in stack[-arg:]])
+                    del stack[-arg:]
+                    stack[-1].append(text, budget)
+                    stack[-1] = None
+                elif opcode == FOR_ITER:
+                    loop_var, iterator = stack[-1]
+                    i = next(iterator, None)
+                    if i is None:
+                        pop()
+                        pc = arg
+                    elif loop_var is not None:
+                        # Update the loop variable to current iteration value
+                        loop_var.value = i
+                elif opcode == ARRAY_REF:
+                    name = names[arg]
+                    var_info = lookup(name, slots[arg])
+                    if var_info is None:
+                        raise NameError(f"Array '{name}' is not defined")
+                    if var_info.__class__ is not ArrayVariable:
+                        raise TypeError(f"'{name}' is not an array")
+                    push(var_info)
+                elif opcode == ARRAY_INDEX:
+                    index = stack[-1]
+                    size = stack[-2].size
+                    if not isinstance(index, int) or index < 0 or index >= size:
+                        raise IndexError(f"Array index {index} out of bounds for array '{names[arg]}' of size {size}")
+                elif opcode == ARRAY_LOAD:
+                    index = pop()
+                    stack[-1] = stack[-1].value[index]
+                elif opcode == ARRAY_STORE:
+                    value = pop()
+                    index = pop()
+                    var_info = pop()
+                    value = COERCIONS[var_info.type](value)
+                    try:
+                        var_info.value[index] = value
+                    except OverflowError:
+                        # Too big for 64 bits, so the array becomes a plain list
+                        widen_array(var_info)[index] = value
+                    push(value)
+                elif opcode == LOGICAL_AND:
+                    right = pop()
+                    stack[-1] = stack[-1] and right
+                elif opcode == LOGICAL_OR:
+                    right = pop()
+                    stack[-1] = stack[-1] or right
+                elif opcode == LOGICAL_NOT:
+                    stack[-1] = not stack[-1]
+                elif opcode == NEGATE:
+                    stack[-1] = -stack[-1]
+                elif opcode == PRINT:
+                    if arg:
+                        values = stack[-arg:]
+                        del stack[-arg:]
+                    else:
+                        values = []
+                    text = ''.join([str(value) for value in values])
+                    write(text)
+                    push(text)
+                elif opcode == GET_FUNCTION:
+                    name = names[arg & 0xFFFF]
+                    function = interp.functions.get(name)
+                    if function is None:
+                        function = BUILTINS.get(name)
+                        if function is None:
+                            raise NameError(f"Function '{name}' is not defined")
+                    arg_count = arg >> 16
+                    if arg_count != len(function.parameters):
+                        raise ValueError(f"Function '{name}' expects {len(function.parameters)} arguments, got {arg_count}")
+                    push(function)
+                elif opcode == CALL:
+                    if arg:
+                        arg_values = stack[-arg:]
+                        del stack[-arg:]
+                    else:
+                        arg_values = []
+                    function = pop()
+                    if function.__class__ is Builtin:
+                        push(function.call(arg_values))
+                        continue
+                    # Locals of the call live in a fresh frame of slots
+                    frame = [None] * function.slot_count
+                    for i, (param_type, slot) in enumerate(zip(function.param_types, function.param_slots)):
+                        arg_value = arg_values[i]
+                        if isinstance(arg_value, VARIABLE_CLASSES):
+                            # Compiled as a reference for the builtin of this name
+                            arg_value = arg_value.value
+                        arg_value = arg_values[i] = COERCIONS[param_type](arg_value)
+                        if param_type == STRING:
+                            frame[slot] = StringVariable(arg_value)
+                        else:
+                            frame[slot] = Variable(arg_value, param_type)
+                    # Pure functions answer repeated calls from their cache;
+                    # a miss is stored when the call returns
+                    entry = None
+                    if memo is not None:
+                        cache = memo.cache_for(function, interp.functions, interp.variables)
+                        if cache is not None:
+                            key = tuple(arg_values)
+                            value = memo.lookup(cache, key)
+                            if value is not MISS:
+                                push(value)
+                                continue
+                            entry = (cache, key)
+                    interp.enter_call(function.name)
+                    frames.append((code, pc, stack, result, interp.frame, entry))
+                    interp.frame = frame
+                    code = function.code
+                    instructions = code.code
+                    constants = code.constants
+                    names = code.names
+                    slots = code.slots
+                    stack = []
+                    push = stack.append
+                    pop = stack.pop
+                    result = None
+                    pc = 0
+                elif opcode == RETURN_VALUE:
+                    value = pop()
+                    if not frames:
+                        return value
+                    code, pc, stack, result, interp.frame, entry = frames.pop()
+                    interp.call_depth -= 1
+                    if entry is not None:
+                        memo.store(entry[0], entry[1], value)
+                    instructions = code.code
+                    constants = code.constants
+                    names = code.names
+                    slots = code.slots
+                    push = stack.append
+                    pop = stack.pop
+                    push(value)
+                elif opcode == LOAD_RESULT:
+                    push(result)
+                elif opcode == POP_TOP:
+                    pop()
+                elif opcode == CHECK_UNDEFINED:
+                    if lookup(names[arg], slots[arg]) is not None:
+                        raise NameError(f"Variable '{names[arg]}' already defined")
+                elif opcode == DECLARE:
+                    var_type = arg >> 16
+                    value = COERCIONS[var_type](pop())
+                    index = arg & 0xFFFF
+                    if var_type == STRING:
+                        interp.declare(names[index], slots[index], StringVariable(value))
+                    else:
+                        interp.declare(names[index], slots[index], Variable(value, var_type))
+                    push(value)
+                elif opcode == DECLARE_ARRAY:
+                    var_type = arg >> 16
+                    size = pop()
+                    if not isinstance(size, int) or size <= 0:
+                        raise ValueError(f"Array size must be a positive integer, got {size}")
+                    budget.allocate(size)
+                    array_data = new_array(var_type, size)
+                    index = arg & 0xFFFF
+                    interp.declare(names[index], slots[index], ArrayVariable(array_data, var_type, size))
+                    push(array_data)
+                elif opcode == FOR_PREP_TIMES:
+                    push((None, iter(range(arg))))
+                elif opcode == FOR_PREP_RANGE:
+                    name = names[arg & 0xFFFF]
+                    loop_var = lookup(name, slots[arg & 0xFFFF])
+                    if loop_var is None:
+                        raise ValueError(f"Loop variable '{name}' is not defined")
+                    if loop_var.__class__ is not Variable or loop_var.type != INT:
+                        raise ValueError(f"Variable {name} is not an integer")
+                    push((loop_var, iter(constants[arg >> 16])))
+                elif opcode == LOOP_IDIOM:
+                    loop_var = stack[-1][0]
+                    if run_idiom(interp, constants[arg], loop_var):
+                        # Ran as one batch, so FOR_ITER finds nothing left
+                        stack[-1] = (loop_var, iter(()))
+                elif opcode == LOAD_SKIP:
+                    push(SKIP)
+                elif opcode == LOAD_END:
+                    push(END)
+                elif opcode == DEFINE_FUNCTION:
+                    function = constants[arg]
+                    interp.define_function(function.name, function)
+                    push(None)
+                elif opcode == BUILD_RETURN:
+                    stack[-1] = ('RETURN', stack[-1])
+                else:
+                    raise ValueError(f"Unknown opcode: {opcode}")
+        except Exception:
+            # Leave the interpreter in the outermost frame
+            if frames:
+                interp.frame = frames[0][4]
+                interp.call_depth -= len(frames)
+            raise
+
+
+def test_vm():
+    """Compile, disassemble and run a small Salt program"""
+    from tokenizer import tokenize
+    from math_parser import Parser
+    from interpreter import Interpreter
+
+    test_code = """
+make function square takes int n gives int
+{
+    give n * n
+}
+make int i 0
+loop i from 1 to 3
+{
+    print "square(" i ") = " square(i)
+}
+make int total 0
+loop i from 1 to 100
+{
+    make total total + i * i
+}
+print "sum of squares: " total
+"""
+    parser = Parser(tokenize(test_code))
+    statements = []
+    while parser.current_token() is not None:
+        statements.append(parser.parse_statement())
+
+    code = compile_statements(statements)
+    print(disassemble(code))
+    print()
+
+    # Round-trip through the serialized form before running
+    code = loads(dumps(code))
+    interpreter = Interpreter()
+    VM(interpreter).run(code)
+    interpreter.output.flush()
+
+
+def test_shadowing():
+    """A local named after a function the body calls stays local (prints 11, then 13)"""
+    from tokenizer import tokenize
+    from math_parser import Parser
+    from interpreter import Interpreter
+
+    test_code = """
+make function g takes int n gives int
+{
+    give n * 2
+}
+make function f takes int n gives int
+{
+    make int r g(n)
+    make int g 5
+    give r + g
+}
+print f(3)
+print f(4)
+"""
+    interpreter = Interpreter(engine='vm')
+    for statement in Parser(tokenize(test_code)).statements():
+        interpreter.execute(statement)
+    interpreter.output.flush()
+
+
+if __name__ == "__main__":
+    test_vm()
+    test_shadowing()
@@ -31,8 +31,66 @@ document.addEventListener('DOMContentLoaded', function () {
   });
   editor.setSize('100%', '100%');
   editor.getWrapperElement().setAttribute('spellcheck', 'false');
+  editor.on('change', scheduleCheck);
 });
 
+// Live syntax errors: /check the code a moment after typing stops. The server
+// keeps the last check for this session and only re-parses what changed.
+const checkSession = Math.random().toString(36).slice(2) + Date.now().toString(36);
+let checkTimer = null;
+let checkCount = 0;
+let errorMarks = [];
+
+function scheduleCheck() {
+  clearTimeout(checkTimer);
+  checkTimer = setTimeout(checkCode, 300);
+}
+
+function checkCode() {
+  const code = editor.getValue();
+  const count = ++checkCount;
+  fetch('/check', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ code, session: checkSession })
+  })
+    .then((r) => r.json())
+    .then((data) => {
+      // A slower reply for older code can arrive after a newer one
+      if (count === checkCount && data.errors) showErrors(data.errors);
+    })
+    .catch(() => {});
+}
+
+function showErrors(errors) {
+  errorMarks.forEach((clear) => clear());
+  errorMarks = [];
+  errors.forEach((error) => {
+    const line = error.line - 1;
+    if (line >= editor.lineCount()) return;
+    editor.addLineClass(line, 'background', 'salt-error-line');
+    const mark = editor.markText(
+      { line, ch: error.column - 1 },
+      { line, ch: editor.getLine(line).length },
+      { className: 'salt-error', title: error.message }
+    );
+    errorMarks.push(() => {
+      editor.removeLineClass(line, 'background', 'salt-error-line');
+      mark.clear();
+    });
+  });
+  const status = document.getElementById('checkStatus');
+  if (!errors.length) {
+    status.textContent = '✅ No syntax errors';
+    status.className = 'check-status';
+    return;
+  }
+  const shown = errors.slice(0, 3).map((e) => `line ${e.line}, column ${e.column}: ${e.message}`);
+  if (errors.length > shown.length) shown.push(`... and ${errors.length - shown.length} more`);
+  status.textContent = `❌ ${errors.length} syntax error${errors.length === 1 ? '' : 's'}\n` + shown.join('\n');
+  status.className = 'check-status has-errors';
+}
+
 function scrollToBottom() {
   const terminal = document.querySelector('.terminal');
   if (terminal) terminal.scrollTop = terminal.scrollHeight;
@@ -58,18 +116,24 @@ function runCode() {
   runBtn.textContent = '⏳ Running...';
   output.innerHTML += '\n\n🔄 Running code...\n';
   scrollToBottom();
-  fetch('/run', {
+  fetch('/run_stream', {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
     body: JSON.stringify({ code })
   })
-    .then((r) => r.json())
-    .then((data) => {
-      output.innerHTML += '\n' + (data.success ? '✅ ' : '❌ ') + data.output + '\n';
-      setTimeout(scrollToBottom, 50);
+    .then((r) => {
+      const type = r.headers.get('Content-Type') || '';
+      if (!type.startsWith('text/event-stream') || !r.body) {
+        // Busy (503) or a server error: one JSON reply like /run
+        return r.json().then((data) => showResult(output, data));
+      }
+      return readEvents(r.body, (data) => {
+        if (data.done) showResult(output, data);
+        else appendOutput(output, data.output);
+      });
     })
     .catch((err) => {
-      output.innerHTML += '\n❌ Error: ' + err.message + '\n';
+      output.insertAdjacentText('beforeend', '\n❌ Error: ' + err.message + '\n');
       setTimeout(scrollToBottom, 50);
     })
     .finally(() => {
@@ -79,6 +143,45 @@ function runCode() {
     });
 }
 
+// Output chunks arrive many times a second, so only scroll once per frame
+let scrollPending = false;
+
+function appendOutput(output, text) {
+  output.insertAdjacentText('beforeend', text);
+  if (!scrollPending) {
+    scrollPending = true;
+    requestAnimationFrame(() => {
+      scrollPending = false;
+      scrollToBottom();
+    });
+  }
+}
+
+function showResult(output, data) {
+  output.insertAdjacentText('beforeend', '\n' + (data.success ? '✅ ' : '❌ ') + data.output + '\n');
+  setTimeout(scrollToBottom, 50);
+}
+
+// Read server-sent events ("data: {...}" blocks) from a fetch body
+function readEvents(body, onEvent) {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let pending = '';
+  function pump() {
+    return reader.read().then(({ done, value }) => {
+      if (done) return;
+      pending += decoder.decode(value, { stream: true });
+      const blocks = pending.split('\n\n');
+      pending = blocks.pop();
+      blocks.forEach((block) => {
+        if (block.startsWith('data: ')) onEvent(JSON.parse(block.slice(6)));
+      });
+      return pump();
+    });
+  }
+  return pump();
+}
+
 function clearOutput() {
   document.getElementById('output').innerHTML = '';
 }
@@ -1,66 +1,171 @@
+import re
+import sys
+from collections import namedtuple
+
 from salt_language import KEYWORDS, OPERATORS
 
+
+# Token kinds
+NUMBER = 'number'
+STRING = 'string'
+NAME = 'name'        # identifiers that aren't keywords
+KEYWORD = 'keyword'
+OP = 'op'            # operators, parentheses, braces, brackets and comma
+
+# A token record: kind, text, and 1-based line and column of its first character
+Token = namedtuple('Token', ['kind', 'value', 'line', 'column'])
+
+_OPERATOR_CHARS = re.escape(''.join(sorted(OPERATORS)))
+
+# One match per token: any run of whitespace, comments and unknown characters
+# is skipped, then exactly one of the numbered groups captures the token.
+# The lookahead stops a comment from backtracking and leaking a token.
+TOKEN_PATTERN = re.compile(
+    r'(?:\s+|\#[^\n]*(?![^\n])|[^\w\s"\#' + _OPERATOR_CHARS + r'])*'
+    r'(?:(\d[\d.]*)'          # 1: number
+    r'|("[^"]*"?)'            # 2: string (may be unterminated)
+    r'|([^\W\d]\w*)'          # 3: identifier or keyword
+    r'|([' + _OPERATOR_CHARS + r'])'  # 4: operator
+    r'|$)'                     # trailing whitespace/comments, no token
+)
+
+# Same token shapes, but comments are matched (and dropped) as empty tokens
+# so findall can produce the token text without per-token Python work
+VALUE_PATTERN = re.compile(
+    r'\#[^\n]*|(\d[\d.]*|"[^"]*"?|[^\W\d]\w*|[' + _OPERATOR_CHARS + '])'
+)
+
+
+def classify(token):
+    """Work out the kind of a bare string token (as produced by tokenize)"""
+    if token.replace('.', '').isdigit():
+        return NUMBER
+    if token.startswith('"') and token.endswith('"'):
+        return STRING
+    if (token[0].isalpha() or token[0] == '_') and all(c.isalnum() or c == '_' for c in token):
+        return KEYWORD if token in KEYWORDS else NAME
+    return OP
+
+
+def _scan(text, tokens, line=1, column=1, hold_open=False):
+    """
+    Appends Token records for text to tokens, numbering from line/column.
+    With hold_open, a trailing unterminated string is left out and its offset
+    in text is returned so the caller can retry it with more input.
+    """
+    append = tokens.append
+    make_token = tuple.__new__  # skips the namedtuple's Python-level __new__
+    intern = sys.intern
+    keywords = KEYWORDS
+    count = text.count
+    rfind = text.rfind
+    line_start = 1 - column  # offset the current line would start at
+    scanned = 0  # newlines before this offset are already counted
+
+    for match in TOKEN_PATTERN.finditer(text):
+        group = match.lastindex
+        if group is None:
+            break
+        start = match.start(group)
+        newlines = count('\n', scanned, start)
+        if newlines:
+            line += newlines
+            line_start = rfind('\n', scanned, start) + 1
+        scanned = start
+        value = match.group(group)
+        column = start - line_start + 1
+
+        if group == 3:
+            # Interned, so every node naming the same variable, function or
+            # operator (lt, and, ...) shares one string
+            value = intern(value)
+            append(make_token(Token, (KEYWORD if value in keywords else NAME, value, line, column)))
+        elif group == 4:
+            append(make_token(Token, (OP, value, line, column)))
+        elif group == 1:
+            append(make_token(Token, (NUMBER, value, line, column)))
+        else:
+            if len(value) == 1 or value[-1] != '"':
+                if hold_open:
+                    return start
+                value += '"'
+            append(make_token(Token, (STRING, value, line, column)))
+
+    return None
+
+
+def lex(text):
+    """
+    Tokenizes Salt source in a single regex pass, returning Token records.
+    Strings keep their quotes (an unterminated string is closed at end of input).
+    """
+    tokens = []
+    _scan(text, tokens)
+    return tokens
+
+
+def lex_file(file, chunk_size=65536):
+    """
+    Lazily tokenizes an open Salt source file, yielding Token records.
+    The file is read in chunks and lexed up to the last complete line, so
+    memory stays proportional to the chunk size rather than the file size.
+    """
+    pending = ''
+    line = 1
+    column = 1
+    waiting_for_quote = False
+
+    while True:
+        chunk = file.read(chunk_size)
+        pending += chunk
+        if chunk:
+            # An open string can't finish until another quote shows up
+            if waiting_for_quote and '"' not in chunk:
+                continue
+            cut = pending.rfind('\n') + 1
+            if not cut:
+                continue
+        else:
+            cut = len(pending)
+
+        text = pending[:cut]
+        pending = pending[cut:]
+        tokens = []
+        held = _scan(text, tokens, line, column, hold_open=bool(chunk))
+        yield from tokens
+
+        if held is None:
+            waiting_for_quote = False
+            newlines = text.count('\n')
+            if newlines:
+                line += newlines
+                column = 1
+            else:
+                column += len(text)
+        else:
+            # Carry the unterminated string over and lex it with the next chunk
+            waiting_for_quote = True
+            newlines = text.count('\n', 0, held)
+            if newlines:
+                line += newlines
+                column = held - text.rfind('\n', 0, held)
+            else:
+                column += held
+            pending = text[held:] + pending
+
+        if not chunk:
+            return
+
+
 def tokenize(text):
     """
     Tokenizes a Salt expression into a list of tokens.
     Handles numbers, operators, parentheses, identifiers, make keyword, and types.
     """
-    tokens = []
-    i = 0
-    
-    while i < len(text):
-        char = text[i]
-        
-        # Skip whitespace
-        if char.isspace():
-            i += 1
-            continue
-        
-        # Handle comments (skip everything from # to end of line)
-        if char == '#':
-            while i < len(text) and text[i] != '\n':
-                i += 1
-            continue
-        
-        # Handle numbers (including decimals)
-        if char.isdigit():
-            number = ''
-            while i < len(text) and (text[i].isdigit() or text[i] == '.'):
-                number += text[i]
-                i += 1
-            tokens.append(number)
-            continue
-        
-        # Handle string literals
-        if char == '"':
-            string_value = ''
-            i += 1  # Skip opening quote
-            while i < len(text) and text[i] != '"':
-                string_value += text[i]
-                i += 1
-            if i < len(text):  # Skip closing quote
-                i += 1
-            tokens.append(f'"{string_value}"')
-            continue
-        
-        # Handle identifiers, keywords, and variable names
-        if char.isalpha() or char == '_':
-            identifier = ''
-            while i < len(text) and (text[i].isalnum() or text[i] == '_'):
-                identifier += text[i]
-                i += 1
-            tokens.append(identifier)
-            continue
-        
-        # Handle operators, parentheses, braces, and comma
-        if char in OPERATORS:
-            tokens.append(char)
-            i += 1
-            continue
-        
-        # Skip unknown characters for now
-        i += 1
-    
+    tokens = [token for token in VALUE_PATTERN.findall(text) if token]
+    # Close any unterminated string (only the last token can be one)
+    if tokens and tokens[-1][0] == '"' and (len(tokens[-1]) == 1 or tokens[-1][-1] != '"'):
+        tokens[-1] += '"'
     return tokens
 
 
@@ -79,6 +184,10 @@ def test_tokenizer():
     for test in test_cases:
         tokens = tokenize(test)
         print(f"'{test}' -> {tokens}")
+    
+    print("\nTyped tokens with positions:")
+    for token in lex("make int x 5\nprint \"x is \" x"):
+        print(f"  {token.line}:{token.column} {token.kind} {token.value}")
 
 
 if __name__ == "__main__":
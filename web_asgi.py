@@ -0,0 +1,407 @@
+"""
+asyncio (ASGI) version of the Salt web app
+
+The same routes and JSON as web_interface.py, for an ASGI server:
+
+    uvicorn web_asgi:app --port 5000
+
+Requests are handled on the event loop and programs run on a SaltPool through
+a bounded thread executor, so a slow client only holds a coroutine, not a
+worker. Before a program runs the request has to be admitted:
+
+- a client (by IP) can have PER_CLIENT programs running or waiting; more
+  gets 429. Behind a reverse proxy listed in TRUSTED_PROXIES the client's IP
+  comes from X-Forwarded-For
+- MAX_RUNNING programs run at once and MAX_WAITING more can wait, for at most
+  QUEUE_TIMEOUT seconds; past either limit the answer is 503 with Retry-After.
+  A batch counts as one program per pool worker it uses
+- request bodies over MAX_BODY bytes get 413
+
+/check only parses, so it skips admission and runs on its own CHECK_THREADS
+threads instead of waiting behind programs.
+"""
+
+import asyncio
+import ipaddress
+import json
+import mimetypes
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from salt_check import CheckSessions
+from salt_pool import SaltPool, PoolBusy, WORKERS, MAX_BATCH
+
+MAX_RUNNING = WORKERS  # Programs running at once, one per pool worker
+MAX_WAITING = 64  # Requests waiting for a turn
+QUEUE_TIMEOUT = 10.0  # Seconds a request waits before it's turned away
+PER_CLIENT = 4  # Programs one client can have running or waiting
+MAX_BODY = 1024 * 1024  # Bytes in a request body
+RETRY_AFTER = 2  # Seconds, sent with a 503
+CHECK_THREADS = 2  # Threads for /check
+
+# Proxies (addresses or networks) whose X-Forwarded-For is believed. From
+# anyone else the header is ignored, since a client can put anything in it.
+TRUSTED_PROXIES = ('127.0.0.1', '::1')
+TRUSTED_NETWORKS = [ipaddress.ip_network(proxy) for proxy in TRUSTED_PROXIES]
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+
+BUSY_MESSAGE = 'Server busy: too many programs running, try again shortly'
+
+
+class Rejected(Exception):
+    """A request that gets an error response instead of running"""
+
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = list(headers)
+
+
+class Admission:
+    """Concurrency limits: who gets to run a program now, who waits and who's turned away
+
+    Each request is admitted with a weight: the pool workers it will keep
+    busy (1 for a program, more for a batch). At most max_running workers'
+    worth runs at once, and a client's weights count against per_client.
+    """
+
+    def __init__(self, max_running=MAX_RUNNING, max_waiting=MAX_WAITING,
+                 per_client=PER_CLIENT, queue_timeout=QUEUE_TIMEOUT):
+        self.max_running = max_running
+        self.max_waiting = max_waiting
+        self.per_client = per_client
+        self.queue_timeout = queue_timeout
+        self.queue = deque()  # (weight, future) for each waiting request, first come first served
+        self.waiting = 0
+        self.active = 0  # Weight of the requests running now
+        self.clients = {}  # Client -> weight it has running or waiting
+        self.admitted = 0
+        self.rejected = 0
+
+    async def __call__(self, client, weight=1):
+        """Wait for a turn to run; returns a function that gives it back"""
+        weight = max(1, min(weight, self.max_running))
+        charge = min(weight, self.per_client)  # So one batch by itself always fits
+        if self.clients.get(client, 0) + charge > self.per_client:
+            self.rejected += 1
+            raise Rejected(429, f'Too many programs from you at once (at most {self.per_client})')
+        must_wait = bool(self.queue) or self.active + weight > self.max_running
+        if must_wait and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Rejected(503, BUSY_MESSAGE, [('retry-after', str(RETRY_AFTER))])
+
+        self.clients[client] = self.clients.get(client, 0) + charge
+        if must_wait:
+            future = asyncio.get_running_loop().create_future()
+            self.queue.append((weight, future))
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(future, self.queue_timeout)
+            except asyncio.TimeoutError:
+                if not future.done() or future.cancelled():
+                    self.leave(client, charge)
+                    self.rejected += 1
+                    self.wake()  # Smaller requests behind this one may fit now
+                    raise Rejected(503, BUSY_MESSAGE, [('retry-after', str(RETRY_AFTER))])
+            except BaseException:
+                if future.done() and not future.cancelled():
+                    self.active -= weight  # Admitted just as it was cancelled
+                self.leave(client, charge)
+                self.wake()
+                raise
+            finally:
+                self.waiting -= 1
+        else:
+            self.active += weight
+        self.admitted += 1
+
+        def release():
+            self.active -= weight
+            self.leave(client, charge)
+            self.wake()
+        return release
+
+    def wake(self):
+        """Admit waiting requests, in order, while there's room for the next one"""
+        queue = self.queue
+        while queue:
+            weight, future = queue[0]
+            if future.done():
+                queue.popleft()  # Timed out or cancelled
+            elif self.active + weight <= self.max_running:
+                queue.popleft()
+                self.active += weight
+                future.set_result(None)
+            else:
+                break
+
+    def leave(self, client, charge):
+        count = self.clients[client] - charge
+        if count:
+            self.clients[client] = count
+        else:
+            del self.clients[client]
+
+    def stats(self):
+        return {
+            'running': self.active,
+            'waiting': self.waiting,
+            'clients': len(self.clients),
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+        }
+
+
+class SaltApp:
+    """The ASGI application"""
+
+    def __init__(self):
+        self.pool = None
+        self.admission = None
+        self.starting = asyncio.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=MAX_RUNNING)
+        self.check_executor = ThreadPoolExecutor(max_workers=CHECK_THREADS)
+        self.check_sessions = CheckSessions()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.handle(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Start the worker processes before the first request comes in
+                await self.get_pool()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.pool is not None:
+                    self.pool.close()
+                self.executor.shutdown(wait=False)
+                self.check_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def get_pool(self):
+        async with self.starting:
+            if self.admission is None:
+                self.admission = Admission()
+            if self.pool is None:
+                self.pool = await self.offload(SaltPool)
+        return self.pool
+
+    async def offload(self, function, *args):
+        """Run a blocking call on the executor"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def handle(self, scope, receive, send):
+        path = scope['path']
+        method = scope['method']
+        try:
+            if path == '/' and method in ('GET', 'HEAD'):
+                await send_response(send, 200, render_index(), 'text/html; charset=utf-8')
+            elif path.startswith('/static/') and method in ('GET', 'HEAD'):
+                await self.static(send, path[len('/static/'):])
+            elif path == '/run' and method == 'POST':
+                await self.run(scope, receive, send)
+            elif path == '/run_stream' and method == 'POST':
+                await self.run_stream(scope, receive, send)
+            elif path == '/run_batch' and method == 'POST':
+                await self.run_batch(scope, receive, send)
+            elif path == '/check' and method == 'POST':
+                await self.check(receive, send)
+            elif path == '/stats' and method == 'GET':
+                pool = await self.get_pool()
+                await send_json(send, 200, {**pool.cache_stats(), 'admission': self.admission.stats()})
+            else:
+                await send_json(send, 404, {'error': 'Not found'})
+        except Rejected as e:
+            if path in ('/run', '/run_stream'):
+                body = {'output': str(e), 'success': False}
+            else:
+                body = {'error': str(e)}
+            await send_json(send, e.status, body, e.headers)
+
+    async def static(self, send, name):
+        path = os.path.realpath(os.path.join(STATIC_DIR, name))
+        if not path.startswith(STATIC_DIR + os.sep) or not os.path.isfile(path):
+            raise Rejected(404, 'Not found')
+        with open(path, 'rb') as f:
+            body = f.read()
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        await send_response(send, 200, body, content_type)
+
+    async def admit(self, scope, weight=1):
+        await self.get_pool()
+        return await self.admission(client_address(scope), weight)
+
+    async def run(self, scope, receive, send):
+        data = await read_json(receive)
+        code = data.get('code') if isinstance(data, dict) else None
+        if not isinstance(code, str):
+            raise Rejected(400, "Expected JSON with a 'code' string")
+        release = await self.admit(scope)
+        try:
+            output, success = await self.offload(self.pool.run, code)
+        except PoolBusy:
+            raise Rejected(503, BUSY_MESSAGE, [('retry-after', str(RETRY_AFTER))])
+        except Exception as e:
+            output, success = f'Server error: {str(e)}', False
+        finally:
+            release()
+        await send_json(send, 200, {'output': output, 'success': success})
+
+    async def run_stream(self, scope, receive, send):
+        data = await read_json(receive)
+        code = data.get('code') if isinstance(data, dict) else None
+        if not isinstance(code, str):
+            raise Rejected(400, "Expected JSON with a 'code' string")
+        release = await self.admit(scope)
+        try:
+            try:
+                stream = self.pool.stream(code)
+            except PoolBusy:
+                raise Rejected(503, BUSY_MESSAGE, [('retry-after', str(RETRY_AFTER))])
+            disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+            try:
+                await send({
+                    'type': 'http.response.start',
+                    'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')],
+                })
+                while not disconnected.done():
+                    event = await self.offload(next, stream, None)
+                    if event is None:
+                        break
+                    if event[0] == 'output':
+                        data = {'output': event[1]}
+                    else:
+                        data = {'done': True, 'output': event[1], 'success': event[2]}
+                    await send({'type': 'http.response.body', 'body': f"data: {json.dumps(data)}\n\n".encode(),
+                                'more_body': True})
+                await send({'type': 'http.response.body', 'body': b''})
+            finally:
+                disconnected.cancel()
+                # Stops the program if the client went away part way
+                await self.offload(stream.close)
+        finally:
+            release()
+
+    async def run_batch(self, scope, receive, send):
+        data = await read_json(receive)
+        programs = data.get('programs') if isinstance(data, dict) else None
+        if not isinstance(programs, list) or not all(isinstance(code, str) for code in programs):
+            raise Rejected(400, "'programs' must be a list of strings")
+        if len(programs) > MAX_BATCH:
+            raise Rejected(400, f'A batch can have at most {MAX_BATCH} programs')
+        await self.get_pool()
+        release = await self.admit(scope, self.pool.batch_width(len(programs)))
+        try:
+            start = time.perf_counter()
+            results = await self.offload(self.pool.run_batch, programs)
+        finally:
+            release()
+        await send_json(send, 200, {
+            'results': [{'output': output, 'success': success, 'time': round(seconds, 6)}
+                        for output, success, seconds in results],
+            'time': round(time.perf_counter() - start, 6),
+        })
+
+
+    async def check(self, receive, send):
+        data = await read_json(receive)
+        code = data.get('code') if isinstance(data, dict) else None
+        session = data.get('session') if isinstance(data, dict) else None
+        if not isinstance(code, str) or not isinstance(session, (str, type(None))):
+            raise Rejected(400, "Expected JSON with a 'code' string and an optional 'session' string")
+        result = await asyncio.get_running_loop().run_in_executor(
+            self.check_executor, self.check_sessions.check, session, code)
+        await send_json(send, 200, result)
+
+
+def is_trusted_proxy(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_NETWORKS)
+
+
+def client_address(scope):
+    """The client's IP: the connection's, or from X-Forwarded-For if that's a trusted proxy"""
+    client = scope.get('client')
+    address = client[0] if client else 'unknown'
+    if not is_trusted_proxy(address):
+        return address
+    forwarded = [value.decode('latin-1') for name, value in scope.get('headers', ()) if name == b'x-forwarded-for']
+    hops = [hop.strip() for hop in ','.join(forwarded).split(',') if hop.strip()]
+    # Each proxy appends the address it got the request from, so the right-most
+    # hop that isn't one of our proxies is the client; anything left of it
+    # came from the client and can't be believed
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else address
+
+
+async def read_json(receive):
+    """The request body as JSON, refusing bodies over MAX_BODY"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise Rejected(400, 'Client disconnected')
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY:
+            raise Rejected(413, f'Request body is over {MAX_BODY} bytes')
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            break
+    try:
+        return json.loads(b''.join(chunks))
+    except ValueError:
+        raise Rejected(400, 'Request body is not valid JSON')
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_response(send, status, body, content_type, headers=()):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]
+                   + [(name.encode(), value.encode()) for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, status, data, headers=()):
+    await send_response(send, status, json.dumps(data), 'application/json', headers)
+
+
+# The template only uses url_for for static files
+STATIC_URL = re.compile(r"\{\{\s*url_for\('static',\s*filename='([^']+)'\)\s*\}\}")
+
+
+def render_index():
+    with open(os.path.join(TEMPLATE_DIR, 'index.html'), encoding='utf-8') as f:
+        return STATIC_URL.sub(lambda match: '/static/' + match.group(1), f.read())
+
+
+app = SaltApp()
@@ -1,8 +1,28 @@
-from flask import Flask, render_template, request, jsonify
-from web_interpreter import run_salt_code
+import json
+import threading
+import time
+
+from flask import Flask, Response, render_template, request, jsonify
+from salt_check import CheckSessions
+from salt_pool import SaltPool, PoolBusy, MAX_BATCH
 
 app = Flask(__name__)
 
+# Programs run in sandboxed worker processes, started on the first /run
+pool = None
+pool_lock = threading.Lock()
+
+# Syntax checks run right here (they only parse), with a Checker per editor session
+check_sessions = CheckSessions()
+
+
+def get_pool():
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = SaltPool()
+    return pool
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -12,13 +32,80 @@ def run_code():
     try:
         code = request.json['code']
         
-        # Run the Salt code using our web interpreter
-        output, success = run_salt_code(code)
+        # Run the Salt code in a worker process with time and memory limits
+        output, success = get_pool().run(code)
         
         return jsonify({'output': output, 'success': success})
         
+    except PoolBusy:
+        return jsonify({'output': 'Server busy: too many programs running, try again shortly', 'success': False}), 503
+    except Exception as e:
+        return jsonify({'output': f'Server error: {str(e)}', 'success': False})
+
+@app.route('/run_stream', methods=['POST'])
+def run_code_stream():
+    """Like /run, but sends output as server-sent events while the program prints"""
+    try:
+        code = request.json['code']
+        stream = get_pool().stream(code)
+    except PoolBusy:
+        return jsonify({'output': 'Server busy: too many programs running, try again shortly', 'success': False}), 503
     except Exception as e:
         return jsonify({'output': f'Server error: {str(e)}', 'success': False})
 
+    def events():
+        # {"output": text} for each chunk, then {"done": true, "output": message, "success": ...}
+        for event in stream:
+            if event[0] == 'output':
+                data = {'output': event[1]}
+            else:
+                data = {'done': True, 'output': event[1], 'success': event[2]}
+            yield f"data: {json.dumps(data)}\n\n"
+
+    response = Response(events(), mimetype='text/event-stream')
+    # Closing the response (e.g. the browser went away) stops the program
+    response.call_on_close(stream.close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let a proxy hold chunks back
+    return response
+
+@app.route('/run_batch', methods=['POST'])
+def run_batch():
+    """Run a list of programs at once: {"programs": [code, ...]}"""
+    try:
+        programs = request.json['programs']
+        if not isinstance(programs, list) or not all(isinstance(code, str) for code in programs):
+            return jsonify({'error': "'programs' must be a list of strings"}), 400
+        if len(programs) > MAX_BATCH:
+            return jsonify({'error': f'A batch can have at most {MAX_BATCH} programs'}), 400
+        
+        start = time.perf_counter()
+        results = get_pool().run_batch(programs)
+        
+        # Results are in the same order as the programs
+        return jsonify({
+            'results': [{'output': output, 'success': success, 'time': round(seconds, 6)}
+                        for output, success, seconds in results],
+            'time': round(time.perf_counter() - start, 6),
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/check', methods=['POST'])
+def check_code():
+    """Every syntax error in {"code": ..., "session": id}; the session's last buffer is reused"""
+    data = request.json
+    code = data.get('code') if isinstance(data, dict) else None
+    session = data.get('session') if isinstance(data, dict) else None
+    if not isinstance(code, str) or not isinstance(session, (str, type(None))):
+        return jsonify({'error': "Expected JSON with a 'code' string and an optional 'session' string"}), 400
+    return jsonify(check_sessions.check(session, code))
+
+@app.route('/stats')
+def stats():
+    # Parsed-program cache hit rate and size, over all workers
+    return jsonify(get_pool().cache_stats())
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000) 
\ No newline at end of file
@@ -1,53 +1,166 @@
 from interpreter import Interpreter
-from math_parser import Parser, PrintNode, ArrayNode
-from tokenizer import tokenize
+from math_parser import Parser, ArrayNode
+from tokenizer import lex
+from optimizer import optimize
+from program_cache import ProgramCache
 import io
 import sys
+import threading
+
+# Most output a program can print before it's cut off
+MAX_OUTPUT_BYTES = 1024 * 1024
+
+# Budgets for a program run from the web. The time limit is under the pool's
+# timeout so a long program gets a clean error instead of its worker killed.
+MAX_STEPS = 50000000  # Loop iterations and function calls
+MAX_TIME = 4.0  # Seconds
+MAX_ARRAY_ELEMENTS = 10000000  # Array elements, all arrays together
+MAX_STRING_LENGTH = 10000000  # Characters in one string
+
+# Streamed output is sent once this many bytes pile up, or this often
+CHUNK_BYTES = 8192
+FLUSH_INTERVAL = 0.1
+
+class OutputLimitExceeded(Exception):
+    """The program printed more than MAX_OUTPUT_BYTES"""
+
+class CappedOutput:
+    """Output sink for web programs: passes lines to send, stopping the program once it's printed too much"""
+
+    def __init__(self, send, max_output=MAX_OUTPUT_BYTES):
+        self.send = send
+        self.max_output = max_output
+        self.bytes = 0
+        self.truncated = False
+
+    def write(self, line):
+        size = len(line.encode('utf-8', 'replace')) + 1  # With its newline
+        if self.bytes + size > self.max_output:
+            room = self.max_output - self.bytes - 1  # Leave space for the newline
+            if room > 0:
+                self.send(line.encode('utf-8', 'replace')[:room].decode('utf-8', 'ignore'))
+            self.bytes = self.max_output
+            self.truncated = True
+            raise OutputLimitExceeded(f"Output cut off: a program can print at most {self.max_output} bytes")
+        self.bytes += size
+        self.send(line)
+
+    def flush(self):
+        pass
 
 class WebInterpreter(Interpreter):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, output=None, max_output=MAX_OUTPUT_BYTES):
         self.output_buffer = []
-    
-    def evaluate(self, node):
-        """Override evaluate to capture print output"""
-        if isinstance(node, PrintNode):
-            # Capture print output
-            values = []
-            for expr in node.expressions:
-                value = self.evaluate(expr)
-                values.append(str(value))
-            
-            result = ''.join(values)
-            self.output_buffer.append(result)
-            return result
-        else:
-            return super().evaluate(node)
-
-def run_salt_code(code):
+        # output is called with each printed line; keeps them in output_buffer by default
+        sink = CappedOutput(output if output is not None else self.output_buffer.append, max_output)
+        super().__init__(max_steps=MAX_STEPS, max_time=MAX_TIME, max_array_elements=MAX_ARRAY_ELEMENTS,
+                         max_string_length=MAX_STRING_LENGTH, output=sink)
+
+class ChunkWriter:
+    """Batches printed lines and sends them on as text chunks
+
+    A chunk goes out when CHUNK_BYTES have piled up, and a background thread
+    sends whatever is waiting every FLUSH_INTERVAL seconds, so output shows
+    up even while the program is busy computing.
+    """
+
+    def __init__(self, send, chunk_bytes=CHUNK_BYTES, interval=FLUSH_INTERVAL):
+        self.send = send
+        self.chunk_bytes = chunk_bytes
+        self.interval = interval
+        self.lines = []
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_periodically, daemon=True)
+        self.flusher.start()
+
+    def write(self, line):
+        with self.lock:
+            self.lines.append(line)
+            self.size += len(line) + 1
+            if self.size >= self.chunk_bytes:
+                self.flush()
+
+    def flush(self):
+        # Callers hold self.lock
+        if self.lines:
+            self.send('\n'.join(self.lines) + '\n')
+            self.lines = []
+            self.size = 0
+
+    def flush_periodically(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                self.flush()
+
+    def close(self):
+        """Stop the background thread and send what's left"""
+        self.stopped.set()
+        self.flusher.join()
+        with self.lock:
+            self.flush()
+
+# Parsed programs, shared by every run in this process
+PROGRAM_CACHE = ProgramCache()
+
+
+def parse_program(code):
+    """Parse a whole program into (statements, error)
+
+    error is the message for a syntax error after the statements that did
+    parse, or None. Those statements still run first, like they would if the
+    program were parsed and run one statement at a time.
+    """
+    statements = []
+    try:
+        # statements() skips a stray top-level '}' (parse_statement alone
+        # would return None on it forever without moving past it)
+        for statement in Parser(lex(code)).statements():
+            statements.append(optimize(statement))
+    except Exception as e:
+        return statements, f"Error: {str(e)}"
+    return statements, None
+
+
+def load_program(code, cache):
+    """The parsed program for this source, from the cache if it's there"""
+    program = cache.get(code) if cache is not None else None
+    if program is None:
+        program = parse_program(code)
+        if cache is not None:
+            cache.put(code, program)
+    return program
+
+
+def run_program(interpreter, code, cache):
+    """Run code on interpreter; returns the error that stopped it, or None"""
+    # Only tokenizing and parsing are cached; every run executes fresh
+    statements, parse_error = load_program(code, cache)
+    for statement in statements:
+        try:
+            interpreter.execute(statement)
+        except OutputLimitExceeded as e:
+            return str(e)
+        except MemoryError:
+            return "Error: Program ran out of memory"
+        except Exception as e:
+            return f"Error: {str(e)}"
+    return parse_error
+
+
+def run_salt_code(code, cache=PROGRAM_CACHE, max_output=MAX_OUTPUT_BYTES):
     """Run Salt code and return output"""
     try:
-        # Parse the code using the same strategy as the main interpreter
-        tokens = tokenize(code)
-        parser = Parser(tokens)
-        
-        # Create interpreter and run
-        interpreter = WebInterpreter()
-        
-        # Parse and execute statements one by one, just like the main interpreter
-        while parser.position < len(tokens):
-            statement = parser.parse_statement()
-            if statement is not None:
-                try:
-                    result = interpreter.evaluate(statement)
-                    if result is not None and result not in [interpreter.SKIP, interpreter.END]:
-                        # Don't print None results or control flow objects
-                        pass
-                except Exception as e:
-                    return f"Error: {str(e)}", False
+        interpreter = WebInterpreter(max_output=max_output)
+        error = run_program(interpreter, code, cache)
         
         # Combine all output
         output = '\n'.join(interpreter.output_buffer)
+        if interpreter.output.truncated:
+            return output + '\n' + error, False
+        if error is not None:
+            return error, False
         if not output:
             output = "Code executed successfully (no output)"
         
@@ -56,6 +169,27 @@ def run_salt_code(code):
     except Exception as e:
         return f"Error: {str(e)}", False
 
+
+def stream_salt_code(code, send, cache=PROGRAM_CACHE, max_output=MAX_OUTPUT_BYTES):
+    """Run Salt code, calling send(text) with batches of output as it prints
+
+    Returns (message, success) once the program is done: the error that
+    stopped it, or a short note if it finished.
+    """
+    writer = ChunkWriter(send)
+    try:
+        interpreter = WebInterpreter(output=writer.write, max_output=max_output)
+        error = run_program(interpreter, code, cache)
+    except Exception as e:
+        error = f"Error: {str(e)}"
+    finally:
+        writer.close()
+    if error is not None:
+        return error, False
+    if not interpreter.output.bytes:
+        return "Code executed successfully (no output)", True
+    return "Code executed successfully", True
+
 if __name__ == "__main__":
     # Test the web interpreter
     test_code = """